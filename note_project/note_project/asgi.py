@@ -13,4 +13,8 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "note_project.settings")
 
+# Under ASGI the hot note endpoints are served by the async-native views in
+# notes/async_views.py. Set NOTES_ASYNC_VIEWS=0 to fall back to the sync ones.
+os.environ.setdefault("NOTES_ASYNC_VIEWS", "1")
+
 application = get_asgi_application()
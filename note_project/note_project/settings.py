@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/4.2/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -44,6 +45,12 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # Only active when NOTES_METRICS is enabled
+    "notes.metrics.MetricsMiddleware",
+    # Only active when NOTES_PROFILE_SAMPLE_RATE or NOTES_PROFILE_SLOW_MS is set
+    "notes.profiling.ProfilingMiddleware",
+    # Only active when NOTES_READ_REPLICAS is set
+    "notes.routers.ReplicaRoutingMiddleware",
     "django.middleware.security.SecurityMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
@@ -89,6 +96,50 @@ DATABASES = {
     }
 }
 
+# Read replica. By default a second, read-only connection to the primary
+# database, so replica routing can be tried on one Postgres instance; point
+# NOTES_REPLICA_HOST at a streaming replica in production. Tests read it as
+# a mirror of the test database (a separate connection, which does not see
+# uncommitted test data, much like a lagging replica).
+DATABASES['replica'] = {
+    **DATABASES['default'],
+    'HOST': os.environ.get('NOTES_REPLICA_HOST', DATABASES['default']['HOST']),
+    'PORT': os.environ.get('NOTES_REPLICA_PORT', DATABASES['default']['PORT']),
+    'OPTIONS': {'options': '-c default_transaction_read_only=on'},
+    'TEST': {'MIRROR': 'default'},
+}
+
+DATABASE_ROUTERS = ['notes.routers.ReplicaRouter']
+
+# Aliases that the reads of GET requests are spread over (e.g.
+# NOTES_READ_REPLICAS=replica); empty sends every query to default. A user's
+# reads stay on default for NOTES_REPLICA_STICKY_SECONDS after a write that
+# concerns them, which should exceed the replicas' usual lag.
+NOTES_READ_REPLICAS = [alias for alias in os.environ.get('NOTES_READ_REPLICAS', '').split(',') if alias]
+NOTES_REPLICA_STICKY_SECONDS = 10
+
+# Cache
+# https://docs.djangoproject.com/en/4.2/topics/cache/
+
+# The "notes" cache holds per-user note listings and their version counters.
+# Local memory works for a single process and in tests; point it at a shared
+# backend (Redis, Memcached) when running several workers.
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'notes': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'notes',
+        'TIMEOUT': 300,
+        'OPTIONS': {
+            'MAX_ENTRIES': 10000,
+        },
+    },
+}
+
+NOTES_CACHE_ALIAS = 'notes'
+
 # Password validation
 # https://docs.djangoproject.com/en/4.2/ref/settings/#auth-password-validators
 
@@ -130,85 +181,119 @@ STATIC_URL = "static/"
 
 DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
 
-# REST FRAMEWORK Authentication Settings
+# REST FRAMEWORK Settings
+# Kept in a single dict: assigning REST_FRAMEWORK more than once silently
+# discards every earlier block.
 REST_FRAMEWORK = {
+
+    # Authentication
     'DEFAULT_AUTHENTICATION_CLASSES': [
         'rest_framework.authentication.BasicAuthentication',
         'rest_framework.authentication.TokenAuthentication',
         'rest_framework.authentication.SessionAuthentication',
-    ]
-}
+    ],
 
-# REST FRAMEWORK Permission Settings
-REST_FRAMEWORK = {
+    # Permissions
     'DEFAULT_PERMISSION_CLASSES': [
         'rest_framework.permissions.IsAuthenticated',
-    ]
-}
-
-# REST FRAMEWORK Pagination Settings
-REST_FRAMEWORK = {
-    'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.LimitOffsetPagination',
-    'PAGE_SIZE': 100
-}
-
-# REST FRAMEWORK Throttling Settings
-REST_FRAMEWORK = {
-
-    'DEFAULT_THROTTLE_CLASSES': [
-
-        'rest_framework.throttling.AnonRateThrottle',
-
-        'rest_framework.throttling.UserRateThrottle'
-
     ],
 
-    'DEFAULT_THROTTLE_RATES': {
-
-        'anon': '2/min',
-
-        'user': '4/min'
-
-    }
-
-}
-
-# Multiple user rate throttle
-REST_FRAMEWORK = {
+    # Pagination
+    'DEFAULT_PAGINATION_CLASS': 'notes.pagination.NoteCursorPagination',
+    'PAGE_SIZE': 100,
 
+    # Scoped rate throttle (token bucket, shared across workers via the
+    # notes_throttlebucket table). Views pick a rate with throttle_scope.
     'DEFAULT_THROTTLE_CLASSES': [
-
-        'notes.throttles.HighRateThrottle',
-
-        'notes.throttles.LowRateThrottle',
-
+        'notes.throttles.ScopedGCRAThrottle'
     ],
-
     'DEFAULT_THROTTLE_RATES': {
-
-        'high': '30/minute',
-
-        'low': '4/minute'
-
+        'high': '120/minute',
+        'low': '30/minute'
     }
-
 }
 
-# Scoped rate throttle
-REST_FRAMEWORK = {
-
-    'DEFAULT_THROTTLE_CLASSES': [
-
-        "rest_framework.throttling.ScopedRateThrottle"
-
-    ],
-
-    'DEFAULT_THROTTLE_RATES': {
-
-        'high': '30/day',
-
-        'low': '4/day'
-
-    }
-
-}
\ No newline at end of file
+# Upper bound for the ?page_size= query parameter on paginated note listings
+NOTES_MAX_PAGE_SIZE = 500
+
+# Length of the content snippet returned by ?view=summary listings
+NOTES_SNIPPET_LENGTH = 200
+
+# Search results ranked below this are dropped, and their highlighted
+# snippets are cut to around this many words
+NOTES_SEARCH_MIN_RANK = 0.01
+NOTES_SEARCH_HEADLINE_WORDS = 35
+
+# Seconds a page of search result ids stays cached; entries are dropped
+# sooner whenever the user's visible notes change
+NOTES_SEARCH_CACHE_TIMEOUT = 300
+
+# Title autocomplete: shortest prefix looked up, default and largest number
+# of suggestions, and how long (seconds) a prefix's suggestions are cached
+NOTES_AUTOCOMPLETE_MIN_LENGTH = 3
+NOTES_AUTOCOMPLETE_LIMIT = 10
+NOTES_AUTOCOMPLETE_MAX_LIMIT = 25
+NOTES_AUTOCOMPLETE_CACHE_TIMEOUT = 30
+
+# Rows fetched per round trip (and per streamed chunk) by /api/notes/export/
+NOTES_EXPORT_CHUNK_SIZE = 2000
+
+# Notes inserted per bulk_create by the NDJSON importer, and how many
+# per-line errors an import report keeps
+NOTES_IMPORT_BATCH_SIZE = 2000
+NOTES_IMPORT_MAX_REPORTED_ERRORS = 100
+
+# Serve the notes list/detail/share/search endpoints from async-native views.
+# note_project/asgi.py turns this on; WSGI deployments keep the sync views.
+NOTES_ASYNC_VIEWS = os.environ.get('NOTES_ASYNC_VIEWS', '0') == '1'
+
+# Delta sync (/api/notes/sync/): default changes per page, how many seconds
+# recent writes are held back so ones committing late are not skipped (keep
+# it above the longest transaction writing notes), and days tombstones of
+# removed notes are kept; older cursors must start a full sync again
+NOTES_SYNC_PAGE_SIZE = 100
+NOTES_SYNC_SETTLE_SECONDS = 2
+NOTES_SYNC_TOMBSTONE_DAYS = 30
+
+# Background tasks (manage.py run_worker): seconds a claimed task is hidden
+# from other workers before it is retried as abandoned, attempts before a
+# task is marked failed, base of the exponential retry delay (seconds), how
+# often idle workers poll, and notes handled per transaction by tasks
+NOTES_TASK_VISIBILITY_TIMEOUT = 300
+NOTES_TASK_MAX_ATTEMPTS = 5
+NOTES_TASK_RETRY_DELAY = 10
+NOTES_TASK_POLL_INTERVAL = 1
+NOTES_TASK_BATCH_SIZE = 1000
+
+# Seconds between runs of the periodic task deleting drained throttle buckets
+NOTES_THROTTLE_PURGE_INTERVAL = 3600
+
+# Django admin: the note changelist shows the planner's row estimate instead
+# of running COUNT(*) when more rows than this are expected
+NOTES_ADMIN_EXACT_COUNT_LIMIT = 100000
+
+# Upper bound on ids / operations accepted by a single /api/notes/batch/ call
+NOTES_BATCH_MAX_OPERATIONS = 1000
+
+# Bulk user provisioning: accounts per /api/auth/register/bulk/ request and
+# processes hashing passwords (None = one per CPU)
+NOTES_PROVISION_MAX_USERS = 5000
+NOTES_PROVISION_HASH_WORKERS = None
+
+# Per-route timing histograms, Server-Timing headers and /api/metrics/
+# (Prometheus text format). Set NOTES_METRICS_TOKEN to require
+# "Authorization: Bearer <token>" from scrapers.
+NOTES_METRICS = os.environ.get('NOTES_METRICS', '0') == '1'
+NOTES_METRICS_TOKEN = os.environ.get('NOTES_METRICS_TOKEN', '')
+
+# Request profiling: cProfile a random fraction of requests and keep stack
+# samples of requests slower than NOTES_PROFILE_SLOW_MS (0 = off), with their
+# SQL. Only the newest NOTES_PROFILE_MAX_FILES profiles are kept on disk and
+# staff can read them at /api/profiles/. NOTES_PROFILE_ROUTES limits
+# profiling to the named routes (comma separated, empty = all).
+NOTES_PROFILE_SAMPLE_RATE = float(os.environ.get('NOTES_PROFILE_SAMPLE_RATE', '0'))
+NOTES_PROFILE_SLOW_MS = int(os.environ.get('NOTES_PROFILE_SLOW_MS', '0'))
+NOTES_PROFILE_ROUTES = [route for route in os.environ.get('NOTES_PROFILE_ROUTES', '').split(',') if route]
+NOTES_PROFILE_DIR = os.environ.get('NOTES_PROFILE_DIR', str(BASE_DIR / 'profiles'))
+NOTES_PROFILE_MAX_FILES = 200
+NOTES_PROFILE_STACK_INTERVAL_MS = 10
@@ -0,0 +1,11 @@
+from django.urls import path
+from .async_views import AsyncNotesAPI, AsyncNoteDetailAPI, AsyncNoteShareAPI, AsyncNoteSearchAPI
+
+# Async-native versions of the hot note endpoints, mounted ahead of the sync
+# ones in notes/urls.py when NOTES_ASYNC_VIEWS is enabled (ASGI deployments)
+urlpatterns = [
+    path('notes/', AsyncNotesAPI.as_view(), name='note-list'), # View or create notes
+    path('notes/<int:id>/', AsyncNoteDetailAPI.as_view(), name='note-detail'), # View, update or delete a note
+    path('notes/<int:id>/share/', AsyncNoteShareAPI.as_view(), name='note-share'), # Share a note
+    path('search/', AsyncNoteSearchAPI.as_view(), name='note-search'), # Search notes
+]
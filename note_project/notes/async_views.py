@@ -0,0 +1,315 @@
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.db.models import Prefetch
+from django.http import HttpResponse
+from django.views import View
+from rest_framework import exceptions, serializers, status
+from rest_framework.authtoken.models import Token
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from rest_framework.settings import api_settings
+
+from .cache import abump_notes_version, aget_or_build, alisting_cache_key, anote_audience, asearch_cache_key
+from .metrics import timed_serialization
+from .etags import if_match_fails, if_none_match, listing_etag, note_etag
+from .models import Note
+from .pagination import NoteCursorPagination, NoteSearchPagination
+from .serializers import NoteSerializer, NoteBatchCreateSerializer, note_data
+from .views import NoteListMixin, normalize_query, order_by_ids, visible_to
+
+
+def shared_with_ids():
+    return Prefetch('shared_with', queryset=User.objects.only('id').order_by('id'))
+
+
+class AsyncAPIView(View):
+    """
+    Async counterpart of the DRF ``APIView`` used by the notes API.
+
+    Token authentication and throttling are awaited in ``dispatch`` and the
+    handlers use the async ORM, so a worker running under ASGI keeps serving
+    other requests while queries are in flight. Request parsing and response
+    rendering reuse DRF's parsers and ``JSONRenderer``, so payloads match the
+    sync views. Headers that throttles put in ``self.headers`` are added to
+    every response, as ``APIView.finalize_response`` does.
+    """
+    throttle_scope = None
+
+    @classmethod
+    def as_view(cls, **initkwargs):
+        # Token authentication is never sent implicitly by browsers, so like
+        # DRF's APIView the views are exempt from session CSRF checks
+        view = super().as_view(**initkwargs)
+        view.csrf_exempt = True
+        return view
+
+    async def dispatch(self, request, *args, **kwargs):
+        request = Request(request, parsers=[parser() for parser in api_settings.DEFAULT_PARSER_CLASSES])
+        self.headers = {}
+
+        try:
+            request.user = await self.authenticate(request)
+            await self.check_throttles(request)
+            response = await super().dispatch(request, *args, **kwargs)
+
+        # Same status codes, headers and messages as DRF's exception handler
+        except exceptions.APIException as e:
+            headers = {}
+            if isinstance(e, (exceptions.NotAuthenticated, exceptions.AuthenticationFailed)):
+                headers['WWW-Authenticate'] = 'Token'
+            if getattr(e, 'wait', None):
+                headers['Retry-After'] = str(int(e.wait))
+            response = self.respond({'detail': e.detail}, status=e.status_code, headers=headers)
+
+        for name, value in self.headers.items():
+            response[name] = value
+        return response
+
+    async def authenticate(self, request):
+        """
+        Resolve ``Authorization: Token <key>`` to an active user.
+        """
+        auth = request.headers.get('Authorization', '').split()
+        if not auth or auth[0].lower() != 'token':
+            raise exceptions.NotAuthenticated()
+        if len(auth) != 2:
+            raise exceptions.AuthenticationFailed('Invalid token header. No credentials provided.')
+
+        try:
+            token = await Token.objects.select_related('user').aget(key=auth[1])
+        except Token.DoesNotExist:
+            raise exceptions.AuthenticationFailed('Invalid token.')
+        if not token.user.is_active:
+            raise exceptions.AuthenticationFailed('User inactive or deleted.')
+        return token.user
+
+    async def check_throttles(self, request):
+        """
+        Run the configured throttles' ``allow_request`` in a worker thread.
+        The async ORM runs its queries the same way, so a native async
+        throttle would not save a thread hop.
+        """
+        waits = []
+        for throttle in [throttle_class() for throttle_class in api_settings.DEFAULT_THROTTLE_CLASSES]:
+            if not await sync_to_async(throttle.allow_request)(request, self):
+                waits.append(throttle.wait())
+        if waits:
+            raise exceptions.Throttled(max((wait for wait in waits if wait is not None), default=None))
+
+    def respond(self, data=None, status=status.HTTP_200_OK, headers=None):
+        with timed_serialization():
+            content = JSONRenderer().render(data) if data is not None else b''
+        return HttpResponse(content, status=status, headers=headers,
+                            content_type='application/json' if data is not None else None)
+
+
+class AsyncNotesAPI(NoteListMixin, AsyncAPIView):
+    pagination_class = NoteCursorPagination
+    throttle_scope = "low"
+
+    # View Notes
+    async def get(self, request):
+        try:
+            serializer_class, fields = self.get_list_fields(request)
+        except serializers.ValidationError as e:
+            return self.respond(e.detail, status=status.HTTP_400_BAD_REQUEST)
+
+        async def build():
+            notes = self.prepare_list(Note.objects.filter(owner=request.user), serializer_class, fields)
+            paginator = self.pagination_class()
+            page = await paginator.apaginate_queryset(notes, request, view=self)
+            return paginator.get_paginated_response(note_data(page, fields)).data
+
+        try:
+            cache_key = await alisting_cache_key(request, 'list')
+            etag = listing_etag(cache_key)
+            if if_none_match(request, etag):
+                return self.respond(status=status.HTTP_304_NOT_MODIFIED, headers={'ETag': etag})
+
+            data = await aget_or_build(cache_key, build)
+            return self.respond(data, headers={'ETag': etag})
+        except Exception as e:
+            return self.respond({'detail': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+    # Create Notes
+    async def post(self, request):
+        serializer = NoteBatchCreateSerializer(data=request.data, context={'request': request})
+        if not serializer.is_valid():
+            return self.respond(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+        data = serializer.validated_data
+        shared_with = set(data.get('shared_with', []))
+        errors = await invalid_user_ids(shared_with)
+        if errors:
+            return self.respond({'shared_with': errors}, status=status.HTTP_400_BAD_REQUEST)
+
+        note = await Note.objects.acreate(owner=request.user, title=data['title'], content=data['content'])
+        await Note.shared_with.through.objects.abulk_create([
+            Note.shared_with.through(note_id=note.id, user_id=user_id) for user_id in shared_with
+        ])
+        await abump_notes_version({request.user.id, *shared_with})
+
+        note = await Note.objects.prefetch_related(shared_with_ids()).aget(id=note.id)
+        return self.respond(NoteSerializer(note).data, status=status.HTTP_201_CREATED,
+                            headers={'ETag': note_etag(note.id, note.revision)})
+
+
+class AsyncNoteDetailAPI(AsyncAPIView):
+    throttle_scope = "high"
+
+    # View Note
+    async def get(self, request, id):
+        try:
+            # Answer conditional requests from the revision column alone
+            notes = visible_to(request.user)
+            if request.headers.get('If-None-Match'):
+                revision = await notes.values_list('revision', flat=True).aget(id=id)
+                etag = note_etag(id, revision)
+                if if_none_match(request, etag):
+                    return self.respond(status=status.HTTP_304_NOT_MODIFIED, headers={'ETag': etag})
+
+            note = await notes.prefetch_related(shared_with_ids()).aget(id=id)
+            return self.respond(NoteSerializer(note).data, headers={'ETag': note_etag(note.id, note.revision)})
+
+        # If note is not found.
+        except Note.DoesNotExist:
+            return self.respond({"detail": "Note not found"}, status=status.HTTP_404_NOT_FOUND)
+        except Exception as e:
+            return self.respond({'detail': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+    # Update Note
+    async def put(self, request, id):
+        try:
+            note = await Note.objects.only('id', 'revision').aget(id=id, owner=request.user)
+        except Note.DoesNotExist:
+            return self.respond({"detail": "Note not found"}, status=status.HTTP_404_NOT_FOUND)
+
+        if if_match_fails(request, note_etag(note.id, note.revision)):
+            return self.respond({"detail": "Note has been modified"}, status=status.HTTP_412_PRECONDITION_FAILED)
+
+        # Validated like the sync view, owner included; the serializer looks
+        # up the owner and shared_with users, so it runs in a thread
+        serializer = NoteSerializer(note, data=request.data, partial=True)
+        if not await sync_to_async(serializer.is_valid)():
+            return self.respond(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        data = serializer.validated_data
+
+        audience = await anote_audience([note.id])
+        # Conditioning the UPDATE on the revision that was checked makes the
+        # If-Match check and the write atomic without holding a row lock
+        updated = await sync_to_async(self.update)(note, data, bool(request.headers.get('If-Match')))
+        if not updated:
+            return self.respond({"detail": "Note has been modified"}, status=status.HTTP_412_PRECONDITION_FAILED)
+        await abump_notes_version(audience | await anote_audience([note.id]))
+
+        note = await Note.objects.prefetch_related(shared_with_ids()).aget(id=id)
+        return self.respond(NoteSerializer(note).data, headers={'ETag': note_etag(note.id, note.revision)})
+
+    @transaction.atomic
+    def update(self, note, data, conditional):
+        # The column update and the shared_with replacement must commit
+        # together; Django has no async transactions, so this runs in a thread
+        notes = Note.objects.filter(id=note.id)
+        if conditional:
+            notes = notes.filter(revision=note.revision)
+        fields = {field: data[field] for field in ('title', 'content', 'owner') if field in data}
+        if not notes.select_for_update().exists():
+            return False
+        if fields:
+            notes.update(**fields)
+        if 'shared_with' in data:
+            Note.shared_with.through.objects.filter(note_id=note.id).delete()
+            Note.shared_with.through.objects.bulk_create([
+                Note.shared_with.through(note_id=note.id, user_id=user.id) for user in set(data['shared_with'])
+            ])
+        return True
+
+    # Delete Note
+    async def delete(self, request, id):
+        try:
+            note = await Note.objects.only('id', 'revision').aget(id=id, owner=request.user)
+        except Note.DoesNotExist:
+            return self.respond({"detail": "Note not found"}, status=status.HTTP_404_NOT_FOUND)
+
+        if if_match_fails(request, note_etag(note.id, note.revision)):
+            return self.respond({"detail": "Note has been modified"}, status=status.HTTP_412_PRECONDITION_FAILED)
+
+        audience = await anote_audience([note.id])
+        notes = Note.objects.filter(id=note.id)
+        if request.headers.get('If-Match'):
+            notes = notes.filter(revision=note.revision)
+        deleted, _ = await notes.adelete()
+        if not deleted:
+            return self.respond({"detail": "Note has been modified"}, status=status.HTTP_412_PRECONDITION_FAILED)
+        await abump_notes_version(audience)
+        return self.respond({"detail": "Note deleted successfully"}, status=status.HTTP_204_NO_CONTENT)
+
+
+class AsyncNoteShareAPI(AsyncAPIView):
+    throttle_scope = "low"
+
+    # Share Note
+    async def post(self, request, id):
+        try:
+            note = await Note.objects.only('id', 'owner_id').aget(id=id, owner=request.user)
+        except Note.DoesNotExist:
+            return self.respond({"detail": "Note not found"}, status=status.HTTP_404_NOT_FOUND)
+
+        user_to_share_with_id = request.data.get('user_to_share_with')
+        if user_to_share_with_id is None:
+            return self.respond({"detail": "user_to_share_with parameter is required"}, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            user_to_share_with = await User.objects.only('id').aget(id=user_to_share_with_id)
+        except (User.DoesNotExist, ValueError):
+            return self.respond({"detail": "User to share with not found"}, status=status.HTTP_404_NOT_FOUND)
+
+        await Note.shared_with.through.objects.abulk_create(
+            [Note.shared_with.through(note_id=note.id, user_id=user_to_share_with.id)],
+            ignore_conflicts=True,
+        )
+        # Everyone who sees the note gets the new shared_with
+        await abump_notes_version(await anote_audience([note.id]))
+        return self.respond({"detail": "Note shared successfully"}, status=status.HTTP_200_OK)
+
+
+class AsyncNoteSearchAPI(NoteListMixin, AsyncAPIView):
+    pagination_class = NoteSearchPagination
+    throttle_scope = "low"
+
+    async def get(self, request):
+        query = normalize_query(request.query_params.get('q', ''))
+
+        if query:
+            try:
+                serializer_class, fields = self.get_list_fields(request, default_view='summary')
+            except serializers.ValidationError as e:
+                return self.respond(e.detail, status=status.HTTP_400_BAD_REQUEST)
+
+            notes, search_query = self.search(request, query)
+            paginator = self.pagination_class()
+            page = paginator.get_page_queryset(notes.values_list('id', flat=True), request, view=self)
+
+            async def build():
+                return [note_id async for note_id in page]
+
+            ids = await aget_or_build(
+                await asearch_cache_key(request.user.id, query, paginator.limit, paginator.offset),
+                build, timeout=settings.NOTES_SEARCH_CACHE_TIMEOUT,
+            )
+            ids = paginator.set_page(ids)
+            notes = self.search_page(request, ids, search_query, serializer_class, fields)
+            notes = order_by_ids([note async for note in notes], ids)
+            return self.respond(paginator.get_paginated_response(note_data(notes, fields)).data)
+        else:
+            return self.respond({"detail": "Please provide a search query"}, status=status.HTTP_400_BAD_REQUEST)
+
+
+async def invalid_user_ids(user_ids):
+    """
+    Return PrimaryKeyRelatedField-style errors for ids with no user.
+    """
+    existing = {user_id async for user_id in User.objects.filter(id__in=user_ids).values_list('id', flat=True)}
+    return [f'Invalid pk "{user_id}" - object does not exist.' for user_id in sorted(user_ids - existing)]
@@ -0,0 +1,312 @@
+import itertools
+import json
+import math
+import random
+import threading
+import time
+import urllib.error
+import urllib.request
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.db import connection, connections
+from django.db.models import Prefetch
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from rest_framework.authtoken.models import Token
+
+from .models import Note
+from .serializers import NoteSerializer, note_data, note_values
+
+# Prefix of every user created by a benchmark run, so a run can be cleaned up
+USER_PREFIX = 'bench-'
+PASSWORD = 'benchmark-password'
+
+WORDS = (
+    'meeting agenda budget project roadmap release review design draft notes '
+    'customer invoice travel plan groceries recipe garden workout reading list '
+    'quarterly report migration database server deploy incident backlog sprint '
+    'ideas research summary contract hiring interview onboarding feedback goals '
+    'weekly monthly urgent follow up call email schedule launch metrics search'
+).split()
+
+
+def seed(users, notes_per_user, content_size, share_fanout, seed=0):
+    """
+    Create ``users`` benchmark users with tokens, ``notes_per_user`` notes
+    each and share every note with up to ``share_fanout`` other users.
+
+    Content lengths are log-normally distributed around ``content_size``
+    characters, so most notes are short and a few are very long. Everything
+    is derived from ``seed``, so runs with the same arguments see the same
+    data.
+    """
+    rng = random.Random(seed)
+    run = f'{USER_PREFIX}{seed}-{time.time_ns()}'
+    # One hash for every account; hashing is deliberately slow
+    password = make_password(PASSWORD)
+    accounts = User.objects.bulk_create([
+        User(username=f'{run}-{i}', password=password) for i in range(users)
+    ])
+    Token.objects.bulk_create([Token(key=Token.generate_key(), user=account) for account in accounts])
+
+    for account in accounts:
+        notes = Note.objects.bulk_create([
+            Note(owner=account, title=text(rng, rng.randint(2, 6)).capitalize(),
+                 content=text(rng, content_length(rng, content_size) // 7))
+            for _ in range(notes_per_user)
+        ], batch_size=1000)
+        others = [other for other in accounts if other.id != account.id]
+        Note.shared_with.through.objects.bulk_create([
+            Note.shared_with.through(note_id=note.id, user_id=other.id)
+            for note in notes
+            for other in rng.sample(others, min(share_fanout, len(others)))
+        ], batch_size=5000)
+    return run
+
+
+def cleanup(prefix=USER_PREFIX):
+    """
+    Delete benchmark users and, by cascade, their notes and tokens.
+    """
+    deleted, _ = User.objects.filter(username__startswith=prefix).delete()
+    return deleted
+
+
+def text(rng, words):
+    return ' '.join(rng.choice(WORDS) for _ in range(max(words, 1)))
+
+
+def content_length(rng, median):
+    return min(int(rng.lognormvariate(math.log(median), 1)), 100 * median)
+
+
+def percentile(values, percent):
+    """
+    Nearest-rank percentile of ``values``.
+    """
+    values = sorted(values)
+    if not values:
+        return None
+    return values[max(math.ceil(percent / 100 * len(values)) - 1, 0)]
+
+
+def compare_serializers(run, rounds, page_size=100):
+    """
+    Serialize a page of each benchmark user's notes ``rounds`` times, with
+    ``NoteSerializer`` over instances and a ``shared_with`` prefetch as the
+    list endpoints used to, and with the ``note_values`` fast path. CPU time
+    of this process only is counted, queries included, so the database's
+    own work is left out.
+    """
+    fields = list(NoteSerializer().fields)
+    pages = [
+        Note.objects.filter(owner_id=user_id).order_by('-id')
+        for user_id in User.objects.filter(username__startswith=run).order_by('id').values_list('id', flat=True)
+    ]
+
+    def serializer(notes):
+        shared_with = Prefetch('shared_with', queryset=User.objects.only('id').order_by('id'))
+        return NoteSerializer(notes.prefetch_related(shared_with)[:page_size], many=True, fields=fields).data
+
+    def values(notes):
+        return note_data(note_values(notes, fields)[:page_size], fields)
+
+    results = {'rows': len(values(pages[0]))}
+    for label, serialize in (('serializer', serializer), ('values', values)):
+        rows = 0
+        start = time.process_time()
+        for _ in range(rounds):
+            for notes in pages:
+                rows += len(serialize(notes))
+        elapsed = time.process_time() - start
+        results[label] = {'rows_per_cpu_second': round(rows / elapsed, 1) if elapsed else None}
+    if results['serializer']['rows_per_cpu_second'] and results['values']['rows_per_cpu_second']:
+        results['speedup'] = round(
+            results['values']['rows_per_cpu_second'] / results['serializer']['rows_per_cpu_second'], 2
+        )
+    else:
+        results['speedup'] = None
+    return results
+
+
+class Scenarios:
+    """
+    One request builder per API endpoint. Each builder takes the iteration
+    number and returns ``(method, path, body)`` for a request made as
+    ``self.user(i)``.
+    """
+
+    def __init__(self, run):
+        self.run = run
+        self.accounts = list(
+            User.objects.filter(username__startswith=run).order_by('id').values_list('id', 'username', 'auth_token__key')
+        )
+        self.notes = {
+            user_id: list(Note.objects.filter(owner_id=user_id).order_by('id').values_list('id', flat=True))
+            for user_id, _, _ in self.accounts
+        }
+        self.rng = random.Random(0)
+        self.lock = threading.Lock()
+        # Notes are deleted at most once, so DELETE pops from its own pool
+        self.deletable = {user_id: list(reversed(ids)) for user_id, ids in self.notes.items()}
+
+    def user(self, i):
+        return self.accounts[i % len(self.accounts)]
+
+    def note(self, i):
+        user_id = self.user(i)[0]
+        with self.lock:
+            return self.rng.choice(self.notes[user_id])
+
+    def word(self):
+        with self.lock:
+            return self.rng.choice(WORDS)
+
+    def all(self):
+        return {
+            'POST auth/login/': lambda i: ('POST', '/api/auth/login/', {'username': self.user(i)[1], 'password': PASSWORD}),
+            'POST auth/register/': lambda i: ('POST', '/api/auth/register/', {
+                'username': f'{self.run}-r{i}', 'password': PASSWORD, 'email': f'{self.run}-r{i}@example.com',
+            }),
+            'GET notes/': lambda i: ('GET', '/api/notes/', None),
+            'POST notes/': lambda i: ('POST', '/api/notes/', {'title': text(self.rng, 4), 'content': text(self.rng, 200)}),
+            'GET note-batch': lambda i: ('GET', f'/api/notes/batch/?ids={",".join(str(self.note(i)) for _ in range(20))}', None),
+            'POST note-batch': lambda i: ('POST', '/api/notes/batch/', {
+                'create': [{'title': text(self.rng, 3), 'content': text(self.rng, 50)} for _ in range(10)],
+            }),
+            'GET note-export': lambda i: ('GET', '/api/notes/export/', None),
+            'POST note-import': lambda i: ('POST', '/api/notes/import/', '\n'.join(
+                json.dumps({'title': text(self.rng, 3), 'content': text(self.rng, 50)}) for _ in range(50)
+            )),
+            'POST note-bulk-share': lambda i: ('POST', '/api/notes/share/', {
+                'notes': [self.note(i) for _ in range(10)], 'users': [self.user(i + 1)[0]],
+            }),
+            'GET note-detail': lambda i: ('GET', f'/api/notes/{self.note(i)}/', None),
+            'PUT note-detail': lambda i: ('PUT', f'/api/notes/{self.note(i)}/', {'title': text(self.rng, 4)}),
+            'POST note-share': lambda i: ('POST', f'/api/notes/{self.note(i)}/share/', {'user_to_share_with': self.user(i + 1)[0]}),
+            'GET note-search': lambda i: ('GET', f'/api/search/?q={self.word()}', None),
+            'GET note-autocomplete': lambda i: ('GET', f'/api/search/autocomplete/?q={self.word()[:4]}', None),
+            # Last, as it removes notes the other scenarios pick from
+            'DELETE note-detail': lambda i: ('DELETE', f'/api/notes/{self.pop_deletable(i)}/', None),
+        }
+
+    def pop_deletable(self, i):
+        user_id = self.user(i)[0]
+        with self.lock:
+            return self.deletable[user_id].pop() if self.deletable[user_id] else 0
+
+
+class Runner:
+    """
+    Send requests through the Django test client (in process, with SQL query
+    counts) or, given ``base_url``, over HTTP to a running server.
+    """
+
+    def __init__(self, base_url=None):
+        self.base_url = base_url.rstrip('/') if base_url else None
+        self.local = threading.local()
+
+    def request(self, method, path, body, token):
+        if self.base_url:
+            return self.http_request(method, path, body, token)
+
+        client = getattr(self.local, 'client', None)
+        if client is None:
+            client = self.local.client = Client()
+        if isinstance(body, str):
+            content_type, data = 'application/x-ndjson', body
+        else:
+            content_type, data = 'application/json', json.dumps(body) if body is not None else ''
+        extra = {'HTTP_AUTHORIZATION': f'Token {token}'} if token else {}
+
+        with CaptureQueriesContext(connection) as queries:
+            start = time.perf_counter()
+            response = client.generic(method, path, data, content_type=content_type, **extra)
+            if response.streaming:
+                b''.join(response.streaming_content)
+            elapsed = time.perf_counter() - start
+        return response.status_code, elapsed, len(queries)
+
+    def http_request(self, method, path, body, token):
+        headers = {'Authorization': f'Token {token}'} if token else {}
+        if isinstance(body, str):
+            data, headers['Content-Type'] = body.encode(), 'application/x-ndjson'
+        elif body is not None:
+            data, headers['Content-Type'] = json.dumps(body).encode(), 'application/json'
+        else:
+            data = None
+        request = urllib.request.Request(self.base_url + path, data=data, headers=headers, method=method)
+
+        start = time.perf_counter()
+        try:
+            with urllib.request.urlopen(request) as response:
+                response.read()
+                code = response.status
+        except urllib.error.HTTPError as e:
+            code = e.code
+        return code, time.perf_counter() - start, None
+
+
+def run_endpoint(runner, scenarios, build, requests, concurrency, warmup):
+    """
+    Send ``warmup`` unrecorded and then ``requests`` recorded requests built
+    by ``build`` from ``concurrency`` threads, and summarize them.
+    """
+    counter = itertools.count()
+    lock = threading.Lock()
+    samples = []
+
+    def send(i):
+        method, path, body = build(i)
+        token = None if path.startswith('/api/auth/') else scenarios.user(i)[2]
+        return runner.request(method, path, body, token)
+
+    def worker():
+        try:
+            while True:
+                with lock:
+                    i = next(counter)
+                if i >= requests:
+                    return
+                sample = send(warmup + i)
+                with lock:
+                    samples.append(sample)
+        finally:
+            if threading.current_thread() is not threading.main_thread():
+                connections.close_all()
+
+    for i in range(warmup):
+        send(i)
+
+    start = time.perf_counter()
+    if concurrency == 1:
+        # Stay on the calling thread (and its transaction)
+        worker()
+    else:
+        threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    elapsed = time.perf_counter() - start
+
+    latencies = [sample[1] * 1000 for sample in samples]
+    queries = [sample[2] for sample in samples if sample[2] is not None]
+    return {
+        'requests': len(samples),
+        'errors': sum(1 for sample in samples if sample[0] >= 400),
+        'status_codes': sorted({sample[0] for sample in samples}),
+        'throughput': round(len(samples) / elapsed, 2) if elapsed else None,
+        'latency_ms': {
+            'mean': round(sum(latencies) / len(latencies), 3) if latencies else None,
+            'p50': round(percentile(latencies, 50), 3) if latencies else None,
+            'p95': round(percentile(latencies, 95), 3) if latencies else None,
+            'p99': round(percentile(latencies, 99), 3) if latencies else None,
+            'max': round(max(latencies), 3) if latencies else None,
+        },
+        'queries': {
+            'mean': round(sum(queries) / len(queries), 2),
+            'max': max(queries),
+        } if queries else None,
+    }
@@ -0,0 +1,227 @@
+import hashlib
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.base import DEFAULT_TIMEOUT
+from django.db import transaction
+
+from .models import Note
+
+# Cache alias used for note listings and per-user version counters.
+CACHE_ALIAS = getattr(settings, 'NOTES_CACHE_ALIAS', 'notes')
+
+_stats_lock = threading.Lock()
+_stats = {'hits': 0, 'misses': 0}
+_namespace_stats = {}
+
+
+def _cache():
+    return caches[CACHE_ALIAS]
+
+
+def _version_key(user_id):
+    return f'notes:version:{user_id}'
+
+
+def _record(outcome, key):
+    # Keys are 'notes:<namespace>:...'
+    namespace = key.split(':')[1]
+    with _stats_lock:
+        _stats[outcome] += 1
+        stats = _namespace_stats.setdefault(namespace, {'hits': 0, 'misses': 0})
+        stats[outcome] += 1
+
+
+def cache_stats(namespace=None):
+    """
+    Return this process' cache hit/miss counters, in total or for one
+    namespace ('list', 'feed', 'search', 'autocomplete').
+    """
+    with _stats_lock:
+        if namespace is None:
+            return dict(_stats)
+        return dict(_namespace_stats.get(namespace, {'hits': 0, 'misses': 0}))
+
+
+def get_notes_version(user_id):
+    """
+    Return the current notes version of a user.
+
+    Versions start from a nanosecond timestamp rather than zero, so a version
+    key that was evicted is re-created with a value no earlier entry used.
+    """
+    cache = _cache()
+    version = cache.get(_version_key(user_id))
+    if version is None:
+        cache.add(_version_key(user_id), time.time_ns(), timeout=None)
+        version = cache.get(_version_key(user_id))
+    return version
+
+
+def _primary_key(user_id):
+    return f'notes:primary:{user_id}'
+
+
+def _bump(user_ids):
+    cache = _cache()
+    for user_id in user_ids:
+        try:
+            cache.incr(_version_key(user_id))
+        except ValueError:
+            cache.set(_version_key(user_id), time.time_ns(), timeout=None)
+    pin_to_primary(user_ids)
+
+
+def pin_to_primary(user_ids):
+    """
+    Send the reads of the given users to the primary database for the next
+    ``NOTES_REPLICA_STICKY_SECONDS`` (see ``notes.routers``), so they see a
+    write before the replicas have replayed it, and never cache a listing
+    of what the replicas had before it.
+    """
+    if settings.NOTES_READ_REPLICAS:
+        _cache().set_many({_primary_key(user_id): True for user_id in user_ids},
+                          timeout=settings.NOTES_REPLICA_STICKY_SECONDS)
+
+
+def pinned_to_primary(user_id):
+    return bool(_cache().get(_primary_key(user_id)))
+
+
+def bump_notes_version(user_ids):
+    """
+    Invalidate every cached listing of the given users, and pin their reads
+    to the primary database.
+
+    The version is bumped straight away and, inside a transaction, once more
+    after commit: a reader that cached pre-commit rows under the first bump
+    is invalidated by the second one.
+    """
+    user_ids = set(user_ids)
+    if not user_ids:
+        return
+    _bump(user_ids)
+    if transaction.get_connection().in_atomic_block:
+        transaction.on_commit(lambda: _bump(user_ids))
+
+
+def note_audience(note_ids):
+    """
+    Return the ids of the owners of, and users shared on, the given notes.
+    """
+    owners = Note.objects.filter(id__in=note_ids).values_list('owner_id', flat=True)
+    shared = Note.shared_with.through.objects.filter(note_id__in=note_ids).values_list('user_id', flat=True)
+    return set(owners.union(shared))
+
+
+def listing_cache_key(request, namespace):
+    """
+    Build the cache key of a listing for the requesting user.
+
+    The key embeds the user's notes version, so bumping the version makes
+    every listing cached for that user unreachable at once.
+    """
+    user_id = request.user.id
+    request_digest = hashlib.md5(
+        (request.get_host() + request.get_full_path()).encode()
+    ).hexdigest()
+    return f'notes:{namespace}:{user_id}:{get_notes_version(user_id)}:{request_digest}'
+
+
+def autocomplete_cache_key(user_id, prefix, limit):
+    """
+    Build the cache key of a user's autocomplete results for a prefix.
+
+    Keyed on the normalized prefix rather than the URL, so every client
+    typing the same prefix shares one entry.
+    """
+    digest = hashlib.md5(f'{prefix}:{limit}'.encode()).hexdigest()
+    return f'notes:autocomplete:{user_id}:{get_notes_version(user_id)}:{digest}'
+
+
+def search_cache_key(user_id, query, limit, offset):
+    """
+    Build the cache key of one page of a user's search result ids.
+
+    The user's notes version is bumped for every note they own or that is
+    shared with them, so any change to their visible set invalidates all
+    of their cached searches.
+    """
+    digest = hashlib.md5(f'{query}:{limit}:{offset}'.encode()).hexdigest()
+    return f'notes:search:{user_id}:{get_notes_version(user_id)}:{digest}'
+
+
+def get_or_build(key, build, timeout=DEFAULT_TIMEOUT):
+    """
+    Return the cached value under ``key``, calling ``build`` on a miss.
+    """
+    cache = _cache()
+    data = cache.get(key)
+    if data is not None:
+        _record('hits', key)
+        return data
+    _record('misses', key)
+    data = build()
+    cache.set(key, data, timeout=timeout)
+    return data
+
+
+# Async counterparts for the async views. Async code never runs inside a
+# transaction.atomic() block here, so bumps need no on_commit follow-up.
+
+async def aget_notes_version(user_id):
+    cache = _cache()
+    version = await cache.aget(_version_key(user_id))
+    if version is None:
+        await cache.aadd(_version_key(user_id), time.time_ns(), timeout=None)
+        version = await cache.aget(_version_key(user_id))
+    return version
+
+
+async def abump_notes_version(user_ids):
+    cache = _cache()
+    for user_id in set(user_ids):
+        try:
+            await cache.aincr(_version_key(user_id))
+        except ValueError:
+            await cache.aset(_version_key(user_id), time.time_ns(), timeout=None)
+    await apin_to_primary(user_ids)
+
+
+async def apin_to_primary(user_ids):
+    if settings.NOTES_READ_REPLICAS:
+        await _cache().aset_many({_primary_key(user_id): True for user_id in user_ids},
+                                 timeout=settings.NOTES_REPLICA_STICKY_SECONDS)
+
+
+async def anote_audience(note_ids):
+    owners = Note.objects.filter(id__in=note_ids).values_list('owner_id', flat=True)
+    shared = Note.shared_with.through.objects.filter(note_id__in=note_ids).values_list('user_id', flat=True)
+    return {user_id async for user_id in owners.union(shared)}
+
+
+async def alisting_cache_key(request, namespace):
+    user_id = request.user.id
+    request_digest = hashlib.md5(
+        (request.get_host() + request.get_full_path()).encode()
+    ).hexdigest()
+    return f'notes:{namespace}:{user_id}:{await aget_notes_version(user_id)}:{request_digest}'
+
+
+async def asearch_cache_key(user_id, query, limit, offset):
+    digest = hashlib.md5(f'{query}:{limit}:{offset}'.encode()).hexdigest()
+    return f'notes:search:{user_id}:{await aget_notes_version(user_id)}:{digest}'
+
+
+async def aget_or_build(key, build, timeout=DEFAULT_TIMEOUT):
+    cache = _cache()
+    data = await cache.aget(key)
+    if data is not None:
+        _record('hits', key)
+        return data
+    _record('misses', key)
+    data = await build()
+    await cache.aset(key, data, timeout=timeout)
+    return data
@@ -0,0 +1,40 @@
+import hashlib
+
+from django.utils.cache import parse_etags, quote_etag
+
+
+def note_etag(note_id, revision):
+    """
+    Strong ETag of a single note, derived from its id and revision.
+    """
+    return quote_etag(f'{note_id}-{revision}')
+
+
+def listing_etag(cache_key):
+    """
+    Strong ETag of a note listing, derived from its versioned cache key.
+    """
+    return quote_etag(hashlib.md5(cache_key.encode()).hexdigest())
+
+
+def if_none_match(request, etag):
+    """
+    Whether ``If-None-Match`` matches ``etag`` (weak comparison).
+    """
+    header = request.headers.get('If-None-Match')
+    if not header:
+        return False
+    etags = [tag.removeprefix('W/') for tag in parse_etags(header)]
+    return '*' in etags or etag in etags
+
+
+def if_match_fails(request, etag):
+    """
+    Whether an ``If-Match`` precondition is present and fails for ``etag``
+    (strong comparison, so weak validators never match).
+    """
+    header = request.headers.get('If-Match')
+    if not header:
+        return False
+    etags = parse_etags(header)
+    return '*' not in etags and etag not in etags
@@ -0,0 +1,15 @@
+import os
+
+# Runs in spawned password hashing processes (see notes.provisioning), so it
+# must not import models before Django is set up
+
+
+def setup_worker(settings_module):
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', settings_module)
+    import django
+    django.setup()
+
+
+def hash_password(password):
+    from django.contrib.auth.hashers import make_password
+    return make_password(password)
@@ -0,0 +1,101 @@
+import json
+
+from django.conf import settings
+from django.db import transaction
+from rest_framework import serializers
+
+from .cache import bump_notes_version
+from .models import Note
+from .serializers import NoteSerializer
+from .tasks import analyze_notes
+
+
+def import_notes(lines, owner, batch_size=None, on_progress=None):
+    """
+    Import notes for ``owner`` from an iterable of NDJSON lines.
+
+    Each line is parsed and validated on its own against NoteSerializer's
+    ``title`` and ``content`` fields; valid notes are inserted with one
+    ``bulk_create`` per ``batch_size`` lines, each batch in its own
+    transaction, so memory stays bounded however long the input is. The
+    search vector is filled in by the insert trigger in the same statement.
+    Invalid lines are skipped and reported by line number.
+
+    ``committed_lines`` counts the leading lines that are fully handled:
+    imported (committed) or reported invalid. If a batch fails, e.g. on a
+    database error, the import stops there and the report gains an
+    ``error`` with the first line that was not imported, so the client can
+    resume from that line without creating duplicates.
+
+    ``on_progress`` is called with the report after every batch. Imports of
+    a batch or more queue a background ``ANALYZE``.
+    """
+    batch_size = batch_size or settings.NOTES_IMPORT_BATCH_SIZE
+    fields = NoteSerializer().fields
+    report = {'lines': 0, 'committed_lines': 0, 'created': 0, 'failed': 0, 'errors': []}
+    batch = []
+
+    def flush():
+        with transaction.atomic():
+            Note.objects.bulk_create(batch)
+        report['created'] += len(batch)
+        report['committed_lines'] = report['lines']
+        batch.clear()
+        bump_notes_version([owner.id])
+        if on_progress:
+            on_progress(report)
+
+    try:
+        for number, line in enumerate(lines, start=1):
+            report['lines'] = number
+            if not line.strip():
+                if not batch:
+                    report['committed_lines'] = number
+                continue
+
+            try:
+                note = parse_note(line, fields)
+            except serializers.ValidationError as e:
+                report['failed'] += 1
+                if len(report['errors']) < settings.NOTES_IMPORT_MAX_REPORTED_ERRORS:
+                    report['errors'].append({'line': number, 'errors': e.detail})
+                if not batch:
+                    report['committed_lines'] = number
+                continue
+
+            batch.append(Note(owner=owner, **note))
+            if len(batch) >= batch_size:
+                flush()
+
+        if batch:
+            flush()
+    except Exception as e:
+        # Earlier batches stay committed; report where to resume
+        report['error'] = {'line': report['committed_lines'] + 1, 'detail': str(e)}
+        return report
+    # Large imports skew the planner statistics until autovacuum catches up
+    if report['created'] >= batch_size:
+        analyze_notes.enqueue()
+    return report
+
+
+def parse_note(line, fields):
+    """
+    Parse one NDJSON line into validated ``title`` and ``content`` values.
+    """
+    try:
+        data = json.loads(line)
+    except ValueError:
+        raise serializers.ValidationError({'non_field_errors': ['Invalid JSON']})
+    if not isinstance(data, dict):
+        raise serializers.ValidationError({'non_field_errors': ['Expected a JSON object']})
+
+    note, errors = {}, {}
+    for name in ('title', 'content'):
+        try:
+            note[name] = fields[name].run_validation(data.get(name, serializers.empty))
+        except serializers.ValidationError as e:
+            errors[name] = e.detail
+    if errors:
+        raise serializers.ValidationError(errors)
+    return note
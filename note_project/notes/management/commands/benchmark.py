@@ -0,0 +1,121 @@
+import contextlib
+import io
+import json
+import platform
+import subprocess
+import time
+
+import django
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import override_settings
+
+from notes.benchmark import Runner, Scenarios, cleanup, compare_serializers, run_endpoint, seed
+
+
+class Command(BaseCommand):
+    help = (
+        "Seed a benchmark dataset, drive every notes API endpoint with concurrent requests and "
+        "print per-endpoint latency percentiles, throughput and SQL query counts as JSON"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=10, help="Benchmark users to create")
+        parser.add_argument('--notes', type=int, default=500, help="Notes per user")
+        parser.add_argument('--content-size', type=int, default=1500, help="Median note content length in characters")
+        parser.add_argument('--share-fanout', type=int, default=3, help="Users each note is shared with")
+        parser.add_argument('--requests', type=int, default=200, help="Recorded requests per endpoint")
+        parser.add_argument('--warmup', type=int, default=10, help="Unrecorded requests per endpoint")
+        parser.add_argument('--concurrency', type=int, default=4, help="Threads sending requests")
+        parser.add_argument('--seed', type=int, default=0, help="Seed of the generated dataset")
+        parser.add_argument('--endpoints', default='', help="Comma-separated endpoint labels to run (default: all)")
+        parser.add_argument('--url', default=None, help=(
+            "Base URL of a running server (e.g. http://127.0.0.1:8000) instead of the in-process test client; "
+            "the server's own throttle rates apply and no query counts are reported"
+        ))
+        parser.add_argument('--serializers', type=int, default=0, help=(
+            "Also time this many rounds of serializing every user's first page with NoteSerializer "
+            "and with the values() fast path, in rows per CPU second"
+        ))
+        parser.add_argument('--output', default='-', help="File to write the JSON report to, or - for stdout")
+        parser.add_argument('--keep', action='store_true', help="Keep the benchmark users and notes afterwards")
+
+    def handle(self, *args, **options):
+        if options['users'] < 2 or options['notes'] < 1 or options['requests'] < 1 or options['concurrency'] < 1:
+            raise CommandError("--users must be at least 2 and --notes, --requests and --concurrency at least 1")
+
+        # Throttles still run (their query is part of every request's cost)
+        # but with rates the benchmark cannot reach
+        rest_framework = {**settings.REST_FRAMEWORK, 'DEFAULT_THROTTLE_RATES': {
+            scope: '1000000/second' for scope in settings.REST_FRAMEWORK.get('DEFAULT_THROTTLE_RATES', {})
+        }}
+        with override_settings(REST_FRAMEWORK=rest_framework, ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, 'testserver']), \
+                contextlib.redirect_stdout(io.StringIO()):
+            report = self.run(options)
+
+        output = json.dumps(report, indent=2)
+        if options['output'] == '-':
+            self.stdout.write(output)
+        else:
+            with open(options['output'], 'w', encoding='utf-8') as f:
+                f.write(output + '\n')
+            self.stderr.write(f"Wrote {len(report['endpoints'])} endpoint results to {options['output']}")
+
+    def run(self, options):
+        started = time.perf_counter()
+        run = seed(options['users'], options['notes'], options['content_size'], options['share_fanout'], options['seed'])
+        seconds_seeding = time.perf_counter() - started
+
+        try:
+            scenarios = Scenarios(run)
+            selected = [label.strip() for label in options['endpoints'].split(',') if label.strip()]
+            builders = scenarios.all()
+            unknown = [label for label in selected if label not in builders]
+            if unknown:
+                raise CommandError(f"Unknown endpoints: {', '.join(unknown)}. Choose from: {', '.join(builders)}")
+
+            runner = Runner(options['url'])
+            results = {}
+            for label, build in builders.items():
+                if selected and label not in selected:
+                    continue
+                results[label] = run_endpoint(
+                    runner, scenarios, build, options['requests'], options['concurrency'], options['warmup'],
+                )
+                self.stderr.write(f"{label}: p50 {results[label]['latency_ms']['p50']} ms")
+
+            serializers = None
+            if options['serializers']:
+                serializers = compare_serializers(run, options['serializers'])
+                self.stderr.write(f"serializers: values() path {serializers['speedup']}x rows per CPU second")
+        finally:
+            if not options['keep']:
+                cleanup(run)
+
+        return {
+            'meta': {
+                'commit': git_commit(),
+                'python': platform.python_version(),
+                'django': django.get_version(),
+                'database': f'{connection.vendor} {connection.pg_version if connection.vendor == "postgresql" else ""}'.strip(),
+                'target': options['url'] or 'test-client',
+                'seconds_seeding': round(seconds_seeding, 3),
+            },
+            'parameters': {
+                name: options[name] for name in (
+                    'users', 'notes', 'content_size', 'share_fanout', 'requests', 'warmup', 'concurrency', 'seed',
+                )
+            },
+            'endpoints': results,
+            **({'serializers': serializers} if serializers else {}),
+        }
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True, cwd=settings.BASE_DIR,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
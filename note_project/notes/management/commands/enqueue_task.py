@@ -0,0 +1,30 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+import notes.tasks  # noqa: F401 (registers the tasks)
+from notes.queue import registry
+
+
+class Command(BaseCommand):
+    help = "Queue a background task, e.g. notes.reindex_notes or notes.purge_tombstones"
+
+    def add_arguments(self, parser):
+        parser.add_argument('name', help="Task name")
+        parser.add_argument('--payload', default='{}', help="Keyword arguments of the task as a JSON object")
+        parser.add_argument('--priority', type=int, default=None, help="Higher runs first")
+        parser.add_argument('--delay', type=int, default=0, help="Seconds to wait before the task may run")
+
+    def handle(self, *args, **options):
+        func = registry.get(options['name'])
+        if func is None:
+            raise CommandError(f"Unknown task {options['name']!r}; known tasks: {', '.join(sorted(registry))}")
+        try:
+            payload = json.loads(options['payload'])
+        except ValueError as e:
+            raise CommandError(f"Invalid payload: {e}")
+        if not isinstance(payload, dict):
+            raise CommandError("The payload must be a JSON object")
+
+        queued = func.enqueue(priority=options['priority'], delay=options['delay'], **payload)
+        self.stdout.write(self.style.SUCCESS(f"Queued {queued}"))
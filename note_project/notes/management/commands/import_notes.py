@@ -0,0 +1,41 @@
+import sys
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from notes.importer import import_notes
+
+
+class Command(BaseCommand):
+    help = "Import notes for a user from an NDJSON file (one {\"title\", \"content\"} object per line)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="NDJSON file to import, or - to read from stdin")
+        parser.add_argument('--user', required=True, help="Username that will own the imported notes")
+        parser.add_argument('--batch-size', type=int, default=None, help="Notes inserted per bulk insert")
+
+    def handle(self, *args, **options):
+        try:
+            owner = User.objects.get(username=options['user'])
+        except User.DoesNotExist:
+            raise CommandError(f"User {options['user']!r} does not exist")
+
+        def progress(report):
+            self.stdout.write(f"{report['created']} notes imported, {report['failed']} lines failed")
+
+        if options['path'] == '-':
+            report = import_notes(sys.stdin, owner, options['batch_size'], progress)
+        else:
+            with open(options['path'], encoding='utf-8') as lines:
+                report = import_notes(lines, owner, options['batch_size'], progress)
+
+        for error in report['errors']:
+            self.stderr.write(f"line {error['line']}: {error['errors']}")
+        if 'error' in report:
+            raise CommandError(
+                f"Import stopped at line {report['error']['line']}: {report['error']['detail']}. "
+                f"{report['created']} notes were imported; resume from line {report['error']['line']}"
+            )
+        self.stdout.write(self.style.SUCCESS(
+            f"Imported {report['created']} notes from {report['lines']} lines ({report['failed']} failed)"
+        ))
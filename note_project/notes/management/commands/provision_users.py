@@ -0,0 +1,39 @@
+import csv
+import json
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from notes.provisioning import provision_users
+
+
+class Command(BaseCommand):
+    help = "Create users and their API tokens from a CSV file with username, email and password columns"
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="CSV file with a header row, or - to read from stdin")
+        parser.add_argument('--workers', type=int, default=None, help="Processes hashing passwords (default: one per CPU)")
+        parser.add_argument('--report', default=None, help="Write the per-user results, including new tokens, to this JSON file")
+
+    def handle(self, *args, **options):
+        if options['path'] == '-':
+            accounts = list(csv.DictReader(sys.stdin))
+        else:
+            with open(options['path'], encoding='utf-8', newline='') as f:
+                accounts = list(csv.DictReader(f))
+        if not accounts:
+            raise CommandError("No users to provision")
+
+        results = provision_users(accounts, options['workers'])
+
+        for line, result in enumerate(results, start=2):
+            if result['status'] != 'created':
+                self.stderr.write(f"line {line}: {result['username']!r} {result['status']}: {result['errors']}")
+        if options['report']:
+            with open(options['report'], 'w', encoding='utf-8') as f:
+                json.dump(results, f, indent=2)
+
+        created = sum(1 for result in results if result['status'] == 'created')
+        self.stdout.write(self.style.SUCCESS(
+            f"Provisioned {created} users from {len(results)} rows ({len(results) - created} failed)"
+        ))
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from notes.sync import purge_tombstones
+
+
+class Command(BaseCommand):
+    help = "Delete sync tombstones older than NOTES_SYNC_TOMBSTONE_DAYS and those of deleted users"
+
+    def handle(self, *args, **options):
+        deleted = purge_tombstones()
+        self.stdout.write(self.style.SUCCESS(f"Deleted {deleted} tombstones"))
@@ -0,0 +1,30 @@
+import signal
+
+from django.core.management.base import BaseCommand
+
+import notes.tasks  # noqa: F401 (registers the tasks)
+from notes.queue import Worker
+
+
+class Command(BaseCommand):
+    help = "Run queued background tasks"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--concurrency', type=int, default=4, help="Tasks run at the same time, on threads")
+        parser.add_argument('--visibility-timeout', type=int, default=None,
+                            help="Seconds before a claimed task that has not finished is run again")
+        parser.add_argument('--once', action='store_true', help="Exit once no task is ready to run")
+
+    def handle(self, *args, **options):
+        worker = Worker(concurrency=max(options['concurrency'], 1), timeout=options['visibility_timeout'])
+
+        def stop(signum, frame):
+            # Finish the running tasks, claim no more
+            self.stdout.write("Stopping after the running tasks")
+            worker.stop()
+        if not options['once']:
+            signal.signal(signal.SIGTERM, stop)
+            signal.signal(signal.SIGINT, stop)
+
+        processed = worker.run(once=options['once'])
+        self.stdout.write(self.style.SUCCESS(f"Ran {processed} tasks"))
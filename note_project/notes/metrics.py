@@ -0,0 +1,238 @@
+import bisect
+import contextvars
+import threading
+import time
+from contextlib import contextmanager
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.http import HttpResponse, HttpResponseNotFound
+
+from .cache import cache_stats
+
+# Upper bounds of the histogram buckets: seconds for timings, queries for counts
+DURATION_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 50, 100)
+
+HISTOGRAMS = {
+    'notes_request_duration_seconds': ("Wall time spent handling the request", DURATION_BUCKETS),
+    'notes_request_db_duration_seconds': ("Time spent executing SQL", DURATION_BUCKETS),
+    'notes_request_db_queries': ("SQL queries executed", QUERY_BUCKETS),
+    'notes_request_serialize_duration_seconds': ("Time spent rendering the response body", DURATION_BUCKETS),
+}
+
+_current = contextvars.ContextVar('notes_request_timer', default=None)
+
+
+class RequestTimer:
+    """
+    Timings of one request, made current with ``measure``.
+    """
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.db = 0.0
+        self.queries = 0
+        self.serialize = 0.0
+
+    @contextmanager
+    def measure(self):
+        token = _current.set(self)
+        try:
+            yield self
+        finally:
+            _current.reset(token)
+
+
+def _execute(execute, sql, params, many, context):
+    timer = _current.get()
+    if timer is None:
+        return execute(sql, params, many, context)
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        timer.db += time.perf_counter() - start
+        timer.queries += 1
+
+
+def install_query_timer():
+    """
+    Add the SQL timing wrapper to this thread's database connections.
+
+    Connections are per thread, and the wrapper stays installed, so this is
+    a membership check after a thread's first request. The wrapper finds
+    the request through a context variable, which also reaches the threads
+    the async ORM runs queries in.
+    """
+    for connection in connections.all():
+        if _execute not in connection.execute_wrappers:
+            connection.execute_wrappers.append(_execute)
+
+
+@contextmanager
+def timed_serialization():
+    """
+    Add the time spent in the block to the current request's serialization
+    time (no-op when metrics are off).
+    """
+    timer = _current.get()
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        if timer is not None:
+            timer.serialize += time.perf_counter() - start
+
+
+class Registry:
+    """
+    In-process histograms keyed by metric name and (route, method) labels,
+    plus a request counter by status code.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.histograms = {}
+            self.requests = {}
+
+    def observe(self, route, method, status, timer, duration):
+        values = {
+            'notes_request_duration_seconds': duration,
+            'notes_request_db_duration_seconds': timer.db,
+            'notes_request_db_queries': timer.queries,
+            'notes_request_serialize_duration_seconds': timer.serialize,
+        }
+        with self.lock:
+            for name, value in values.items():
+                buckets = HISTOGRAMS[name][1]
+                # One count per bucket plus a last one for values above them all
+                counts, total = self.histograms.get((name, route, method), ([0] * (len(buckets) + 1), 0.0))
+                counts[bisect.bisect_left(buckets, value)] += 1
+                self.histograms[(name, route, method)] = (counts, total + value)
+            key = (route, method, status)
+            self.requests[key] = self.requests.get(key, 0) + 1
+
+    def render(self):
+        """
+        The registry in the Prometheus text exposition format.
+        """
+        with self.lock:
+            histograms = {key: (list(counts), total) for key, (counts, total) in self.histograms.items()}
+            requests = dict(self.requests)
+
+        lines = [
+            '# HELP notes_requests_total Requests handled',
+            '# TYPE notes_requests_total counter',
+        ]
+        for (route, method, status), count in sorted(requests.items()):
+            lines.append(f'notes_requests_total{{route="{route}",method="{method}",status="{status}"}} {count}')
+
+        for name, (help_text, buckets) in HISTOGRAMS.items():
+            lines += [f'# HELP {name} {help_text}', f'# TYPE {name} histogram']
+            for (metric, route, method), (counts, total) in sorted(histograms.items()):
+                if metric != name:
+                    continue
+                labels = f'route="{route}",method="{method}"'
+                cumulative = 0
+                for bound, count in zip(buckets, counts):
+                    cumulative += count
+                    lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {cumulative}')
+                lines.append(f'{name}_bucket{{{labels},le="+Inf"}} {sum(counts)}')
+                lines.append(f'{name}_sum{{{labels}}} {total:.6f}')
+                lines.append(f'{name}_count{{{labels}}} {sum(counts)}')
+
+        lines += ['# HELP notes_cache_requests_total Notes cache lookups', '# TYPE notes_cache_requests_total counter']
+        for namespace in ('list', 'feed', 'search', 'autocomplete'):
+            for outcome, count in cache_stats(namespace).items():
+                lines.append(f'notes_cache_requests_total{{namespace="{namespace}",outcome="{outcome}"}} {count}')
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+
+def route_name(request):
+    match = getattr(request, 'resolver_match', None)
+    if match is None:
+        return 'unmatched'
+    return match.url_name or match.route
+
+
+class MetricsMiddleware:
+    """
+    Record wall time, SQL time, query count and response rendering time of
+    every request into ``registry``, and report them to the client in a
+    ``Server-Timing`` header.
+
+    Enabled by ``NOTES_METRICS``; otherwise Django drops the middleware at
+    startup and it costs nothing. When enabled, each request costs a few
+    ``perf_counter`` calls per query and one short lock to update the
+    histograms (plus, under ASGI, one hop to the sync thread).
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not settings.NOTES_METRICS:
+            raise MiddlewareNotUsed()
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        install_query_timer()
+        timer = RequestTimer()
+        with timer.measure():
+            response = self.get_response(request)
+        return self.finish(request, response, timer)
+
+    async def __acall__(self, request):
+        # The async ORM runs queries in the request's thread-sensitive thread
+        await sync_to_async(install_query_timer)()
+        timer = RequestTimer()
+        with timer.measure():
+            response = await self.get_response(request)
+        return self.finish(request, response, timer)
+
+    def process_template_response(self, request, response):
+        # DRF responses are rendered after the view returns
+        timer = _current.get()
+        if timer is not None:
+            start = time.perf_counter()
+
+            def rendered(response):
+                timer.serialize += time.perf_counter() - start
+            response.add_post_render_callback(rendered)
+        return response
+
+    def finish(self, request, response, timer):
+        duration = time.perf_counter() - timer.start
+        registry.observe(route_name(request), request.method, response.status_code, timer, duration)
+        response['Server-Timing'] = ', '.join([
+            f'total;dur={duration * 1000:.1f}',
+            f'db;dur={timer.db * 1000:.1f};desc="{timer.queries} queries"',
+            f'serialize;dur={timer.serialize * 1000:.1f}',
+        ])
+        return response
+
+
+def metrics_view(request):
+    """
+    Serve ``registry`` in the Prometheus text format. With
+    ``NOTES_METRICS_TOKEN`` set, scrapers must send it as a bearer token.
+    """
+    if not settings.NOTES_METRICS:
+        return HttpResponseNotFound()
+    token = settings.NOTES_METRICS_TOKEN
+    if token and request.headers.get('Authorization') != f'Bearer {token}':
+        return HttpResponse(status=401)
+    return HttpResponse(registry.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
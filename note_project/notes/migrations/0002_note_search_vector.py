@@ -0,0 +1,89 @@
+# Generated by Django 4.2.6 on 2026-10-18 09:00
+
+import django.contrib.postgres.indexes
+import django.contrib.postgres.search
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.db import migrations
+
+
+SEARCH_VECTOR_SQL = """
+    setweight(to_tsvector('pg_catalog.english', coalesce({table}title, '')), 'A') ||
+    setweight(to_tsvector('pg_catalog.english', coalesce({table}content, '')), 'B')
+"""
+
+CREATE_TRIGGER_SQL = """
+CREATE OR REPLACE FUNCTION notes_note_search_vector_update() RETURNS trigger AS $$
+BEGIN
+    NEW.search_vector := {expression};
+    RETURN NEW;
+END
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER notes_note_search_vector_trigger
+    BEFORE INSERT OR UPDATE OF title, content ON notes_note
+    FOR EACH ROW EXECUTE FUNCTION notes_note_search_vector_update();
+""".format(expression=SEARCH_VECTOR_SQL.format(table='NEW.'))
+
+DROP_TRIGGER_SQL = """
+DROP TRIGGER IF EXISTS notes_note_search_vector_trigger ON notes_note;
+DROP FUNCTION IF EXISTS notes_note_search_vector_update();
+"""
+
+BACKFILL_BATCH_SIZE = 5000
+
+
+def backfill_search_vector(apps, schema_editor):
+    # The migration is non-atomic, so every batch commits on its own and only
+    # holds row locks on the rows it touches.
+    with schema_editor.connection.cursor() as cursor:
+        last_id = 0
+        while True:
+            cursor.execute(
+                """
+                WITH batch AS (
+                    SELECT id FROM notes_note
+                    WHERE id > %s
+                    ORDER BY id
+                    LIMIT %s
+                )
+                UPDATE notes_note
+                SET search_vector = {expression}
+                FROM batch
+                WHERE notes_note.id = batch.id
+                RETURNING notes_note.id
+                """.format(expression=SEARCH_VECTOR_SQL.format(table='notes_note.')),
+                [last_id, BACKFILL_BATCH_SIZE],
+            )
+            ids = [row[0] for row in cursor.fetchall()]
+            if not ids:
+                break
+            last_id = max(ids)
+
+
+class Migration(migrations.Migration):
+
+    atomic = False
+
+    dependencies = [
+        ("notes", "0001_initial"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="note",
+            name="search_vector",
+            field=django.contrib.postgres.search.SearchVectorField(
+                editable=False, null=True
+            ),
+        ),
+        # Install the trigger before backfilling so rows written while the
+        # backfill runs are covered too.
+        migrations.RunSQL(CREATE_TRIGGER_SQL, DROP_TRIGGER_SQL),
+        migrations.RunPython(backfill_search_vector, migrations.RunPython.noop),
+        AddIndexConcurrently(
+            model_name="note",
+            index=django.contrib.postgres.indexes.GinIndex(
+                fields=["search_vector"], name="notes_note_search_gin"
+            ),
+        ),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 4.2.6 on 2026-10-18 10:00
+
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    atomic = False
+
+    dependencies = [
+        ("notes", "0002_note_search_vector"),
+    ]
+
+    operations = [
+        AddIndexConcurrently(
+            model_name="note",
+            index=models.Index(
+                fields=["owner", "id"], name="notes_note_owner_id_idx"
+            ),
+        ),
+    ]
@@ -0,0 +1,66 @@
+# Generated by Django 4.2.6 on 2026-10-18 11:00
+
+from django.db import migrations, models
+
+
+CREATE_TRIGGERS_SQL = """
+CREATE OR REPLACE FUNCTION notes_note_revision_update() RETURNS trigger AS $$
+BEGIN
+    IF NEW.title IS DISTINCT FROM OLD.title
+        OR NEW.content IS DISTINCT FROM OLD.content
+        OR NEW.owner_id IS DISTINCT FROM OLD.owner_id THEN
+        NEW.revision := OLD.revision + 1;
+    ELSE
+        -- Never let a save() from a stale in-memory instance move it back.
+        NEW.revision := GREATEST(NEW.revision, OLD.revision);
+    END IF;
+    RETURN NEW;
+END
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER notes_note_revision_trigger
+    BEFORE UPDATE ON notes_note
+    FOR EACH ROW EXECUTE FUNCTION notes_note_revision_update();
+
+CREATE OR REPLACE FUNCTION notes_note_shared_with_revision_update() RETURNS trigger AS $$
+BEGIN
+    UPDATE notes_note SET revision = revision + 1
+    WHERE id IN (SELECT DISTINCT note_id FROM changed_rows);
+    RETURN NULL;
+END
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER notes_note_shared_with_insert_revision_trigger
+    AFTER INSERT ON notes_note_shared_with
+    REFERENCING NEW TABLE AS changed_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION notes_note_shared_with_revision_update();
+
+CREATE TRIGGER notes_note_shared_with_delete_revision_trigger
+    AFTER DELETE ON notes_note_shared_with
+    REFERENCING OLD TABLE AS changed_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION notes_note_shared_with_revision_update();
+"""
+
+DROP_TRIGGERS_SQL = """
+DROP TRIGGER IF EXISTS notes_note_shared_with_delete_revision_trigger ON notes_note_shared_with;
+DROP TRIGGER IF EXISTS notes_note_shared_with_insert_revision_trigger ON notes_note_shared_with;
+DROP FUNCTION IF EXISTS notes_note_shared_with_revision_update();
+DROP TRIGGER IF EXISTS notes_note_revision_trigger ON notes_note;
+DROP FUNCTION IF EXISTS notes_note_revision_update();
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("notes", "0003_note_owner_id_idx"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="note",
+            name="revision",
+            field=models.PositiveIntegerField(default=1, editable=False),
+        ),
+        migrations.RunSQL(CREATE_TRIGGERS_SQL, DROP_TRIGGERS_SQL),
+    ]
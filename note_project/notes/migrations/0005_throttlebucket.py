@@ -0,0 +1,28 @@
+# Generated by Django 4.2.6 on 2026-10-18 12:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("notes", "0004_note_revision"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="ThrottleBucket",
+            fields=[
+                (
+                    "key",
+                    models.CharField(max_length=255, primary_key=True, serialize=False),
+                ),
+                ("tat", models.FloatField()),
+            ],
+        ),
+        # Rate-limit state is not worth WAL writes or crash safety
+        migrations.RunSQL(
+            "ALTER TABLE notes_throttlebucket SET UNLOGGED",
+            "ALTER TABLE notes_throttlebucket SET LOGGED",
+        ),
+    ]
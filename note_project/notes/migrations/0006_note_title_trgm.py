@@ -0,0 +1,26 @@
+# Generated by Django 4.2.6 on 2026-10-18 13:00
+
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.operations import AddIndexConcurrently, TrigramExtension
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    atomic = False
+
+    dependencies = [
+        ("notes", "0005_throttlebucket"),
+    ]
+
+    operations = [
+        TrigramExtension(),
+        AddIndexConcurrently(
+            model_name="note",
+            index=GinIndex(
+                fields=["title"],
+                name="notes_note_title_trgm",
+                opclasses=["gin_trgm_ops"],
+            ),
+        ),
+    ]
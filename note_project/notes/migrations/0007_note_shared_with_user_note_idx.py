@@ -0,0 +1,23 @@
+# Generated by Django 4.2.6 on 2026-10-18 15:00
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    atomic = False
+
+    dependencies = [
+        ("notes", "0006_note_title_trgm"),
+    ]
+
+    # The shared_with table is created by Django and only indexed on
+    # (note_id, user_id) and on each column alone. Reading a user's shared
+    # notes in note order, as the feed does, needs (user_id, note_id).
+    operations = [
+        migrations.RunSQL(
+            "CREATE INDEX CONCURRENTLY IF NOT EXISTS notes_note_shared_with_user_note_idx "
+            "ON notes_note_shared_with (user_id, note_id)",
+            "DROP INDEX CONCURRENTLY IF EXISTS notes_note_shared_with_user_note_idx",
+        ),
+    ]
@@ -0,0 +1,185 @@
+# Generated by Django 4.2.6 on 2026-10-18 16:00
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.conf import settings
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.db import migrations, models
+
+
+CREATE_TRIGGERS_SQL = """
+CREATE OR REPLACE FUNCTION notes_note_timestamps_update() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        NEW.created_at := statement_timestamp();
+        NEW.updated_at := NEW.created_at;
+    ELSE
+        NEW.created_at := OLD.created_at;
+        -- The revision is bumped by notes_note_revision_trigger, which runs
+        -- first, and by the shared_with triggers.
+        IF NEW.revision <> OLD.revision THEN
+            NEW.updated_at := statement_timestamp();
+        ELSE
+            NEW.updated_at := OLD.updated_at;
+        END IF;
+    END IF;
+    RETURN NEW;
+END
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER notes_note_timestamps_trigger
+    BEFORE INSERT OR UPDATE ON notes_note
+    FOR EACH ROW EXECUTE FUNCTION notes_note_timestamps_update();
+
+CREATE OR REPLACE FUNCTION notes_note_delete_tombstones() RETURNS trigger AS $$
+BEGIN
+    INSERT INTO notes_notetombstone (user_id, note_id, deleted_at)
+    SELECT owner_id, id, statement_timestamp() FROM removed_rows
+    ON CONFLICT (user_id, note_id) DO UPDATE SET deleted_at = EXCLUDED.deleted_at;
+    RETURN NULL;
+END
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER notes_note_delete_tombstones_trigger
+    AFTER DELETE ON notes_note
+    REFERENCING OLD TABLE AS removed_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION notes_note_delete_tombstones();
+
+CREATE OR REPLACE FUNCTION notes_note_owner_tombstones() RETURNS trigger AS $$
+BEGIN
+    INSERT INTO notes_notetombstone (user_id, note_id, deleted_at)
+    VALUES (OLD.owner_id, OLD.id, statement_timestamp())
+    ON CONFLICT (user_id, note_id) DO UPDATE SET deleted_at = EXCLUDED.deleted_at;
+    DELETE FROM notes_notetombstone WHERE user_id = NEW.owner_id AND note_id = NEW.id;
+    RETURN NULL;
+END
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER notes_note_owner_tombstones_trigger
+    AFTER UPDATE OF owner_id ON notes_note
+    FOR EACH ROW WHEN (OLD.owner_id IS DISTINCT FROM NEW.owner_id)
+    EXECUTE FUNCTION notes_note_owner_tombstones();
+
+-- Django removes a note's shared_with rows before the note itself, so this
+-- also covers the recipients of deleted notes. Owners keep their notes.
+CREATE OR REPLACE FUNCTION notes_note_shared_with_unshare_tombstones() RETURNS trigger AS $$
+BEGIN
+    INSERT INTO notes_notetombstone (user_id, note_id, deleted_at)
+    SELECT removed.user_id, removed.note_id, statement_timestamp()
+    FROM removed_rows removed LEFT JOIN notes_note note ON note.id = removed.note_id
+    WHERE note.owner_id IS DISTINCT FROM removed.user_id
+    ON CONFLICT (user_id, note_id) DO UPDATE SET deleted_at = EXCLUDED.deleted_at;
+    RETURN NULL;
+END
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER notes_note_shared_with_unshare_tombstones_trigger
+    AFTER DELETE ON notes_note_shared_with
+    REFERENCING OLD TABLE AS removed_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION notes_note_shared_with_unshare_tombstones();
+
+-- A note shared again is visible again; its bumped updated_at syncs it
+CREATE OR REPLACE FUNCTION notes_note_shared_with_share_tombstones() RETURNS trigger AS $$
+BEGIN
+    DELETE FROM notes_notetombstone tombstone
+    USING added_rows added
+    WHERE tombstone.user_id = added.user_id AND tombstone.note_id = added.note_id;
+    RETURN NULL;
+END
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER notes_note_shared_with_share_tombstones_trigger
+    AFTER INSERT ON notes_note_shared_with
+    REFERENCING NEW TABLE AS added_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION notes_note_shared_with_share_tombstones();
+"""
+
+DROP_TRIGGERS_SQL = """
+DROP TRIGGER IF EXISTS notes_note_shared_with_share_tombstones_trigger ON notes_note_shared_with;
+DROP FUNCTION IF EXISTS notes_note_shared_with_share_tombstones();
+DROP TRIGGER IF EXISTS notes_note_shared_with_unshare_tombstones_trigger ON notes_note_shared_with;
+DROP FUNCTION IF EXISTS notes_note_shared_with_unshare_tombstones();
+DROP TRIGGER IF EXISTS notes_note_owner_tombstones_trigger ON notes_note;
+DROP FUNCTION IF EXISTS notes_note_owner_tombstones();
+DROP TRIGGER IF EXISTS notes_note_delete_tombstones_trigger ON notes_note;
+DROP FUNCTION IF EXISTS notes_note_delete_tombstones();
+DROP TRIGGER IF EXISTS notes_note_timestamps_trigger ON notes_note;
+DROP FUNCTION IF EXISTS notes_note_timestamps_update();
+"""
+
+
+class Migration(migrations.Migration):
+
+    atomic = False
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ("notes", "0007_note_shared_with_user_note_idx"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="NoteTombstone",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("note_id", models.BigIntegerField()),
+                ("deleted_at", models.DateTimeField()),
+                (
+                    "user",
+                    models.ForeignKey(
+                        db_constraint=False,
+                        db_index=False,
+                        on_delete=django.db.models.deletion.DO_NOTHING,
+                        related_name="+",
+                        to=settings.AUTH_USER_MODEL,
+                    ),
+                ),
+            ],
+            options={
+                "indexes": [
+                    models.Index(
+                        fields=["user", "deleted_at", "note_id"],
+                        name="notes_notetombstone_sync_idx",
+                    )
+                ],
+                "constraints": [
+                    models.UniqueConstraint(
+                        fields=("user", "note_id"),
+                        name="notes_notetombstone_user_note_uniq",
+                    )
+                ],
+            },
+        ),
+        # Existing notes are stamped with the migration time; the constant
+        # default is stored in the catalog instead of rewriting the table
+        migrations.AddField(
+            model_name="note",
+            name="created_at",
+            field=models.DateTimeField(
+                default=django.utils.timezone.now, editable=False
+            ),
+        ),
+        migrations.AddField(
+            model_name="note",
+            name="updated_at",
+            field=models.DateTimeField(
+                default=django.utils.timezone.now, editable=False
+            ),
+        ),
+        migrations.RunSQL(CREATE_TRIGGERS_SQL, DROP_TRIGGERS_SQL),
+        AddIndexConcurrently(
+            model_name="note",
+            index=models.Index(
+                fields=["owner", "updated_at", "id"],
+                name="notes_note_owner_updated_idx",
+            ),
+        ),
+    ]
@@ -0,0 +1,43 @@
+# Generated by Django 4.2.6 on 2026-10-18 17:00
+
+from django.db import migrations
+
+
+# Tunes Postgres' own TOAST storage of note bodies; there is no size
+# threshold or compression flag of our own, as TOAST has both already.
+# Postgres only starts compressing a row's large values, and moving them out
+# of line, once the row outgrows TOAST_TUPLE_THRESHOLD (about 2KB, fixed when
+# the server is built); smaller rows are stored as they are. toast_tuple_target
+# is how small it then tries to make the row: lowered from the default ~2KB
+# to 1KB, rows over the threshold keep less of their values in the heap,
+# which keeps more (title, owner) rows per page for listings that do not read
+# the content. Each stored value records whether and how it was compressed,
+# and is only decompressed when a query reads the column. lz4 compresses and
+# decompresses several times faster than the default pglz; it applies to
+# values written from now on, and is skipped on servers built without it.
+COMPRESSION_SQL = """
+ALTER TABLE notes_note SET (toast_tuple_target = 1024);
+DO $$
+BEGIN
+    ALTER TABLE notes_note ALTER COLUMN content SET COMPRESSION lz4;
+EXCEPTION WHEN feature_not_supported THEN
+    RAISE NOTICE 'lz4 is not available, notes_note.content keeps pglz compression';
+END
+$$;
+"""
+
+RESET_COMPRESSION_SQL = """
+ALTER TABLE notes_note ALTER COLUMN content SET COMPRESSION default;
+ALTER TABLE notes_note RESET (toast_tuple_target);
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("notes", "0008_note_timestamps_tombstones"),
+    ]
+
+    operations = [
+        migrations.RunSQL(COMPRESSION_SQL, RESET_COMPRESSION_SQL),
+    ]
@@ -1,20 +1,129 @@
 from django.contrib.auth.models import User
-from typing import Any
 from django.db import models
-from django.contrib.postgres.search import SearchQuery, SearchRank, SearchVector
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchVectorField
+from django.utils import timezone
+
+# Text search configuration used for the stored search vector. Queries must
+# use the same configuration for Postgres to be able to use the GIN index.
+SEARCH_CONFIG = 'english'
+
+
+class NoteManager(models.Manager):
+    """
+    Leaves ``search_vector`` unloaded. It is only ever written by a trigger
+    and read in SQL, and for long notes it is larger than the content.
+    """
+    def get_queryset(self):
+        return super().get_queryset().defer('search_vector')
+
+
 class Note(models.Model):
     title = models.CharField(max_length=255, blank=False)
     content = models.TextField()
     owner = models.ForeignKey(User, on_delete=models.CASCADE)
     shared_with = models.ManyToManyField(User, related_name='shared_notes', blank=True)
 
-    # # Add a search vector field
-    # search_vector = SearchVectorField(null=True, editable=False)
+    # Weighted tsvector (title 'A', content 'B'), maintained by the
+    # notes_note_search_vector_trigger database trigger so that bulk_create,
+    # queryset.update() and raw SQL writes keep it in sync as well.
+    search_vector = SearchVectorField(null=True, editable=False)
+
+    # Incremented by database triggers whenever the note's serialized state
+    # changes: its own columns or a row added to / removed from shared_with.
+    # Used to derive ETags without loading or serializing the note.
+    revision = models.PositiveIntegerField(default=1, editable=False)
+
+    # Set by the notes_note_timestamps_trigger database trigger from the
+    # statement's timestamp: on insert, and whenever the revision moves.
+    # The defaults only fill in unsaved instances; reload after a write to
+    # read the stored values.
+    created_at = models.DateTimeField(default=timezone.now, editable=False)
+    updated_at = models.DateTimeField(default=timezone.now, editable=False)
+
+    objects = NoteManager()
+
+    class Meta:
+        indexes = [
+            # Backs keyset pagination of a user's notes (owner_id, id < cursor)
+            models.Index(fields=['owner', 'id'], name='notes_note_owner_id_idx'),
+            # Backs delta sync of a user's notes (owner_id, (updated_at, id) > cursor)
+            models.Index(fields=['owner', 'updated_at', 'id'], name='notes_note_owner_updated_idx'),
+            GinIndex(fields=['search_vector'], name='notes_note_search_gin'),
+            # Trigram index answering prefix and typo-tolerant title lookups
+            GinIndex(fields=['title'], name='notes_note_title_trgm', opclasses=['gin_trgm_ops']),
+        ]
+
+    def __str__(self) -> str:
+        # owner_id rather than the owner, which would cost a query per note
+        return str(self.owner_id) + " - " + self.title
+
+
+class NoteTombstone(models.Model):
+    """
+    Record that a note stopped being visible to a user, because it was
+    deleted, unshared from them or given to another owner. Written and
+    removed by database triggers, and read by the sync endpoint.
+
+    There is no foreign key constraint on ``user``: tombstones are written
+    while a deleted user's notes are deleted, and are purged afterwards.
+    """
+    user = models.ForeignKey(User, on_delete=models.DO_NOTHING, db_constraint=False, db_index=False,
+                             related_name='+')
+    note_id = models.BigIntegerField()
+    deleted_at = models.DateTimeField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'note_id'], name='notes_notetombstone_user_note_uniq'),
+        ]
+        indexes = [
+            models.Index(fields=['user', 'deleted_at', 'note_id'], name='notes_notetombstone_sync_idx'),
+        ]
+
+
+class ThrottleBucket(models.Model):
+    """
+    Shared state of notes.throttles.GCRARateThrottle: one row per throttle
+    key holding its theoretical arrival time in epoch seconds. The table is
+    unlogged, as losing it on a crash only resets the rate limits.
+    """
+    key = models.CharField(max_length=255, primary_key=True)
+    tat = models.FloatField()
+
+
+class Task(models.Model):
+    """
+    A unit of background work, run by ``manage.py run_worker`` (see
+    notes.queue). ``available_at`` is when the task may next be claimed:
+    its start time while queued, and the end of its visibility timeout
+    while running, after which a task whose worker died is claimed again.
+    Tasks that succeed are deleted; failed ones are kept for inspection.
+    """
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    FAILED = 'failed'
+    STATUS_CHOICES = [(QUEUED, 'Queued'), (RUNNING, 'Running'), (FAILED, 'Failed')]
+
+    name = models.CharField(max_length=100)
+    payload = models.JSONField(default=dict)
+    # Higher runs first
+    priority = models.SmallIntegerField(default=0)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=QUEUED)
+    available_at = models.DateTimeField(default=timezone.now)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    max_attempts = models.PositiveSmallIntegerField(default=5)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(default=timezone.now, editable=False)
+
+    class Meta:
+        indexes = [
+            # Only claimable tasks are indexed, in claim order
+            models.Index(
+                models.F('priority').desc(), 'available_at', 'id',
+                name='notes_task_claim_idx', condition=models.Q(status__in=['queued', 'running']),
+            ),
+        ]
 
-    # def save(self, *args, **kwargs):
-    #     # Update search_vector on save
-    #     self.search_vector = SearchVector('title', 'content')
-    #     super().save(*args, **kwargs)
-    
     def __str__(self) -> str:
-        return self.owner.username + " " + str(self.owner.id) + " - " + self.title
+        return f"{self.name} #{self.id} ({self.status})"
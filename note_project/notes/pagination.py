@@ -0,0 +1,217 @@
+from django.conf import settings
+from rest_framework.pagination import CursorPagination, LimitOffsetPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+
+class NoteCursorPagination(CursorPagination):
+    """
+    Keyset pagination over a user's notes.
+
+    Ordering on the unique primary key means every page is fetched with
+    ``WHERE owner_id = ? AND id < ? ORDER BY id DESC LIMIT ?``, which the
+    ``(owner_id, id)`` index answers at the same cost however deep the page.
+    The cursor is opaque to clients and only ever contains a position.
+
+    ``paginate_queryset`` is split around the single query it runs so the
+    async views can evaluate that query with ``apaginate_queryset``.
+    """
+    ordering = '-id'
+    page_size_query_param = 'page_size'
+    max_page_size = getattr(settings, 'NOTES_MAX_PAGE_SIZE', 500)
+
+    def paginate_queryset(self, queryset, request, view=None):
+        queryset = self.get_page_queryset(queryset, request, view)
+        if queryset is None:
+            return None
+        return self.set_page(list(queryset))
+
+    async def apaginate_queryset(self, queryset, request, view=None):
+        queryset = self.get_page_queryset(queryset, request, view)
+        if queryset is None:
+            return None
+        return self.set_page([item async for item in queryset])
+
+    def get_page_queryset(self, queryset, request, view=None):
+        """
+        Return the sliced queryset holding the requested page plus one row.
+        """
+        if not self.read_position(request, queryset, view):
+            return None
+
+        # Always fetch an extra item to tell whether a following page exists.
+        queryset = self.bound(queryset)
+        return queryset[self.offset:self.offset + self.page_size + 1]
+
+    def read_position(self, request, queryset, view=None):
+        """
+        Read the page size and cursor of the request; False when the request
+        is not paginated.
+        """
+        self.page_size = self.get_page_size(request)
+        if not self.page_size:
+            return False
+
+        self.base_url = request.build_absolute_uri()
+        self.ordering = self.get_ordering(request, queryset, view)
+
+        self.cursor = self.decode_cursor(request)
+        if self.cursor is None:
+            (self.offset, self.reverse, self.current_position) = (0, False, None)
+        else:
+            (self.offset, self.reverse, self.current_position) = self.cursor
+        return True
+
+    def bound(self, queryset, field=None):
+        """
+        Order ``queryset`` for the page and filter it to rows past the
+        cursor position. ``field`` names the ordering column when it is
+        called differently in ``queryset`` (e.g. ``note_id``).
+        """
+        order = self.ordering[0]
+        is_reversed = order.startswith('-')
+        order_attr = field or order.lstrip('-')
+
+        # Cursor pagination always enforces an ordering.
+        if self.reverse != is_reversed:
+            queryset = queryset.order_by('-' + order_attr)
+        else:
+            queryset = queryset.order_by(order_attr)
+
+        # If we have a cursor with a fixed position then filter by that.
+        if self.current_position is not None:
+            # Test for: (cursor reversed) XOR (queryset reversed)
+            if self.cursor.reverse != is_reversed:
+                kwargs = {order_attr + '__lt': self.current_position}
+            else:
+                kwargs = {order_attr + '__gt': self.current_position}
+
+            queryset = queryset.filter(**kwargs)
+        return queryset
+
+    def set_page(self, results):
+        """
+        Work out the page and its next/previous positions from the rows
+        fetched for ``get_page_queryset``.
+        """
+        self.page = list(results[:self.page_size])
+
+        # Determine the position of the final item following the page.
+        if len(results) > len(self.page):
+            has_following_position = True
+            following_position = self._get_position_from_instance(results[-1], self.ordering)
+        else:
+            has_following_position = False
+            following_position = None
+
+        if self.reverse:
+            # The query ordering was reversed, so reverse the items back.
+            self.page = list(reversed(self.page))
+
+            self.has_next = (self.current_position is not None) or (self.offset > 0)
+            self.has_previous = has_following_position
+            if self.has_next:
+                self.next_position = self.current_position
+            if self.has_previous:
+                self.previous_position = following_position
+        else:
+            self.has_next = has_following_position
+            self.has_previous = (self.current_position is not None) or (self.offset > 0)
+            if self.has_next:
+                self.next_position = following_position
+            if self.has_previous:
+                self.previous_position = self.current_position
+
+        # Display page controls in the browsable API if there is more
+        # than one page.
+        if (self.has_previous or self.has_next) and self.template is not None:
+            self.display_page_controls = True
+
+        return self.page
+
+
+class NoteFeedPagination(NoteCursorPagination):
+    """
+    Keyset pagination over notes merged from several sources, such as the
+    notes a user owns and the notes shared with them.
+
+    Every source is bounded by the cursor and limited to the page on its own
+    index before the sources are merged, so a page costs the same whichever
+    source it comes from and however deep it is::
+
+        WHERE id IN ((SELECT id ... WHERE owner_id = ? AND id < ? ORDER BY id DESC LIMIT ?)
+                     UNION ALL
+                     (SELECT note_id ... WHERE user_id = ? AND note_id < ? ORDER BY note_id DESC LIMIT ?))
+        ORDER BY id DESC LIMIT ?
+    """
+
+    def paginate_feed(self, queryset, sources, request, view=None):
+        """
+        Paginate the notes of ``queryset`` whose ids come from ``sources``,
+        ``(queryset, field)`` pairs naming note ids in ``field``.
+        """
+        if not self.read_position(request, queryset, view):
+            return None
+
+        limit = self.offset + self.page_size + 1
+        ids = [self.bound(source, field).values_list(field, flat=True)[:limit] for source, field in sources]
+        if len(ids) > 1:
+            ids = [ids[0].union(*ids[1:], all=True)]
+        queryset = self.bound(queryset.filter(id__in=ids[0]))
+        return self.set_page(list(queryset[self.offset:limit]))
+
+
+class NoteSearchPagination(LimitOffsetPagination):
+    """
+    ``?limit=&offset=`` pagination of ranked search results.
+
+    Rank is not unique, so search pages by offset rather than keyset. No
+    ``COUNT(*)`` is run: one extra row tells whether a next page exists, so
+    the only query is ``ORDER BY rank DESC LIMIT ? OFFSET ?`` and Postgres
+    keeps a bounded top-N sort instead of ordering every match.
+    """
+    max_limit = getattr(settings, 'NOTES_MAX_PAGE_SIZE', 500)
+    template = None
+
+    def paginate_queryset(self, queryset, request, view=None):
+        queryset = self.get_page_queryset(queryset, request, view)
+        if queryset is None:
+            return None
+        return self.set_page(list(queryset))
+
+    async def apaginate_queryset(self, queryset, request, view=None):
+        queryset = self.get_page_queryset(queryset, request, view)
+        if queryset is None:
+            return None
+        return self.set_page([item async for item in queryset])
+
+    def get_page_queryset(self, queryset, request, view=None):
+        """
+        Return the sliced queryset holding the requested page plus one row.
+        """
+        self.limit = self.get_limit(request)
+        if self.limit is None:
+            return None
+
+        self.offset = self.get_offset(request)
+        self.request = request
+        return queryset[self.offset:self.offset + self.limit + 1]
+
+    def set_page(self, results):
+        self.has_next = len(results) > self.limit
+        return list(results[:self.limit])
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+
+        url = self.request.build_absolute_uri()
+        url = replace_query_param(url, self.limit_query_param, self.limit)
+        return replace_query_param(url, self.offset_query_param, self.offset + self.limit)
+
+    def get_paginated_response(self, data):
+        return Response({
+            'next': self.get_next_link(),
+            'previous': self.get_previous_link(),
+            'results': data,
+        })
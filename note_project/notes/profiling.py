@@ -0,0 +1,276 @@
+import contextvars
+import cProfile
+import io
+import json
+import os
+import pstats
+import random
+import re
+import sys
+import threading
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+
+from .metrics import route_name
+
+# Profile ids are file name stems: '<ns timestamp>-<route>-<method>'
+PROFILE_ID = re.compile(r'^\d+-[\w-]+-[A-Z]+$')
+
+_current = contextvars.ContextVar('notes_profile_record', default=None)
+
+
+class ProfileRecord:
+    """
+    What is captured about one candidate request: the SQL it ran and either
+    a cProfile profile (sampled requests) or stack samples (requests
+    watched for the latency threshold).
+    """
+
+    def __init__(self, request, reason):
+        self.request = request
+        self.reason = reason
+        self.started_at = time.time()
+        self.start = time.perf_counter()
+        self.statements = []
+        self.stacks = {}
+        self.profiler = None
+
+    def to_dict(self, response, duration):
+        data = {
+            'route': route_name(self.request),
+            'method': self.request.method,
+            'path': self.request.get_full_path(),
+            'status': response.status_code,
+            'reason': self.reason,
+            'started_at': self.started_at,
+            'duration_ms': round(duration * 1000, 3),
+            'sql': self.statements,
+        }
+        if self.profiler is not None:
+            data['profile'] = profile_rows(self.profiler)
+        if self.stacks:
+            data['stacks'] = [
+                {'stack': stack, 'samples': count}
+                for stack, count in sorted(self.stacks.items(), key=lambda item: -item[1])
+            ]
+        return data
+
+
+def profile_rows(profiler, limit=100):
+    """
+    The functions of a cProfile profile with the highest cumulative time.
+    """
+    stats = pstats.Stats(profiler, stream=io.StringIO())
+    rows = [
+        {
+            'function': f'{filename}:{line}({name})',
+            'calls': calls,
+            'tottime_ms': round(tottime * 1000, 3),
+            'cumtime_ms': round(cumtime * 1000, 3),
+        }
+        for (filename, line, name), (_, calls, tottime, cumtime, _) in stats.stats.items()
+    ]
+    return sorted(rows, key=lambda row: -row['cumtime_ms'])[:limit]
+
+
+def _record_sql(execute, sql, params, many, context):
+    record = _current.get()
+    if record is None:
+        return execute(sql, params, many, context)
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        record.statements.append({'sql': sql, 'duration_ms': round((time.perf_counter() - start) * 1000, 3)})
+
+
+def install_sql_recorder():
+    # Installed once per thread connection, like metrics.install_query_timer
+    for connection in connections.all():
+        if _record_sql not in connection.execute_wrappers:
+            connection.execute_wrappers.append(_record_sql)
+
+
+class StackSampler:
+    """
+    One daemon thread that samples the Python stacks of the threads handling
+    watched requests every ``interval`` seconds. Requests that finish under
+    the latency threshold drop their samples; nothing is done per request
+    beyond adding and removing it from ``watched``.
+    """
+
+    def __init__(self, interval):
+        self.interval = interval
+        self.watched = {}
+        self.lock = threading.Lock()
+        self.thread = None
+
+    def watch(self, record):
+        with self.lock:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, name='notes-stack-sampler', daemon=True)
+                self.thread.start()
+            self.watched[threading.get_ident()] = record
+
+    def unwatch(self):
+        with self.lock:
+            self.watched.pop(threading.get_ident(), None)
+
+    def run(self):
+        while True:
+            time.sleep(self.interval)
+            with self.lock:
+                watched = list(self.watched.items())
+            if not watched:
+                continue
+            frames = sys._current_frames()
+            for ident, record in watched:
+                frame = frames.get(ident)
+                if frame is not None:
+                    stack = ';'.join(reversed(list(folded_frames(frame))))
+                    record.stacks[stack] = record.stacks.get(stack, 0) + 1
+
+
+def folded_frames(frame, depth=64):
+    while frame is not None and depth:
+        code = frame.f_code
+        yield f'{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})'
+        frame = frame.f_back
+        depth -= 1
+
+
+class ProfileStore:
+    """
+    Profiles as JSON files in ``NOTES_PROFILE_DIR``, keeping only the newest
+    ``NOTES_PROFILE_MAX_FILES``.
+    """
+
+    @property
+    def directory(self):
+        return settings.NOTES_PROFILE_DIR
+
+    def save(self, data):
+        os.makedirs(self.directory, exist_ok=True)
+        route = re.sub(r'[^\w-]', '_', data['route'])
+        profile_id = f"{time.time_ns()}-{route}-{data['method']}"
+        path = os.path.join(self.directory, profile_id + '.json')
+        with open(path + '.tmp', 'w', encoding='utf-8') as f:
+            json.dump({'id': profile_id, **data}, f)
+        os.replace(path + '.tmp', path)
+
+        for stale in self.ids()[settings.NOTES_PROFILE_MAX_FILES:]:
+            try:
+                os.remove(os.path.join(self.directory, stale + '.json'))
+            except FileNotFoundError:
+                pass
+        return profile_id
+
+    def ids(self):
+        """
+        Stored profile ids, newest first.
+        """
+        try:
+            names = os.listdir(self.directory)
+        except FileNotFoundError:
+            return []
+        ids = [name[:-len('.json')] for name in names if name.endswith('.json')]
+        return sorted((profile_id for profile_id in ids if PROFILE_ID.match(profile_id)),
+                      key=lambda profile_id: int(profile_id.split('-', 1)[0]), reverse=True)
+
+    def load(self, profile_id):
+        if not PROFILE_ID.match(profile_id):
+            raise FileNotFoundError(profile_id)
+        with open(os.path.join(self.directory, profile_id + '.json'), encoding='utf-8') as f:
+            return json.load(f)
+
+
+store = ProfileStore()
+
+
+class ProfilingMiddleware:
+    """
+    Profile a sampled fraction of requests with cProfile
+    (``NOTES_PROFILE_SAMPLE_RATE``) and keep stack samples of any request
+    slower than ``NOTES_PROFILE_SLOW_MS``, together with the SQL each one
+    ran. ``NOTES_PROFILE_ROUTES`` limits both to the named routes.
+
+    Disabled unless one of the two is set. Requests that are neither
+    sampled nor watched for the threshold pay one random() call.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not settings.NOTES_PROFILE_SAMPLE_RATE and not settings.NOTES_PROFILE_SLOW_MS:
+            raise MiddlewareNotUsed()
+        self.get_response = get_response
+        self.sampler = StackSampler(settings.NOTES_PROFILE_STACK_INTERVAL_MS / 1000)
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def candidate(self, request):
+        if random.random() < settings.NOTES_PROFILE_SAMPLE_RATE:
+            return 'sampled'
+        if settings.NOTES_PROFILE_SLOW_MS:
+            return 'slow'
+        return None
+
+    def in_scope(self, request):
+        routes = settings.NOTES_PROFILE_ROUTES
+        return not routes or route_name(request) in routes
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+
+        reason = self.candidate(request)
+        if reason is None:
+            return self.get_response(request)
+
+        install_sql_recorder()
+        record = ProfileRecord(request, reason)
+        token = _current.set(record)
+        try:
+            if reason == 'sampled':
+                record.profiler = cProfile.Profile()
+                record.profiler.enable()
+            else:
+                self.sampler.watch(record)
+            try:
+                response = self.get_response(request)
+            finally:
+                if record.profiler is not None:
+                    record.profiler.disable()
+                else:
+                    self.sampler.unwatch()
+        finally:
+            _current.reset(token)
+        return self.finish(record, response)
+
+    async def __acall__(self, request):
+        # Coroutines interleave on the event loop thread, so async requests
+        # get their SQL and timing recorded but no profile or stacks
+        reason = self.candidate(request)
+        if reason is None:
+            return await self.get_response(request)
+
+        await sync_to_async(install_sql_recorder)()
+        record = ProfileRecord(request, reason)
+        token = _current.set(record)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _current.reset(token)
+        return self.finish(record, response)
+
+    def finish(self, record, response):
+        duration = time.perf_counter() - record.start
+        slow_ms = settings.NOTES_PROFILE_SLOW_MS
+        keep = record.reason == 'sampled' or duration * 1000 >= slow_ms
+        if keep and self.in_scope(record.request):
+            store.save(record.to_dict(response, duration))
+        return response
@@ -0,0 +1,116 @@
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.db import connection, transaction
+from django.db.models import Q
+from rest_framework.authtoken.models import Token
+
+from .hashing import hash_password, setup_worker
+from .serializers import ProvisionUserSerializer
+
+# Inserts the accounts that do not exist yet; a username taken since the
+# collision check is skipped rather than failing the whole batch
+INSERT_USERS_SQL = """
+    INSERT INTO {table} (username, email, password, first_name, last_name,
+                         is_superuser, is_staff, is_active, date_joined)
+    SELECT username, email, password, '', '', false, false, true, statement_timestamp()
+    FROM unnest(%s::text[], %s::text[], %s::text[]) AS account(username, email, password)
+    ON CONFLICT (username) DO NOTHING
+    RETURNING id, username
+"""
+
+
+def provision_users(accounts, workers=None):
+    """
+    Create many users, with auth tokens, from a list of
+    ``{"username", "email", "password"}`` dicts.
+
+    Every account is validated on its own. Usernames and emails are checked
+    against existing users in one query, and repeats within the batch are
+    rejected. Passwords are hashed in a pool of ``workers`` processes
+    (``NOTES_PROVISION_HASH_WORKERS``, default one per CPU), since hashing
+    costs far more than the inserts. Users and tokens are then inserted with
+    one statement each.
+
+    Returns one result per account, in input order, with a ``status`` of
+    ``created`` (and the new ``token``), ``invalid`` or ``exists``.
+    """
+    results = [{'username': account.get('username') if isinstance(account, dict) else None}
+               for account in accounts]
+    valid = {}
+    for index, account in enumerate(accounts):
+        serializer = ProvisionUserSerializer(data=account)
+        if not serializer.is_valid():
+            results[index].update(status='invalid', errors=serializer.errors)
+        else:
+            valid[index] = serializer.validated_data
+
+    # Collisions with existing users and earlier accounts of the batch
+    taken = User.objects.filter(
+        Q(username__in=[data['username'] for data in valid.values()]) |
+        Q(email__in=[data['email'] for data in valid.values()])
+    ).values_list('username', 'email')
+    usernames, emails = set(), set()
+    for username, email in taken:
+        usernames.add(username)
+        emails.add(email)
+    for index, data in list(valid.items()):
+        errors = {}
+        if data['username'] in usernames:
+            errors['username'] = ["Username already exists"]
+        if data['email'] in emails:
+            errors['email'] = ["email already exists"]
+        usernames.add(data['username'])
+        emails.add(data['email'])
+        if errors:
+            results[index].update(status='exists', errors=errors)
+            del valid[index]
+
+    if not valid:
+        return results
+
+    passwords = hash_passwords([data['password'] for data in valid.values()], workers)
+
+    with transaction.atomic():
+        with connection.cursor() as cursor:
+            cursor.execute(INSERT_USERS_SQL.format(table=User._meta.db_table), [
+                [data['username'] for data in valid.values()],
+                [data['email'] for data in valid.values()],
+                passwords,
+            ])
+            created = dict((username, user_id) for user_id, username in cursor.fetchall())
+        tokens = Token.objects.bulk_create([
+            Token(key=Token.generate_key(), user_id=user_id) for user_id in created.values()
+        ])
+    keys = {token.user_id: token.key for token in tokens}
+
+    for index, data in valid.items():
+        user_id = created.get(data['username'])
+        if user_id is None:
+            results[index].update(status='exists', errors={'username': ["Username already exists"]})
+        else:
+            results[index].update(status='created', id=user_id, token=keys[user_id])
+    return results
+
+
+def hash_passwords(passwords, workers=None):
+    """
+    Hash ``passwords`` with the default hasher across a process pool.
+    """
+    workers = min(workers or settings.NOTES_PROVISION_HASH_WORKERS or os.cpu_count() or 1, len(passwords))
+    if workers <= 1:
+        return [make_password(password) for password in passwords]
+
+    # Spawned rather than forked workers do not inherit this process' open
+    # database connections or threads; they only need the settings
+    with ProcessPoolExecutor(
+        max_workers=workers,
+        mp_context=multiprocessing.get_context('spawn'),
+        initializer=setup_worker,
+        initargs=(os.environ['DJANGO_SETTINGS_MODULE'],),
+    ) as pool:
+        return list(pool.map(hash_password, passwords, chunksize=max(len(passwords) // (workers * 4), 1)))
@@ -0,0 +1,232 @@
+import datetime
+import logging
+import threading
+import traceback
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from django.conf import settings
+from django.db import DatabaseError, close_old_connections, connections, router
+from django.utils import timezone
+
+from .models import Task
+
+logger = logging.getLogger(__name__)
+
+# Longest pause, in seconds, between claims while the database is failing
+MAX_CLAIM_BACKOFF = 60
+
+# Tasks by name, filled in by the @task decorator
+registry = {}
+
+# Claims up to %(limit)s tasks in one statement. SKIP LOCKED lets concurrent
+# workers pass over each other's rows instead of queueing on their locks.
+# The row locks end with the statement: a claimed task is kept from other
+# workers by pushing available_at past its visibility timeout instead, so
+# no transaction stays open while the task runs.
+CLAIM_SQL = """
+    UPDATE notes_task
+    SET status = 'running', attempts = attempts + 1,
+        available_at = statement_timestamp() + make_interval(secs => %(timeout)s)
+    WHERE id IN (
+        SELECT id FROM notes_task
+        WHERE status IN ('queued', 'running') AND available_at <= statement_timestamp()
+        ORDER BY priority DESC, available_at, id
+        LIMIT %(limit)s
+        FOR UPDATE SKIP LOCKED
+    )
+    RETURNING id, name, payload, priority, status, available_at, attempts, max_attempts, last_error, created_at
+"""
+
+
+class TaskFunction:
+    """
+    A registered task. Call it to run it inline, or ``enqueue`` it.
+    """
+
+    def __init__(self, func, name, priority, max_attempts, every=None):
+        self.func = func
+        self.name = name
+        self.priority = priority
+        self.max_attempts = max_attempts
+        self.every = every
+
+    def __call__(self, **payload):
+        return self.func(**payload)
+
+    def enqueue(self, priority=None, delay=0, **payload):
+        """
+        Queue the task with the keyword arguments as its JSON payload. Inside
+        a transaction, workers only see it once the transaction commits.
+        """
+        return Task.objects.create(
+            name=self.name,
+            payload=payload,
+            priority=self.priority if priority is None else priority,
+            available_at=timezone.now() + datetime.timedelta(seconds=delay),
+            max_attempts=self.max_attempts or settings.NOTES_TASK_MAX_ATTEMPTS,
+        )
+
+
+def task(name, priority=0, max_attempts=None, every=None):
+    """
+    Register a function as a background task under ``name``. Tasks may be
+    run more than once (after a retry or a visibility timeout), so they
+    must be safe to repeat.
+
+    Tasks with ``every`` (seconds) are periodic: workers queue them when
+    they start, and each run queues the next one ``every`` seconds later.
+    """
+    def register(func):
+        registry[name] = TaskFunction(func, name, priority, max_attempts, every)
+        return registry[name]
+    return register
+
+
+def schedule_periodic():
+    """
+    Queue every periodic task that is not queued or running already.
+    Workers starting together may both queue one; a periodic task then
+    just runs twice, which tasks must be safe to do anyway.
+    """
+    for func in registry.values():
+        if func.every and not Task.objects.filter(name=func.name).exclude(status=Task.FAILED).exists():
+            func.enqueue()
+
+
+def claim(limit, timeout=None):
+    """
+    Claim up to ``limit`` runnable tasks, highest priority first, for
+    ``timeout`` seconds (``NOTES_TASK_VISIBILITY_TIMEOUT``).
+    """
+    timeout = settings.NOTES_TASK_VISIBILITY_TIMEOUT if timeout is None else timeout
+    # The claim is a write, whatever the database router does with raw()
+    return list(Task.objects.raw(CLAIM_SQL, {'limit': limit, 'timeout': timeout}, using=router.db_for_write(Task)))
+
+
+def execute(claimed):
+    """
+    Run a claimed task and record the outcome. Outcomes are only written
+    while the claim is still current, i.e. no other worker has claimed the
+    task again after its visibility timeout.
+    """
+    current = Task.objects.filter(id=claimed.id, attempts=claimed.attempts)
+    func = registry.get(claimed.name)
+    if func is None or claimed.attempts > claimed.max_attempts:
+        # Unknown tasks, and tasks whose workers kept dying, are not run
+        error = f"Unknown task {claimed.name!r}" if func is None else "Too many attempts"
+        current.update(status=Task.FAILED, last_error=error)
+        return False
+
+    try:
+        func(**claimed.payload)
+    except Exception:
+        error = traceback.format_exc()
+        logger.exception("Task %s failed (attempt %s of %s)", claimed, claimed.attempts, claimed.max_attempts)
+        if claimed.attempts >= claimed.max_attempts:
+            current.update(status=Task.FAILED, last_error=error)
+        else:
+            # Exponential backoff before the next attempt
+            delay = settings.NOTES_TASK_RETRY_DELAY * 2 ** (claimed.attempts - 1)
+            current.update(status=Task.QUEUED, last_error=error,
+                           available_at=timezone.now() + datetime.timedelta(seconds=delay))
+        return False
+
+    current.delete()
+    if func.every:
+        func.enqueue(delay=func.every)
+    return True
+
+
+class Worker:
+    """
+    Claim tasks and run them on ``concurrency`` threads, claiming only as
+    many as there are idle threads so unclaimed tasks stay available to
+    other workers. With a concurrency of 1 tasks run on the calling thread.
+    """
+
+    def __init__(self, concurrency=1, timeout=None, poll_interval=None):
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self.poll_interval = settings.NOTES_TASK_POLL_INTERVAL if poll_interval is None else poll_interval
+        self.stopping = threading.Event()
+        self.processed = 0
+        self.failures = 0
+        self.scheduled = False
+
+    def stop(self):
+        self.stopping.set()
+
+    def run(self, once=False):
+        """
+        Run tasks until ``stop`` is called or, with ``once``, until no task
+        is runnable. Returns the number of tasks run.
+        """
+        if self.concurrency == 1:
+            while not self.stopping.is_set():
+                tasks = self.claim_tasks(1)
+                if tasks is None:
+                    continue
+                if tasks:
+                    execute(tasks[0])
+                    self.processed += 1
+                elif once:
+                    break
+                else:
+                    self.stopping.wait(self.poll_interval)
+            return self.processed
+
+        running = set()
+        with ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix='notes-worker') as pool:
+            while not self.stopping.is_set():
+                idle = self.concurrency - len(running)
+                tasks = self.claim_tasks(idle) if idle else []
+                if tasks is None:
+                    continue
+                running |= {pool.submit(self.execute_in_thread, claimed) for claimed in tasks}
+                if not running:
+                    if once:
+                        break
+                    self.stopping.wait(self.poll_interval)
+                    continue
+                # Claim again at once while tasks keep coming and threads are idle
+                done, running = wait(running, timeout=0 if tasks else self.poll_interval,
+                                     return_when=FIRST_COMPLETED)
+                self.processed += len(done)
+            wait(running)
+        self.processed += len(running)
+        return self.processed
+
+    def claim_tasks(self, limit):
+        """
+        Claim up to ``limit`` tasks. While the database is failing, log the
+        error and return None after an exponential backoff, so the worker
+        outlives database restarts and failovers.
+        """
+        # The main thread keeps its connections between claims; drop those
+        # that broke or outlived CONN_MAX_AGE, as the request cycle does,
+        # but never one a caller (such as a test case) holds in a transaction
+        for connection in connections.all(initialized_only=True):
+            if not connection.in_atomic_block:
+                connection.close_if_unusable_or_obsolete()
+        try:
+            if not self.scheduled:
+                schedule_periodic()
+                self.scheduled = True
+            tasks = claim(limit, self.timeout)
+        except DatabaseError:
+            delay = min(self.poll_interval * 2 ** self.failures, MAX_CLAIM_BACKOFF)
+            self.failures += 1
+            logger.exception("Claiming tasks failed, retrying in %ss", delay)
+            self.stopping.wait(delay)
+            return None
+        self.failures = 0
+        return tasks
+
+    def execute_in_thread(self, claimed):
+        # Pool threads keep their connections between tasks, like request
+        # threads, subject to CONN_MAX_AGE
+        close_old_connections()
+        try:
+            return execute(claimed)
+        finally:
+            close_old_connections()
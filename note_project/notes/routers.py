@@ -0,0 +1,133 @@
+import contextvars
+import random
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import DEFAULT_DB_ALIAS
+
+from .cache import apin_to_primary, pin_to_primary, pinned_to_primary
+
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+# Read from the primary whatever the request: accounts and tokens must be
+# current the moment they are created, and the throttle table is unlogged,
+# so it does not exist on replicas
+PRIMARY_APPS = {'auth', 'authtoken', 'contenttypes', 'sessions', 'admin'}
+PRIMARY_MODELS = {'notes.throttlebucket'}
+
+_current = contextvars.ContextVar('notes_replica_routing', default=None)
+
+
+class RoutingState:
+    """
+    Where the reads of one request go: the primary, or one replica picked
+    for the whole request so its queries see a single snapshot's lag.
+    """
+
+    def __init__(self, request):
+        self.request = request
+        self.primary = request.method not in SAFE_METHODS
+        self.replica = random.choice(settings.NOTES_READ_REPLICAS)
+        self.sticky = None
+
+    def use_primary(self):
+        if self.primary:
+            return True
+        if self.sticky is None:
+            # Looked up once, on the first read after authentication
+            user = getattr(self.request, 'user', None)
+            self.sticky = user is not None and user.is_authenticated and pinned_to_primary(user.id)
+        return self.sticky
+
+
+class ReplicaRouter:
+    """
+    Send the reads of safe requests to the ``NOTES_READ_REPLICAS`` aliases
+    and everything else to the primary (``default``).
+
+    Reads stay on the primary for unsafe requests, for views with
+    ``use_primary = True``, for users who wrote recently (see
+    ``notes.cache.pin_to_primary``) and outside of requests, e.g. in
+    management commands. ``select_for_update()`` queries are routed as
+    writes by Django, so locking reads always go to the primary.
+    """
+
+    def db_for_read(self, model, **hints):
+        state = _current.get()
+        if state is None:
+            return None
+        if model._meta.app_label in PRIMARY_APPS or model._meta.label_lower in PRIMARY_MODELS:
+            return None
+        if state.use_primary():
+            return None
+        return state.replica
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        databases = {DEFAULT_DB_ALIAS, *settings.NOTES_READ_REPLICAS}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # Replicas are copies of the primary and are never migrated
+        return db == DEFAULT_DB_ALIAS
+
+
+class ReplicaRoutingMiddleware:
+    """
+    Make ``ReplicaRouter`` route the current request, and pin the user to
+    the primary after an unsafe request.
+
+    Enabled by ``NOTES_READ_REPLICAS``; otherwise every query goes to the
+    primary and the middleware is dropped at startup.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not settings.NOTES_READ_REPLICAS:
+            raise MiddlewareNotUsed()
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        state = RoutingState(request)
+        token = _current.set(state)
+        try:
+            response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        if self.wrote(state):
+            pin_to_primary([state.request.user.id])
+        return response
+
+    async def __acall__(self, request):
+        state = RoutingState(request)
+        token = _current.set(state)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _current.reset(token)
+        if self.wrote(state):
+            await apin_to_primary([state.request.user.id])
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        view_class = getattr(view_func, 'view_class', view_func)
+        if getattr(view_class, 'use_primary', False):
+            state = _current.get()
+            if state is not None:
+                state.primary = True
+
+    def wrote(self, state):
+        # Writes that change notes pin their whole audience when they bump
+        # its versions; this also covers the user's other writes
+        user = getattr(state.request, 'user', None)
+        return state.request.method not in SAFE_METHODS and user is not None and user.is_authenticated
@@ -1,12 +1,105 @@
 from rest_framework import serializers
 from .models import Note
 from django.contrib.auth.models import User
+from django.contrib.auth.validators import UnicodeUsernameValidator
+from django.contrib.postgres.expressions import ArraySubquery
+from django.db.models import OuterRef, Q
 
-class NoteSerializer(serializers.ModelSerializer):
+class DynamicFieldsMixin:
+    """
+    Takes an optional ``fields`` argument naming the fields to keep, so list
+    endpoints can serve sparse fieldsets.
+    """
+    def __init__(self, *args, **kwargs):
+        fields = kwargs.pop('fields', None)
+        super().__init__(*args, **kwargs)
+
+        if fields is not None:
+            for name in set(self.fields) - set(fields):
+                self.fields.pop(name)
+
+
+class NoteSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
     owner = serializers.PrimaryKeyRelatedField(queryset=User.objects.all(), default=serializers.CurrentUserDefault())
     class Meta:
         model = Note
-        fields = '__all__'
+        exclude = ['search_vector', 'revision', 'created_at', 'updated_at']
+
+    def to_representation(self, instance):
+        # shared_with ids in ascending order, whatever order they are read in
+        data = super().to_representation(instance)
+        if 'shared_with' in data:
+            data['shared_with'] = sorted(data['shared_with'])
+        return data
+
+
+class NoteSyncSerializer(NoteSerializer):
+    """
+    Read-only note representation of the sync endpoint, with timestamps.
+    """
+    class Meta(NoteSerializer.Meta):
+        exclude = ['search_vector', 'revision']
+
+
+class NoteSummarySerializer(NoteSerializer):
+    """
+    Compact, read-only note representation for listings: the content is
+    replaced by a ``snippet`` annotated in SQL by the view.
+    """
+    snippet = serializers.CharField(read_only=True)
+
+    class Meta(NoteSerializer.Meta):
+        exclude = ['search_vector', 'revision', 'created_at', 'updated_at', 'content']
+
+
+def note_values(notes, fields):
+    """
+    Read-only fast path of ``NoteSerializer`` and its subclasses for
+    listings: ``notes`` as a ``values()`` queryset of the columns of
+    ``fields``, plus the ``id``. The ``shared_with`` ids come sorted from an
+    ARRAY subquery of the same query, evaluated only for the rows returned.
+    Turn its rows into output with ``note_data``.
+    """
+    columns = ['id', *[field for field in fields if field not in ('id', 'shared_with')]]
+    if 'shared_with' not in fields:
+        return notes.values(*columns)
+    # Named apart from the shared_with field, which values() cannot shadow
+    return notes.values(*columns, shared_ids=ArraySubquery(
+        Note.shared_with.through.objects.filter(note_id=OuterRef('id')).order_by('user_id').values('user_id')
+    ))
+
+
+def note_data(rows, fields):
+    """
+    The data ``NoteSerializer(notes, many=True, fields=fields)`` would
+    return for rows of ``note_values``, without per-field dispatch; both
+    list ``shared_with`` ids in ascending order, so it renders to the same
+    JSON.
+    """
+    keys = [(field, 'shared_ids' if field == 'shared_with' else field) for field in fields]
+    return [{field: row[key] for field, key in keys} for row in rows]
+
+
+class NoteBatchCreateSerializer(NoteSerializer):
+    """
+    One create operation of a batch request. The owner is always the
+    requesting user and shared_with ids are checked in bulk by the view,
+    so validating a whole batch costs no per-item queries.
+    """
+    owner = serializers.HiddenField(default=serializers.CurrentUserDefault())
+    shared_with = serializers.ListField(child=serializers.IntegerField(), required=False)
+
+
+class NoteBatchUpdateSerializer(NoteBatchCreateSerializer):
+    """
+    One update operation of a batch request, validated as a partial update.
+    """
+    id = serializers.IntegerField()
+
+    def validate(self, data):
+        if 'id' not in data:
+            raise serializers.ValidationError({'id': ['This field is required.']})
+        return data
 
 
 class RegisterSerializer(serializers.Serializer):
@@ -15,24 +108,38 @@ class RegisterSerializer(serializers.Serializer):
     password = serializers.CharField()
 
     def validate(self, data):
-            if data['username']:
-                if User.objects.filter(username=data['username']).exists():
+            # One query for both uniqueness checks
+            taken = User.objects.filter(
+                Q(username=data['username']) | Q(email=data['email'])
+            ).values_list('username', flat=True)
+            for username in taken:
+                if username == data['username']:
                     raise serializers.ValidationError("Username already exists")
-                
-            if data['email']:
-                if User.objects.filter(email=data['email']).exists():
-                    raise serializers.ValidationError("email already exists")
-                
+            if taken:
+                raise serializers.ValidationError("email already exists")
+
             return data
     
     def create(self, validated_data):
-        user = User.objects.create(username=validated_data['username'], email=validated_data['email'])
-        user.set_password(validated_data['password'])
-        user.save()
-        print(validated_data)
+        # The password is hashed before the single INSERT
+        User.objects.create_user(
+            username=validated_data['username'],
+            email=validated_data['email'],
+            password=validated_data['password'],
+        )
         return validated_data
     
 
+class ProvisionUserSerializer(serializers.Serializer):
+    """
+    One account of a bulk provisioning request. Only the fields are checked
+    here; collisions are looked up for the whole batch in one query.
+    """
+    username = serializers.CharField(max_length=150, validators=[UnicodeUsernameValidator()])
+    email = serializers.EmailField()
+    password = serializers.CharField(max_length=128)
+
+
 class LoginSerializer(serializers.Serializer):
     # email = serializers.EmailField()
     username = serializers.CharField()
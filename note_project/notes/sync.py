@@ -0,0 +1,113 @@
+import base64
+import datetime
+
+from django.conf import settings
+from django.db import connection
+from django.utils import timezone
+
+from .models import NoteTombstone
+
+EPOCH = datetime.datetime(1970, 1, 1, tzinfo=datetime.timezone.utc)
+
+# Upper bound of the changes a sync reads: rows newer than the settle lag
+# are left for a later sync, so a write committing after a newer one has
+# been read is not skipped
+SETTLED_SQL = "SELECT statement_timestamp() - make_interval(secs => %s)"
+
+# Changes visible to a user after a (timestamp, note id) position, up to the
+# settled bound, oldest first: notes they own, notes shared with them and
+# tombstones. Each source is read in order from its own index and limited
+# before they are merged.
+CHANGES_SQL = """
+    (
+        SELECT false AS deleted, id AS note_id, updated_at AS changed_at
+        FROM notes_note
+        WHERE owner_id = %(user)s
+          AND (%(at)s::timestamptz IS NULL OR (updated_at, id) > (%(at)s, %(id)s))
+          AND updated_at <= %(settled)s
+        ORDER BY updated_at, id
+        LIMIT %(limit)s
+    )
+    UNION
+    (
+        SELECT false, note.id, note.updated_at
+        FROM notes_note note
+        JOIN notes_note_shared_with shared ON shared.note_id = note.id
+        WHERE shared.user_id = %(user)s
+          AND (%(at)s::timestamptz IS NULL OR (note.updated_at, note.id) > (%(at)s, %(id)s))
+          AND note.updated_at <= %(settled)s
+        ORDER BY note.updated_at, note.id
+        LIMIT %(limit)s
+    )
+    UNION ALL
+    (
+        SELECT true, note_id, deleted_at
+        FROM notes_notetombstone
+        WHERE user_id = %(user)s
+          AND %(at)s::timestamptz IS NOT NULL AND (deleted_at, note_id) > (%(at)s, %(id)s)
+          AND deleted_at <= %(settled)s
+        ORDER BY deleted_at, note_id
+        LIMIT %(limit)s
+    )
+    ORDER BY changed_at, note_id
+    LIMIT %(limit)s
+"""
+
+
+class CursorExpired(Exception):
+    pass
+
+
+def encode_cursor(changed_at, note_id):
+    """
+    Opaque sync cursor for the position of a change.
+    """
+    micros = (changed_at - EPOCH) // datetime.timedelta(microseconds=1)
+    return base64.urlsafe_b64encode(f'{micros}.{note_id}'.encode()).decode()
+
+
+def decode_cursor(cursor):
+    """
+    Position ``(changed_at, note_id)`` of a sync cursor. Raises
+    ``ValueError`` for malformed cursors and ``CursorExpired`` for cursors
+    older than the tombstones kept.
+    """
+    try:
+        micros, note_id = base64.urlsafe_b64decode(cursor.encode()).decode().split('.')
+        changed_at = EPOCH + datetime.timedelta(microseconds=int(micros))
+        note_id = int(note_id)
+    except (ValueError, UnicodeDecodeError, OverflowError):
+        raise ValueError("Invalid sync cursor")
+    if changed_at < timezone.now() - datetime.timedelta(days=settings.NOTES_SYNC_TOMBSTONE_DAYS):
+        raise CursorExpired()
+    return changed_at, note_id
+
+
+def changes_since(user, position, limit):
+    """
+    Up to ``limit`` changes visible to ``user`` after ``position`` (None
+    for a full sync, which skips tombstones), as ``(deleted, note_id,
+    changed_at)`` rows in order, and the settled time they were read up to.
+    """
+    at, note_id = position or (None, 0)
+    with connection.cursor() as cursor:
+        cursor.execute(SETTLED_SQL, [settings.NOTES_SYNC_SETTLE_SECONDS])
+        settled = cursor.fetchone()[0]
+        cursor.execute(CHANGES_SQL, {'user': user.id, 'at': at, 'id': note_id, 'limit': limit, 'settled': settled})
+        return cursor.fetchall(), settled
+
+
+def purge_tombstones():
+    """
+    Delete tombstones older than ``NOTES_SYNC_TOMBSTONE_DAYS``, which no
+    valid cursor can reach, and those of deleted users.
+    """
+    cutoff = timezone.now() - datetime.timedelta(days=settings.NOTES_SYNC_TOMBSTONE_DAYS)
+    expired, _ = NoteTombstone.objects.filter(deleted_at__lt=cutoff).delete()
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "DELETE FROM notes_notetombstone tombstone WHERE NOT EXISTS "
+            "(SELECT 1 FROM auth_user WHERE auth_user.id = tombstone.user_id)"
+        )
+        orphaned = cursor.rowcount
+    return expired + orphaned
@@ -0,0 +1,78 @@
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import connection, transaction
+
+from .cache import bump_notes_version, note_audience
+from .models import Note
+from .queue import task
+from .sync import purge_tombstones as purge_sync_tombstones
+from .throttles import purge_expired_buckets
+
+
+@task('notes.purge_user', priority=-10)
+def purge_user(user_id):
+    """
+    Delete a user and their notes, ``NOTES_TASK_BATCH_SIZE`` notes per
+    transaction rather than in the one long cascade of ``user.delete()``.
+    Users the notes were shared with get tombstones and fresh listings, as
+    do the owners and recipients of other notes shared with the user.
+    """
+    while True:
+        with transaction.atomic():
+            ids = list(
+                Note.objects.filter(owner_id=user_id).order_by('id')
+                .values_list('id', flat=True)[:settings.NOTES_TASK_BATCH_SIZE]
+            )
+            if not ids:
+                break
+            audience = note_audience(ids)
+            Note.objects.filter(id__in=ids).delete()
+            bump_notes_version(audience)
+    with transaction.atomic():
+        # Deleting the user drops them from the shared_with of others' notes
+        audience = note_audience(Note.shared_with.through.objects.filter(user_id=user_id).values('note_id'))
+        User.objects.filter(id=user_id).delete()
+        bump_notes_version(audience - {user_id})
+
+
+@task('notes.reindex_notes')
+def reindex_notes(owner_id=None):
+    """
+    Recompute the search vectors of all notes, or of one owner's, in
+    batches, e.g. after changing the text search configuration. Assigning
+    the title to itself fires the search vector trigger without changing
+    the note's revision.
+    """
+    notes = Note.objects.all() if owner_id is None else Note.objects.filter(owner_id=owner_id)
+    last_id = 0
+    while True:
+        ids = list(notes.filter(id__gt=last_id).order_by('id').values_list('id', flat=True)[:settings.NOTES_TASK_BATCH_SIZE])
+        if not ids:
+            break
+        with connection.cursor() as cursor:
+            cursor.execute("UPDATE notes_note SET title = title WHERE id = ANY(%s::bigint[])", [ids])
+        last_id = ids[-1]
+
+
+@task('notes.analyze_notes', priority=-5)
+def analyze_notes():
+    """
+    Refresh the planner statistics of the notes tables after a large
+    import, rather than waiting for autovacuum to notice.
+    """
+    with connection.cursor() as cursor:
+        cursor.execute("ANALYZE notes_note, notes_note_shared_with")
+
+
+@task('notes.purge_tombstones', priority=-10)
+def purge_tombstones():
+    purge_sync_tombstones()
+
+
+@task('notes.purge_throttle_buckets', priority=-10, every=settings.NOTES_THROTTLE_PURGE_INTERVAL)
+def purge_throttle_buckets():
+    """
+    Delete throttle buckets that have drained, so the table only holds
+    recently active (user, scope) pairs.
+    """
+    purge_expired_buckets()
@@ -1,9 +1,35 @@
+import datetime
+import gzip
+import io
+import json
+import tempfile
+import time
+import warnings
+
 from django.contrib.auth.models import User
-from . models import Note
+from . models import Note, NoteTombstone, Task, ThrottleBucket
 from rest_framework.test import APIClient
 from rest_framework.test import APITestCase
 from rest_framework import status
+from rest_framework.renderers import JSONRenderer
 from rest_framework.authtoken.models import Token
+from unittest import mock
+from django.core.cache import caches
+from django.core.management import CommandError, call_command
+from django.db import OperationalError, connection, connections
+from django.db.models import F, Prefetch
+from django.db.models.functions import Substr
+from django.test import Client, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from .cache import cache_stats, get_notes_version
+from .metrics import registry
+from .pagination import NoteCursorPagination
+from .queue import TaskFunction, Worker, claim, execute, registry as task_registry
+from .routers import ReplicaRouter
+from .serializers import NoteSerializer, NoteSummarySerializer, note_data, note_values
+from .sync import decode_cursor, encode_cursor
+from .tasks import purge_throttle_buckets, reindex_notes
 
 class NoteTestCase(APITestCase):
 
@@ -167,8 +193,8 @@ class NoteTestCase(APITestCase):
 
         # Check the response
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        self.assertEqual(len(response.data), 1)
-        self.assertEqual(response.data[0]['title'], "Billy Smith")
+        self.assertEqual(len(response.data['results']), 1)
+        self.assertEqual(response.data['results'][0]['title'], "Billy Smith")
 
     def test_get_notes_without_query(self):
         '''
@@ -181,3 +207,1768 @@ class NoteTestCase(APITestCase):
         # Check the response
         self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
         self.assertEqual(response.data['detail'], "Please provide a search query")
+
+
+class NoteSearchVectorTestCase(APITestCase):
+
+    """
+    Test suite for the stored search vector
+    """
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser1', password='this_is_a_test')
+        self.token = Token.objects.create(user=self.user)
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + self.token.key)
+        self.url = "http://127.0.0.1:8000/api/search/"
+
+    def test_search_vector_populated_on_bulk_create_and_update(self):
+        '''
+        test search vector is maintained for writes that skip save()
+        '''
+        Note.objects.bulk_create([
+            Note(title="Groceries", content="apples and pears", owner=self.user),
+        ])
+        self.assertTrue(Note.objects.filter(search_vector="apples").exists())
+
+        Note.objects.update(content="bananas")
+        self.assertFalse(Note.objects.filter(search_vector="apples").exists())
+        self.assertTrue(Note.objects.filter(search_vector="bananas").exists())
+
+    def test_search_ranks_title_above_content(self):
+        '''
+        test title matches rank above content matches
+        '''
+        Note.objects.create(title="Shopping", content="remember the budget", owner=self.user)
+        Note.objects.create(title="Budget", content="monthly numbers", owner=self.user)
+        Note.objects.create(title="Unrelated", content="nothing here", owner=self.user)
+
+        response = self.client.get(self.url, {"q": "budget"})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([note['title'] for note in response.data['results']], ["Budget", "Shopping"])
+
+
+class NoteSearchTestCase(APITestCase):
+
+    """
+    Test suite for scoped, paginated search
+    """
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser1', password='this_is_a_test')
+        self.other = User.objects.create_user(username='testuser2', password='this_is_a_test')
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + Token.objects.create(user=self.user).key)
+        self.url = "http://127.0.0.1:8000/api/search/"
+
+    def search(self, params):
+        response = self.client.get(self.url, params)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response
+
+    def test_only_own_and_shared_notes(self):
+        '''
+        test search never returns notes the user cannot see
+        '''
+        own = Note.objects.create(title="Mine", content="secret plans", owner=self.user)
+        shared = Note.objects.create(title="Shared", content="secret plans", owner=self.other)
+        shared.shared_with.add(self.user)
+        Note.objects.create(title="Private", content="secret plans", owner=self.other)
+
+        response = self.search({"q": "secret"})
+        self.assertEqual(sorted(note['id'] for note in response.data['results']), [own.id, shared.id])
+
+    def test_websearch_syntax_and_threshold(self):
+        '''
+        test quoted phrases and excluded words, and the minimum rank
+        '''
+        Note.objects.create(title="Garden", content="plant the red roses", owner=self.user)
+        Note.objects.create(title="Kitchen", content="red onions and roses", owner=self.user)
+
+        response = self.search({"q": '"red roses"'})
+        self.assertEqual([note['title'] for note in response.data['results']], ["Garden"])
+        response = self.search({"q": "roses -onions"})
+        self.assertEqual([note['title'] for note in response.data['results']], ["Garden"])
+
+        with self.settings(NOTES_SEARCH_MIN_RANK=1):
+            self.assertEqual(self.search({"q": "roses"}).data['results'], [])
+
+    def test_paginated_with_headline(self):
+        '''
+        test results are paged by limit/offset and carry a highlighted snippet
+        '''
+        Note.objects.bulk_create([
+            Note(title=f"Note {i}", content="lorem " * 200 + "needle " + "ipsum " * 200, owner=self.user)
+            for i in range(5)
+        ])
+        response = self.search({"q": "needle", "limit": 2})
+        self.assertEqual(len(response.data['results']), 2)
+        self.assertIsNone(response.data['previous'])
+        note = response.data['results'][0]
+        self.assertNotIn('content', note)
+        self.assertIn("<b>needle</b>", note['snippet'])
+        self.assertLess(len(note['snippet']), 400)
+
+        seen = [note['id'] for note in response.data['results']]
+        while response.data['next']:
+            response = self.client.get(response.data['next'])
+            seen += [note['id'] for note in response.data['results']]
+        self.assertEqual(sorted(seen), sorted(Note.objects.values_list('id', flat=True)))
+
+        response = self.search({"q": "needle", "view": "full", "fields": "id,content"})
+        self.assertEqual(set(response.data['results'][0]), {"id", "content"})
+
+
+class NoteSearchCacheTestCase(APITestCase):
+
+    """
+    Test suite for the search result cache
+    """
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser1', password='this_is_a_test')
+        self.other = User.objects.create_user(username='testuser2', password='this_is_a_test')
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + Token.objects.create(user=self.user).key)
+        self.url = "http://127.0.0.1:8000/api/search/"
+        caches['notes'].clear()
+        self.shared = Note.objects.create(title="Roadmap", content="quarterly plan", owner=self.other)
+        self.shared.shared_with.add(self.user)
+        Note.objects.create(title="Plan", content="my own plan", owner=self.user)
+
+    def test_repeated_search_skips_ranking(self):
+        '''
+        test a repeated search only loads the cached page of ids
+        '''
+        first = self.client.get(self.url, {"q": "plan"})
+        hits = cache_stats('search')['hits']
+        with CaptureQueriesContext(connection) as queries:
+            second = self.client.get(self.url, {"q": "  PLAN "})
+        self.assertEqual(cache_stats('search')['hits'], hits + 1)
+        self.assertEqual(second.data, first.data)
+        self.assertFalse(any('ts_rank_cd' in query['sql'] for query in queries.captured_queries))
+
+        # Other representations of the same page reuse the entry
+        response = self.client.get(self.url, {"q": "plan", "fields": "id,title"})
+        self.assertEqual(cache_stats('search')['hits'], hits + 2)
+        self.assertEqual([note['title'] for note in response.data['results']],
+                         [note['title'] for note in first.data['results']])
+
+    def test_invalidated_by_changes_to_visible_notes(self):
+        '''
+        test edits to shared notes by their owner invalidate cached searches
+        '''
+        response = self.client.get(self.url, {"q": "quarterly"})
+        self.assertEqual(len(response.data['results']), 1)
+
+        other = APIClient()
+        other.credentials(HTTP_AUTHORIZATION='Token ' + Token.objects.create(user=self.other).key)
+        other.put(f"http://127.0.0.1:8000/api/notes/{self.shared.id}/", {"content": "yearly plan"}, format='json')
+
+        response = self.client.get(self.url, {"q": "quarterly"})
+        self.assertEqual(response.data['results'], [])
+
+    def test_pages_are_cached_separately(self):
+        '''
+        test each page of results has its own entry
+        '''
+        hits = cache_stats('search')['hits']
+        first = self.client.get(self.url, {"q": "plan", "limit": 1})
+        second = self.client.get(first.data['next'])
+        self.assertEqual(cache_stats('search')['hits'], hits)
+        self.assertNotEqual(first.data['results'], second.data['results'])
+        self.assertIsNone(second.data['next'])
+
+
+class NoteAutocompleteTestCase(APITestCase):
+
+    """
+    Test suite for title autocomplete
+    """
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser1', password='this_is_a_test')
+        self.other = User.objects.create_user(username='testuser2', password='this_is_a_test')
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + Token.objects.create(user=self.user).key)
+        self.url = "http://127.0.0.1:8000/api/search/autocomplete/"
+        caches['notes'].clear()
+
+    def titles(self, params):
+        response = self.client.get(self.url, params)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return [note['title'] for note in response.data['results']]
+
+    def test_prefix_and_typo_matches(self):
+        '''
+        test prefixes rank first, typos still match and hidden notes do not
+        '''
+        Note.objects.create(title="Weekly groceries", content="", owner=self.user)
+        Note.objects.create(title="Groceries", content="", owner=self.user)
+        shared = Note.objects.create(title="Grocery budget", content="", owner=self.other)
+        shared.shared_with.add(self.user)
+        Note.objects.create(title="Groceries for Bob", content="", owner=self.other)
+        Note.objects.create(title="Travel plans", content="", owner=self.user)
+
+        self.assertEqual(self.titles({"q": "GROC"}), ["Grocery budget", "Groceries", "Weekly groceries"])
+        self.assertIn("Groceries", self.titles({"q": "grocceries"}))
+        self.assertEqual(self.titles({"q": "groc", "limit": 1}), ["Grocery budget"])
+
+    def test_short_prefix(self):
+        '''
+        test prefixes below the minimum length return nothing without a query
+        '''
+        Note.objects.create(title="Groceries", content="", owner=self.user)
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.titles({"q": "gr"}), [])
+        self.assertFalse(any('notes_note"' in query['sql'] for query in queries.captured_queries))
+
+    def test_cached_until_notes_change(self):
+        '''
+        test a prefix is served from cache until the user's notes change
+        '''
+        Note.objects.create(title="Groceries", content="", owner=self.user)
+        self.titles({"q": "groc"})
+        hits = cache_stats()['hits']
+        self.assertEqual(self.titles({"q": " Groc "}), ["Groceries"])
+        self.assertEqual(cache_stats()['hits'], hits + 1)
+
+        self.client.post("http://127.0.0.1:8000/api/notes/", {"title": "Grocer", "content": "x"}, format='json')
+        self.assertEqual(self.titles({"q": "groc"}), ["Grocer", "Groceries"])
+
+
+class NotePaginationTestCase(APITestCase):
+
+    """
+    Test suite for keyset pagination of the notes list
+    """
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser1', password='this_is_a_test')
+        self.token = Token.objects.create(user=self.user)
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + self.token.key)
+        self.url = "http://127.0.0.1:8000/api/notes/"
+
+    def test_walk_pages_with_next_cursor(self):
+        '''
+        test every note is returned exactly once when following next cursors
+        '''
+        Note.objects.bulk_create([
+            Note(title=f"Note {i}", content="content", owner=self.user) for i in range(7)
+        ])
+        seen = []
+        response = self.client.get(self.url, {"page_size": 3})
+        while True:
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertLessEqual(len(response.data['results']), 3)
+            seen += [note['id'] for note in response.data['results']]
+            if not response.data['next']:
+                break
+            response = self.client.get(response.data['next'])
+
+        expected = list(Note.objects.order_by('-id').values_list('id', flat=True))
+        self.assertEqual(seen, expected)
+
+    def test_page_size_is_capped(self):
+        '''
+        test page_size larger than NOTES_MAX_PAGE_SIZE is clamped
+        '''
+        Note.objects.bulk_create([
+            Note(title=f"Note {i}", content="content", owner=self.user) for i in range(3)
+        ])
+        with mock.patch.object(NoteCursorPagination, 'max_page_size', 2):
+            response = self.client.get(self.url, {"page_size": 1000})
+        self.assertEqual(len(response.data['results']), 2)
+        self.assertIsNotNone(response.data['next'])
+
+
+class NoteFeedTestCase(APITestCase):
+
+    """
+    Test suite for the merged feed of own and shared notes
+    """
+    def setUp(self):
+        caches['notes'].clear()
+        self.user = User.objects.create_user(username='testuser1', password='this_is_a_test')
+        self.other = User.objects.create_user(username='testuser2', password='this_is_a_test')
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + Token.objects.create(user=self.user).key)
+        self.url = "http://127.0.0.1:8000/api/notes/feed/"
+
+        # Owned and shared notes interleaved by id, plus one the user cannot see
+        self.owned, self.shared = [], []
+        for i in range(4):
+            self.owned.append(Note.objects.create(title=f"Mine {i}", content="content", owner=self.user))
+            note = Note.objects.create(title=f"Theirs {i}", content="content", owner=self.other)
+            note.shared_with.add(self.user)
+            self.shared.append(note)
+        Note.objects.create(title="Private", content="content", owner=self.other)
+
+    def ids(self, notes):
+        return sorted((note.id for note in notes), reverse=True)
+
+    def test_scopes(self):
+        '''
+        test the feed filters to owned, shared or all visible notes
+        '''
+        response = self.client.get(self.url)
+        self.assertEqual([note['id'] for note in response.data['results']], self.ids(self.owned + self.shared))
+        response = self.client.get(self.url, {"scope": "owned"})
+        self.assertEqual([note['id'] for note in response.data['results']], self.ids(self.owned))
+        response = self.client.get(self.url, {"scope": "shared"})
+        self.assertEqual([note['id'] for note in response.data['results']], self.ids(self.shared))
+
+        response = self.client.get(self.url, {"scope": "everyone"})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_walk_pages_in_constant_queries(self):
+        '''
+        test following next cursors returns every note once, one query per page
+        '''
+        seen = []
+        response = self.client.get(self.url, {"page_size": 3, "fields": "id,title"})
+        while True:
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            seen += [note['id'] for note in response.data['results']]
+            if not response.data['next']:
+                break
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(response.data['next'])
+            notes_queries = [q['sql'] for q in queries.captured_queries if 'notes_note' in q['sql']]
+            self.assertEqual(len(notes_queries), 1)
+            self.assertIn('UNION ALL', notes_queries[0])
+        self.assertEqual(seen, self.ids(self.owned + self.shared))
+
+    def test_unsharing_updates_feed(self):
+        '''
+        test a note unshared by its owner leaves the recipient's feed
+        '''
+        self.client.get(self.url, {"scope": "shared"})
+        other = APIClient()
+        other.credentials(HTTP_AUTHORIZATION='Token ' + Token.objects.create(user=self.other).key)
+        other.delete("http://127.0.0.1:8000/api/notes/share/",
+                     {"notes": [self.shared[0].id], "users": [self.user.id]}, format='json')
+        response = self.client.get(self.url, {"scope": "shared"})
+        self.assertEqual([note['id'] for note in response.data['results']], self.ids(self.shared[1:]))
+
+    def test_shared_note_detail_is_read_only(self):
+        '''
+        test a shared note can be read but not changed by the recipient
+        '''
+        url = f"http://127.0.0.1:8000/api/notes/{self.shared[0].id}/"
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['title'], "Theirs 0")
+        self.assertEqual(self.client.put(url, {"title": "Mine now"}, format='json').status_code,
+                         status.HTTP_404_NOT_FOUND)
+        self.assertEqual(self.client.delete(url).status_code, status.HTTP_404_NOT_FOUND)
+
+
+@override_settings(NOTES_SYNC_SETTLE_SECONDS=0)
+class NoteSyncTestCase(APITestCase):
+
+    """
+    Test suite for delta sync with change cursors and tombstones
+    """
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser1', password='this_is_a_test')
+        self.other = User.objects.create_user(username='testuser2', password='this_is_a_test')
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + Token.objects.create(user=self.user).key)
+        self.url = "http://127.0.0.1:8000/api/notes/sync/"
+
+    def sync(self, cursor=None, **params):
+        if cursor:
+            params['cursor'] = cursor
+        response = self.client.get(self.url, params)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response.data
+
+    def test_timestamps_follow_changes(self):
+        '''
+        test updated_at moves on edits and shares only, and created_at never
+        '''
+        note = Note.objects.create(title="Note", content="content", owner=self.user)
+        note.refresh_from_db()
+        created_at = note.created_at
+        self.assertEqual(note.updated_at, created_at)
+
+        note.save()
+        note.refresh_from_db()
+        self.assertEqual(note.updated_at, created_at)
+
+        Note.objects.filter(id=note.id).update(title="Renamed")
+        note.refresh_from_db()
+        self.assertGreater(note.updated_at, created_at)
+        updated_at = note.updated_at
+
+        note.shared_with.add(self.other)
+        note.refresh_from_db()
+        self.assertGreater(note.updated_at, updated_at)
+        self.assertEqual(note.created_at, created_at)
+
+    def test_changes_since_cursor(self):
+        '''
+        test only edits, new shares and removals since the cursor are returned
+        '''
+        Note.objects.create(title="Kept", content="content", owner=self.user)
+        edited = Note.objects.create(title="Edited", content="content", owner=self.user)
+        deleted = Note.objects.create(title="Deleted", content="content", owner=self.user)
+        unshared = Note.objects.create(title="Unshared", content="content", owner=self.other)
+        unshared.shared_with.add(self.user)
+
+        data = self.sync()
+        self.assertEqual([note['title'] for note in data['notes']], ["Kept", "Edited", "Deleted", "Unshared"])
+        self.assertEqual(data['deleted'], [])
+        self.assertIn('updated_at', data['notes'][0])
+        cursor = data['cursor']
+        self.assertEqual(self.sync(cursor)['notes'], [])
+
+        self.client.put(f"http://127.0.0.1:8000/api/notes/{edited.id}/", {"title": "Edited again"}, format='json')
+        self.client.delete(f"http://127.0.0.1:8000/api/notes/{deleted.id}/")
+        unshared.shared_with.remove(self.user)
+        resharing = Note.objects.create(title="Shared", content="content", owner=self.other)
+        resharing.shared_with.add(self.user)
+
+        data = self.sync(cursor)
+        self.assertEqual([note['title'] for note in data['notes']], ["Edited again", "Shared"])
+        self.assertEqual(sorted(data['deleted']), sorted([deleted.id, unshared.id]))
+
+        # Sharing a note again drops its tombstone and sends the note
+        unshared.shared_with.add(self.user)
+        data = self.sync(cursor)
+        self.assertEqual(data['deleted'], [deleted.id])
+        self.assertIn(unshared.id, [note['id'] for note in data['notes']])
+
+    def test_pages_through_changes(self):
+        '''
+        test large change sets are paged without gaps or repeats
+        '''
+        Note.objects.bulk_create([
+            Note(title=f"Note {i}", content="content", owner=self.user) for i in range(7)
+        ])
+        seen, cursor = [], None
+        while True:
+            data = self.sync(cursor, page_size=3)
+            self.assertLessEqual(len(data['notes']), 3)
+            seen += [note['id'] for note in data['notes']]
+            cursor = data['cursor']
+            if not data['has_more']:
+                break
+        self.assertEqual(seen, list(Note.objects.order_by('id').values_list('id', flat=True)))
+
+    def test_idle_clients_keep_fresh_cursors(self):
+        '''
+        test caught-up syncs move the cursor to the settled time, even with no changes
+        '''
+        data = self.sync()
+        self.assertEqual(data['notes'], [])
+        self.assertIsNotNone(data['cursor'])
+
+        # A client idle for most of the tombstone window gets a current cursor
+        idle = encode_cursor(timezone.now() - datetime.timedelta(days=29), 0)
+        data = self.sync(idle)
+        self.assertFalse(data['has_more'])
+        self.assertGreater(decode_cursor(data['cursor'])[0], timezone.now() - datetime.timedelta(minutes=1))
+
+        note = Note.objects.create(title="Note", content="content", owner=self.user)
+        data = self.sync(data['cursor'])
+        self.assertEqual([changed['id'] for changed in data['notes']], [note.id])
+        self.assertEqual(self.sync(data['cursor'])['notes'], [])
+
+    def test_invalid_and_expired_cursors(self):
+        '''
+        test bad cursors are rejected and old ones must start a full sync
+        '''
+        response = self.client.get(self.url, {"cursor": "not-a-cursor"})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+        old = encode_cursor(timezone.now() - datetime.timedelta(days=31), 1)
+        response = self.client.get(self.url, {"cursor": old})
+        self.assertEqual(response.status_code, status.HTTP_410_GONE)
+
+        note = Note.objects.create(title="Note", content="content", owner=self.user)
+        note.delete()
+        NoteTombstone.objects.update(deleted_at=timezone.now() - datetime.timedelta(days=31))
+        call_command('purge_tombstones', stdout=io.StringIO())
+        self.assertFalse(NoteTombstone.objects.exists())
+
+
+class NoteStorageTestCase(APITestCase):
+
+    """
+    Test suite for compressed storage and lazy loading of note bodies
+    """
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser1', password='this_is_a_test')
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + Token.objects.create(user=self.user).key)
+
+    def stored(self, content):
+        note = Note.objects.create(title="Log", content=content, owner=self.user)
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT pg_column_size(content), pg_column_compression(content), pg_column_size(search_vector) "
+                "FROM notes_note WHERE id = %s", [note.id]
+            )
+            return cursor.fetchone()
+
+    def test_content_is_compressed_above_the_toast_threshold(self):
+        '''
+        test bodies whose rows pass the ~2KB toast threshold are compressed and smaller ones are not
+        '''
+        # Punctuation has no lexemes, so the content alone sizes the row
+        size, method, vector_size = self.stored("=" * 1900)
+        self.assertLess(vector_size, 64)
+        self.assertGreaterEqual(size, 1900)
+        self.assertIsNone(method)
+
+        size, method, vector_size = self.stored("=" * 2100)
+        self.assertLess(vector_size, 64)
+        self.assertLess(size, 2100 // 4)
+        self.assertIsNotNone(method)
+
+    def test_unused_columns_are_not_loaded(self):
+        '''
+        test the search vector is never read, nor the content when deleting
+        '''
+        note = Note.objects.create(title="Note", content="content", owner=self.user)
+        url = f"http://127.0.0.1:8000/api/notes/{note.id}/"
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.client.get(url).status_code, status.HTTP_200_OK)
+            self.client.put(url, {"title": "Renamed"}, format='json')
+        self.assertFalse([q for q in queries.captured_queries if 'search_vector' in q['sql']])
+
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.client.delete(url).status_code, status.HTTP_204_NO_CONTENT)
+        self.assertFalse([q for q in queries.captured_queries if '"notes_note"."content"' in q['sql']])
+
+
+@override_settings(NOTES_READ_REPLICAS=['replica'])
+class ReplicaRoutingTestCase(APITestCase):
+
+    """
+    Test suite for read-replica routing with read-your-writes stickiness.
+    The replica alias mirrors the test database over its own connection,
+    so it does not see what a test writes, like a lagging replica.
+    """
+    databases = {'default', 'replica'}
+
+    def setUp(self):
+        caches['notes'].clear()
+        self.user = User.objects.create_user(username='testuser1', password='this_is_a_test')
+        self.other = User.objects.create_user(username='testuser2', password='this_is_a_test')
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + Token.objects.create(user=self.user).key)
+        self.other_client = APIClient()
+        self.other_client.credentials(HTTP_AUTHORIZATION='Token ' + Token.objects.create(user=self.other).key)
+        self.url = "http://127.0.0.1:8000/api/notes/"
+
+    def test_reads_go_to_replica(self):
+        '''
+        test safe requests read notes from the replica and tokens from the primary
+        '''
+        note = Note.objects.create(title="Unreplicated", content="content", owner=self.user)
+        with CaptureQueriesContext(connections['replica']) as queries:
+            response = self.client.get(self.url)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertEqual(response.data['results'], [])
+            response = self.client.get(f"{self.url}{note.id}/")
+            self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        self.assertTrue(queries.captured_queries)
+        self.assertFalse([q for q in queries.captured_queries if 'authtoken' in q['sql']])
+
+        # Outside of a request everything stays on the primary
+        self.assertIsNone(ReplicaRouter().db_for_read(Note))
+
+    def test_writers_read_their_writes(self):
+        '''
+        test the writer and the users shared with read from the primary for a while
+        '''
+        response = self.client.post(self.url, {"title": "Fresh", "content": "content"}, format='json')
+        note_id = response.data['id']
+        self.client.post(f"{self.url}{note_id}/share/", {"user_to_share_with": self.other.id}, format='json')
+
+        with CaptureQueriesContext(connections['replica']) as queries:
+            self.assertEqual(self.client.get(f"{self.url}{note_id}/").status_code, status.HTTP_200_OK)
+            self.assertEqual(self.other_client.get(f"{self.url}{note_id}/").status_code, status.HTTP_200_OK)
+        self.assertFalse(queries.captured_queries)
+
+        # Once the window is over the replica is read again
+        caches['notes'].delete(f'notes:primary:{self.other.id}')
+        self.assertEqual(self.other_client.get(f"{self.url}{note_id}/").status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_use_primary_views(self):
+        '''
+        test views that opt out of replicas read from the primary
+        '''
+        Note.objects.create(title="Unreplicated", content="content", owner=self.user)
+        with override_settings(NOTES_SYNC_SETTLE_SECONDS=0), \
+                CaptureQueriesContext(connections['replica']) as queries:
+            response = self.client.get("http://127.0.0.1:8000/api/notes/sync/")
+        self.assertEqual([note['title'] for note in response.data['notes']], ["Unreplicated"])
+        self.assertFalse(queries.captured_queries)
+
+
+class TaskQueueTestCase(APITestCase):
+
+    """
+    Test suite for the database-backed background task queue
+    """
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser1', password='this_is_a_test')
+        self.other = User.objects.create_user(username='testuser2', password='this_is_a_test')
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + Token.objects.create(user=self.user).key)
+
+    def test_claim_order_and_visibility_timeout(self):
+        '''
+        test tasks are claimed by priority, hidden while claimed and claimed again after the timeout
+        '''
+        low = reindex_notes.enqueue(owner_id=self.user.id)
+        high = reindex_notes.enqueue(priority=5, owner_id=self.other.id)
+        later = reindex_notes.enqueue(delay=60)
+
+        self.assertEqual([claimed.id for claimed in claim(1)], [high.id])
+        self.assertEqual([claimed.id for claimed in claim(5)], [low.id])
+        self.assertEqual(claim(5), [])
+
+        # A worker that dies leaves its task to be claimed once the timeout ends
+        Task.objects.filter(id=high.id).update(available_at=timezone.now())
+        claimed, = claim(5)
+        self.assertEqual((claimed.id, claimed.attempts, claimed.status), (high.id, 2, Task.RUNNING))
+        self.assertTrue(execute(claimed))
+        self.assertEqual(list(Task.objects.values_list('id', flat=True).order_by('id')), [low.id, later.id])
+
+    def test_retries_then_fails(self):
+        '''
+        test a failing task is retried with backoff and then kept as failed
+        '''
+        def explode():
+            raise RuntimeError("boom")
+
+        with mock.patch.dict(task_registry, {'tests.explode': TaskFunction(explode, 'tests.explode', 0, 2)}):
+            queued = task_registry['tests.explode'].enqueue()
+            with self.assertLogs('notes.queue', level='ERROR'):
+                self.assertFalse(execute(claim(1)[0]))
+            queued.refresh_from_db()
+            self.assertEqual(queued.status, Task.QUEUED)
+            self.assertGreater(queued.available_at, timezone.now())
+            self.assertIn("RuntimeError: boom", queued.last_error)
+
+            Task.objects.filter(id=queued.id).update(available_at=timezone.now())
+            with self.assertLogs('notes.queue', level='ERROR'):
+                self.assertFalse(execute(claim(1)[0]))
+            queued.refresh_from_db()
+            self.assertEqual((queued.status, queued.attempts), (Task.FAILED, 2))
+            self.assertEqual(claim(1), [])
+
+    def test_worker_survives_database_errors(self):
+        '''
+        test a failing claim is logged and retried with backoff instead of stopping the worker
+        '''
+        worker = Worker(poll_interval=0.5)
+        errors = [OperationalError("server closed the connection unexpectedly")] * 2
+        with mock.patch('notes.queue.claim', side_effect=errors + [[]]) as claimed, \
+                mock.patch.object(worker.stopping, 'wait') as waited, \
+                self.assertLogs('notes.queue', level='ERROR') as logs:
+            self.assertEqual(worker.run(once=True), 0)
+        self.assertEqual(claimed.call_count, 3)
+        self.assertEqual([call.args for call in waited.call_args_list], [(0.5,), (1.0,)])
+        self.assertIn("OperationalError", logs.output[0])
+        self.assertEqual(worker.failures, 0)
+
+    def test_account_deletion_runs_in_background(self):
+        '''
+        test deleting an account disables it at once and purges its notes in the worker
+        '''
+        note = Note.objects.create(title="Shared", content="content", owner=self.user)
+        note.shared_with.add(self.other)
+        Note.objects.create(title="Private", content="content", owner=self.user)
+
+        response = self.client.delete("http://127.0.0.1:8000/api/auth/account/")
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        self.assertEqual(self.client.get("http://127.0.0.1:8000/api/notes/").status_code, status.HTTP_401_UNAUTHORIZED)
+        self.assertEqual(Note.objects.count(), 2)
+
+        with self.settings(NOTES_TASK_BATCH_SIZE=1):
+            call_command('run_worker', '--once', '--concurrency', '1', stdout=io.StringIO())
+        self.assertFalse(User.objects.filter(id=self.user.id).exists())
+        self.assertFalse(Note.objects.exists())
+        self.assertFalse(Task.objects.exclude(name=purge_throttle_buckets.name).exists())
+        self.assertTrue(NoteTombstone.objects.filter(user=self.other, note_id=note.id).exists())
+
+    def test_account_deletion_refreshes_notes_shared_with_the_user(self):
+        '''
+        test owners of notes shared with a deleted user get listings without them
+        '''
+        third = User.objects.create_user(username='testuser3', password='this_is_a_test')
+        note = Note.objects.create(title="Theirs", content="content", owner=self.other)
+        note.shared_with.add(self.user, third)
+        owner = APIClient()
+        owner.credentials(HTTP_AUTHORIZATION='Token ' + Token.objects.create(user=self.other).key)
+        recipient = APIClient()
+        recipient.credentials(HTTP_AUTHORIZATION='Token ' + Token.objects.create(user=third).key)
+        feed = "http://127.0.0.1:8000/api/notes/feed/"
+        self.assertEqual(owner.get(feed).data['results'][0]['shared_with'], [self.user.id, third.id])
+        self.assertEqual(recipient.get(feed).data['results'][0]['shared_with'], [self.user.id, third.id])
+
+        self.client.delete("http://127.0.0.1:8000/api/auth/account/")
+        call_command('run_worker', '--once', '--concurrency', '1', stdout=io.StringIO())
+        self.assertEqual(owner.get(feed).data['results'][0]['shared_with'], [third.id])
+        self.assertEqual(recipient.get(feed).data['results'][0]['shared_with'], [third.id])
+
+
+class NoteAdminTestCase(APITestCase):
+    '''
+    The note changelist joins owners, reads only the start of the content
+    and does not count large tables exactly.
+    '''
+    url = "/admin/notes/note/"
+
+    def setUp(self):
+        self.superuser = User.objects.create_superuser(username='root', email='root@example.com', password='this_is_a_test')
+        self.client.force_login(self.superuser)
+        self.owners = [User.objects.create_user(username=f'owner{i}', password='this_is_a_test') for i in range(3)]
+
+    def changelist_queries(self, url=None):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url or self.url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response, [query['sql'] for query in queries.captured_queries]
+
+    def test_changelist_queries_do_not_grow_with_rows(self):
+        Note.objects.create(title="First", content="x" * 500, owner=self.owners[0])
+        _, few = self.changelist_queries()
+        for owner in self.owners:
+            Note.objects.bulk_create([Note(title=f"Note {i}", content="x" * 500, owner=owner) for i in range(5)])
+        response, many = self.changelist_queries()
+        self.assertEqual(len(few), len(many))
+        notes = response.context['cl'].result_list
+        self.assertIn('content', notes[0].get_deferred_fields())
+        self.assertContains(response, "x" * 80 + "…")
+        self.assertNotContains(response, "x" * 81)
+
+    def test_large_tables_use_the_planner_estimate(self):
+        Note.objects.create(title="First", content="Content", owner=self.owners[0])
+        _, queries = self.changelist_queries()
+        self.assertEqual(sum('COUNT(' in sql for sql in queries), 1)
+        with override_settings(NOTES_ADMIN_EXACT_COUNT_LIMIT=-1):
+            _, queries = self.changelist_queries()
+        self.assertFalse(any('COUNT(' in sql for sql in queries))
+
+    def test_search_and_owner_filter(self):
+        Note.objects.create(title="Groceries", content="Milk", owner=self.owners[0])
+        Note.objects.create(title="Groceries again", content="Bread", owner=self.owners[1])
+        Note.objects.create(title="Holiday", content="Beach", owner=self.owners[1])
+
+        response, queries = self.changelist_queries(self.url + "?q=groceries")
+        self.assertEqual({note.title for note in response.context['cl'].result_list}, {"Groceries", "Groceries again"})
+        self.assertTrue(any('%>' in sql for sql in queries))
+
+        response, _ = self.changelist_queries(self.url + f"?owner={self.owners[1].id}")
+        self.assertEqual({note.title for note in response.context['cl'].result_list}, {"Groceries again", "Holiday"})
+        response, _ = self.changelist_queries(self.url + "?owner=nobody")
+        self.assertEqual(len(response.context['cl'].result_list), 0)
+
+    def test_reassigning_a_note_refreshes_the_old_owner(self):
+        '''
+        test the previous owner's cached listing drops a note moved to someone else
+        '''
+        note = Note.objects.create(title="Moving", content="Content", owner=self.owners[0])
+        old_owner = APIClient()
+        old_owner.credentials(HTTP_AUTHORIZATION='Token ' + Token.objects.create(user=self.owners[0]).key)
+        notes = "http://127.0.0.1:8000/api/notes/"
+        self.assertEqual(len(old_owner.get(notes).data['results']), 1)
+
+        response = self.client.post(f"{self.url}{note.id}/change/", {
+            "title": "Moving", "content": "Content", "owner": self.owners[1].id, "shared_with": "",
+        })
+        self.assertEqual(response.status_code, status.HTTP_302_FOUND)
+        self.assertEqual(old_owner.get(notes).data['results'], [])
+
+    def test_change_form_uses_raw_id_widgets(self):
+        note = Note.objects.create(title="First", content="Content", owner=self.owners[0])
+        note.shared_with.add(self.owners[1])
+        response = self.client.get(f"{self.url}{note.id}/change/")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertContains(response, 'class="vForeignKeyRawIdAdminField"')
+        self.assertContains(response, 'class="vManyToManyRawIdAdminField"')
+        self.assertNotContains(response, '<option value="%d"' % self.owners[2].id)
+        self.assertEqual(str(note), f"{self.owners[0].id} - First")
+
+
+class NoteValuesTestCase(APITestCase):
+    '''
+    The values() fast path renders the same JSON as NoteSerializer.
+    '''
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser1', password='this_is_a_test')
+        self.others = [User.objects.create_user(username=f'other{i}', password='this_is_a_test') for i in range(3)]
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + Token.objects.create(user=self.user).key)
+        Note.objects.create(title="Alone", content="Nobody else", owner=self.user)
+        shared = Note.objects.create(title="Shared été \U0001f600", content="Line 1\nLine \"2\"", owner=self.user)
+        # Added out of id order; both paths list them sorted
+        shared.shared_with.add(self.others[2], self.others[0])
+
+    def shared_with_ids(self, order):
+        return Prefetch('shared_with', queryset=User.objects.only('id').order_by(order))
+
+    def test_serializer_sorts_shared_with(self):
+        '''
+        test NoteSerializer lists shared_with ids in ascending order whatever order they are read in
+        '''
+        note = Note.objects.prefetch_related(self.shared_with_ids('-id')).get(title__startswith="Shared")
+        self.assertEqual(NoteSerializer(note).data['shared_with'], [self.others[0].id, self.others[2].id])
+
+    def assertSameJSON(self, serializer_class, fields, notes):
+        renderer = JSONRenderer()
+        with self.assertNumQueries(1):
+            fast = note_data(list(note_values(notes, fields)), fields)
+        slow = serializer_class(notes.prefetch_related(self.shared_with_ids('id')), many=True, fields=fields).data
+        self.assertEqual(renderer.render(fast), renderer.render(slow))
+
+    def test_matches_serializer(self):
+        notes = Note.objects.filter(owner=self.user).order_by('id')
+        self.assertSameJSON(NoteSerializer, list(NoteSerializer().fields), notes)
+        self.assertSameJSON(NoteSerializer, ['title', 'shared_with'], notes)
+        self.assertSameJSON(NoteSerializer, ['owner'], notes)
+        summary = notes.annotate(snippet=Substr('content', 1, 4))
+        self.assertSameJSON(NoteSummarySerializer, list(NoteSummarySerializer().fields), summary)
+
+    def test_list_responses_match_serializer(self):
+        expected = JSONRenderer().render(NoteSerializer(
+            Note.objects.filter(owner=self.user).order_by('-id').prefetch_related(self.shared_with_ids('id')), many=True,
+        ).data)
+        for url in ("http://127.0.0.1:8000/api/notes/", "http://127.0.0.1:8000/api/notes/feed/"):
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertEqual(JSONRenderer().render(response.json()['results']), expected)
+        with override_settings(ROOT_URLCONF='notes.async_urls'):
+            response = self.client.get("/notes/")
+        self.assertEqual(JSONRenderer().render(response.json()['results']), expected)
+
+    def test_benchmark_compares_serializers(self):
+        out = io.StringIO()
+        call_command('benchmark', users=2, notes=5, requests=1, warmup=0, concurrency=1,
+                     endpoints='GET notes/', serializers=3, stdout=out, stderr=io.StringIO())
+        report = json.loads(out.getvalue())['serializers']
+        self.assertEqual(report['rows'], 5)
+        self.assertGreater(report['serializer']['rows_per_cpu_second'], 0)
+        self.assertGreater(report['values']['rows_per_cpu_second'], 0)
+        self.assertIn('speedup', report)
+
+
+class NoteListCacheTestCase(APITestCase):
+
+    """
+    Test suite for the versioned note listing cache
+    """
+    def setUp(self):
+        caches['notes'].clear()
+        self.user = User.objects.create_user(username='testuser1', password='this_is_a_test')
+        self.other = User.objects.create_user(username='testuser2', password='this_is_a_test')
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + Token.objects.create(user=self.user).key)
+        self.url = "http://127.0.0.1:8000/api/notes/"
+
+    def test_repeated_listing_is_served_from_cache(self):
+        '''
+        test an unchanged listing does not query notes again
+        '''
+        Note.objects.create(title="Cached", content="content", owner=self.user)
+        self.client.get(self.url)
+        hits = cache_stats()['hits']
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(self.url)
+        self.assertEqual(cache_stats()['hits'], hits + 1)
+        self.assertFalse([q for q in queries.captured_queries if 'notes_note' in q['sql']])
+        self.assertEqual(response.data['results'][0]['title'], "Cached")
+
+    def test_writes_invalidate_listing(self):
+        '''
+        test create, update and delete are visible on the next listing
+        '''
+        self.client.get(self.url)
+        response = self.client.post(self.url, {"title": "First", "content": "content"}, format='json')
+        note_id = response.data['id']
+        self.assertEqual(len(self.client.get(self.url).data['results']), 1)
+
+        self.client.put(f"{self.url}{note_id}/", {"title": "Renamed"}, format='json')
+        self.assertEqual(self.client.get(self.url).data['results'][0]['title'], "Renamed")
+
+        self.client.delete(f"{self.url}{note_id}/")
+        self.assertEqual(self.client.get(self.url).data['results'], [])
+
+    def test_share_bumps_recipient_version(self):
+        '''
+        test being added to shared_with invalidates the recipient's listings
+        '''
+        note = Note.objects.create(title="Shared", content="content", owner=self.user)
+        version = get_notes_version(self.other.id)
+        response = self.client.post(f"{self.url}{note.id}/share/", {"user_to_share_with": self.other.id}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertGreater(get_notes_version(self.other.id), version)
+
+
+class NoteConditionalRequestTestCase(APITestCase):
+
+    """
+    Test suite for ETags and conditional requests
+    """
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser1', password='this_is_a_test')
+        self.other = User.objects.create_user(username='testuser2', password='this_is_a_test')
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + Token.objects.create(user=self.user).key)
+        self.note = Note.objects.create(title="Tagged", content="content", owner=self.user)
+        self.url = f"http://127.0.0.1:8000/api/notes/{self.note.id}/"
+
+    def test_if_none_match_returns_not_modified(self):
+        '''
+        test a matching If-None-Match gets 304 and a stale one gets the body
+        '''
+        etag = self.client.get(self.url)['ETag']
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+        self.note.shared_with.add(self.other)
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_listing_if_none_match(self):
+        '''
+        test the notes listing honours If-None-Match until a write happens
+        '''
+        url = "http://127.0.0.1:8000/api/notes/"
+        etag = self.client.get(url)['ETag']
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, status.HTTP_304_NOT_MODIFIED)
+        self.client.put(self.url, {"title": "Changed"}, format='json')
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, status.HTTP_200_OK)
+
+    def test_if_match_guards_put_and_delete(self):
+        '''
+        test writes with a stale If-Match are rejected with 412
+        '''
+        etag = self.client.get(self.url)['ETag']
+        response = self.client.put(self.url, {"title": "First"}, format='json', HTTP_IF_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(response['ETag'], etag)
+
+        response = self.client.put(self.url, {"title": "Second"}, format='json', HTTP_IF_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_412_PRECONDITION_FAILED)
+        response = self.client.delete(self.url, HTTP_IF_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_412_PRECONDITION_FAILED)
+        self.assertEqual(Note.objects.get().title, "First")
+
+    def test_failed_writes_roll_back(self):
+        '''
+        test an error after the write returns 500 and leaves the note as it was
+        '''
+        with mock.patch('notes.views.bump_notes_version', side_effect=RuntimeError("cache down")):
+            response = self.client.put(self.url, {"title": "Changed"}, format='json')
+            self.assertEqual(response.status_code, status.HTTP_500_INTERNAL_SERVER_ERROR)
+            response = self.client.delete(self.url)
+            self.assertEqual(response.status_code, status.HTTP_500_INTERNAL_SERVER_ERROR)
+        self.assertEqual(Note.objects.get().title, "Tagged")
+
+
+class NoteBatchTestCase(APITestCase):
+
+    """
+    Test suite for the batch note endpoint
+    """
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser1', password='this_is_a_test')
+        self.other = User.objects.create_user(username='testuser2', password='this_is_a_test')
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + Token.objects.create(user=self.user).key)
+        self.url = "http://127.0.0.1:8000/api/notes/batch/"
+
+    def test_batch_create_update_delete(self):
+        '''
+        test a batch applies every operation and reports per-item results
+        '''
+        keep = Note.objects.create(title="Keep", content="content", owner=self.user)
+        drop = Note.objects.create(title="Drop", content="content", owner=self.user)
+        foreign = Note.objects.create(title="Foreign", content="content", owner=self.other)
+        data = {
+            "create": [
+                {"title": "New 1", "content": "one"},
+                {"title": "New 2", "content": "two", "shared_with": [self.other.id]},
+            ],
+            "update": [
+                {"id": keep.id, "title": "Kept"},
+                {"id": foreign.id, "title": "Stolen"},
+            ],
+            "delete": [drop.id, foreign.id],
+        }
+        response = self.client.post(self.url, data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([item['status'] for item in response.data['create']], [201, 201])
+        self.assertEqual(response.data['create'][1]['note']['shared_with'], [self.other.id])
+        self.assertEqual([item['status'] for item in response.data['update']], [200, 404])
+        self.assertEqual([item['status'] for item in response.data['delete']], [204, 404])
+
+        self.assertEqual(
+            sorted(Note.objects.values_list('title', flat=True)),
+            ["Foreign", "Kept", "New 1", "New 2"],
+        )
+
+    def test_batch_validation_errors_apply_nothing(self):
+        '''
+        test an invalid item rejects the whole batch with per-item errors
+        '''
+        data = {"create": [{"title": "Valid", "content": "content"}, {"title": ""}]}
+        response = self.client.post(self.url, data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.data['create'][0], {})
+        self.assertIn('title', response.data['create'][1])
+
+        data = {"create": [{"title": "Valid", "content": "content", "shared_with": [0]}]}
+        response = self.client.post(self.url, data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(Note.objects.count(), 0)
+
+    def test_batch_create_uses_constant_queries(self):
+        '''
+        test the number of queries does not grow with the batch size
+        '''
+        def run(count):
+            data = {"create": [{"title": f"Note {i}", "content": "content"} for i in range(count)]}
+            with CaptureQueriesContext(connection) as queries:
+                self.client.post(self.url, data, format='json')
+            return len(queries)
+
+        self.assertEqual(run(2), run(50))
+
+    def test_multi_get(self):
+        '''
+        test ids= returns owned notes and lists the missing ones
+        '''
+        mine = Note.objects.create(title="Mine", content="content", owner=self.user)
+        theirs = Note.objects.create(title="Theirs", content="content", owner=self.other)
+        response = self.client.get(self.url, {"ids": f"{mine.id},{theirs.id}"})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([note['title'] for note in response.data['results']], ["Mine"])
+        self.assertEqual(response.data['missing'], [theirs.id])
+
+
+class NoteBulkShareTestCase(APITestCase):
+
+    """
+    Test suite for bulk sharing
+    """
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser1', password='this_is_a_test')
+        self.users = [User.objects.create_user(username=f'recipient{i}', password='12345') for i in range(3)]
+        self.notes = [Note.objects.create(title=f"Note {i}", content="content", owner=self.user) for i in range(4)]
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + Token.objects.create(user=self.user).key)
+        self.url = "http://127.0.0.1:8000/api/notes/share/"
+        self.data = {
+            "notes": [note.id for note in self.notes],
+            "users": [user.id for user in self.users],
+        }
+
+    def test_bulk_share_reports_only_new_shares(self):
+        '''
+        test sharing skips existing pairs and reports what changed
+        '''
+        self.notes[0].shared_with.add(self.users[0])
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(self.url, self.data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data['changed']), 11)
+        self.assertEqual(response.data['unchanged'], 1)
+        self.assertEqual(Note.shared_with.through.objects.count(), 12)
+        # Checks, the insert, the changed notes' audience and the version bump
+        self.assertLessEqual(len(queries), 6)
+
+    def test_bulk_unshare(self):
+        '''
+        test unsharing removes every pair
+        '''
+        self.client.post(self.url, self.data, format='json')
+        response = self.client.delete(self.url, self.data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data['changed']), 12)
+        self.assertEqual(Note.shared_with.through.objects.count(), 0)
+
+    def test_existing_recipients_see_new_shares(self):
+        '''
+        test users the note was already shared with get fresh feeds on share and unshare
+        '''
+        self.notes[0].shared_with.add(self.users[0])
+        recipient = APIClient()
+        recipient.credentials(HTTP_AUTHORIZATION='Token ' + Token.objects.create(user=self.users[0]).key)
+        feed = "http://127.0.0.1:8000/api/notes/feed/"
+
+        def shared_with():
+            return recipient.get(feed).data['results'][0]['shared_with']
+
+        self.assertEqual(shared_with(), [self.users[0].id])
+        self.client.post(f"http://127.0.0.1:8000/api/notes/{self.notes[0].id}/share/",
+                         {"user_to_share_with": self.users[1].id}, format='json')
+        self.assertEqual(shared_with(), [self.users[0].id, self.users[1].id])
+        self.client.post(self.url, {"notes": [self.notes[0].id], "users": [self.users[2].id]}, format='json')
+        self.assertEqual(shared_with(), [user.id for user in self.users])
+        self.client.delete(self.url, {"notes": [self.notes[0].id], "users": [self.users[1].id]}, format='json')
+        self.assertEqual(shared_with(), [self.users[0].id, self.users[2].id])
+
+    def test_bulk_share_rejects_foreign_notes_and_unknown_users(self):
+        '''
+        test nothing is shared when a note is not owned or a user is missing
+        '''
+        foreign = Note.objects.create(title="Foreign", content="content", owner=self.users[0])
+        data = {"notes": [self.notes[0].id, foreign.id], "users": [self.users[1].id, 0]}
+        response = self.client.post(self.url, data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        self.assertEqual(response.data['notes'], [foreign.id])
+        self.assertEqual(response.data['users'], [0])
+        self.assertEqual(Note.shared_with.through.objects.count(), 0)
+
+
+class NoteListSerializationTestCase(APITestCase):
+
+    """
+    Test suite for list prefetching, sparse fieldsets and summary mode
+    """
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser1', password='this_is_a_test')
+        self.other = User.objects.create_user(username='testuser2', password='this_is_a_test')
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + Token.objects.create(user=self.user).key)
+        self.url = "http://127.0.0.1:8000/api/notes/"
+
+    def create_notes(self, count):
+        notes = Note.objects.bulk_create([
+            Note(title=f"Note {i}", content="x" * 500, owner=self.user) for i in range(count)
+        ])
+        Note.shared_with.through.objects.bulk_create([
+            Note.shared_with.through(note_id=note.id, user_id=self.other.id) for note in notes
+        ])
+
+    def count_list_queries(self, params):
+        caches['notes'].clear()
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(self.url, params)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return len(queries)
+
+    def test_query_count_is_constant(self):
+        '''
+        test listing and search do not issue a query per note
+        '''
+        self.create_notes(2)
+        small = self.count_list_queries({})
+        self.create_notes(20)
+        self.assertEqual(self.count_list_queries({}), small)
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get("http://127.0.0.1:8000/api/search/", {"q": "note"})
+        self.assertEqual(len(response.data['results']), 22)
+        # Ranked ids and the page's notes are loaded separately
+        self.assertLessEqual(len(queries), small + 1)
+
+    def test_sparse_fieldset(self):
+        '''
+        test fields= limits the returned fields and skips the shared_with subquery
+        '''
+        self.create_notes(3)
+        caches['notes'].clear()
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(self.url, {"fields": "id,title"})
+        self.assertEqual(set(response.data['results'][0]), {"id", "title"})
+        self.assertFalse(any('notes_note_shared_with' in query['sql'] for query in queries.captured_queries))
+        self.assertEqual(self.count_list_queries({"fields": "id,title"}), self.count_list_queries({}))
+
+        response = self.client.get(self.url, {"fields": "id,secret"})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_summary_view(self):
+        '''
+        test view=summary returns a truncated snippet instead of content
+        '''
+        self.create_notes(1)
+        with self.settings(NOTES_SNIPPET_LENGTH=10):
+            response = self.client.get(self.url, {"view": "summary"})
+        note = response.data['results'][0]
+        self.assertNotIn('content', note)
+        self.assertEqual(note['snippet'], "x" * 10)
+        self.assertEqual(note['shared_with'], [self.other.id])
+
+
+class NoteExportTestCase(APITestCase):
+
+    """
+    Test suite for the NDJSON export
+    """
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser1', password='this_is_a_test')
+        self.other = User.objects.create_user(username='testuser2', password='this_is_a_test')
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + Token.objects.create(user=self.user).key)
+        self.url = "http://127.0.0.1:8000/api/notes/export/"
+        self.headers = {'Authorization': 'Token ' + self.user.auth_token.key}
+        self.notes = Note.objects.bulk_create([
+            Note(title=f"Note {i}", content="content", owner=self.user) for i in range(5)
+        ])
+        self.notes[0].shared_with.add(self.other)
+        Note.objects.create(title="Foreign", content="content", owner=self.other)
+
+    def test_export_streams_ndjson(self):
+        '''
+        test the export streams one serialized note per line
+        '''
+        with self.settings(NOTES_EXPORT_CHUNK_SIZE=2):
+            response = self.client.get(self.url)
+            self.assertTrue(response.streaming)
+            body = b''.join(response.streaming_content)
+        lines = [json.loads(line) for line in body.decode().splitlines()]
+        self.assertEqual([note['title'] for note in lines], [f"Note {i}" for i in range(5)])
+        self.assertEqual(lines[0], NoteSerializer(Note.objects.get(id=self.notes[0].id)).data)
+
+    def test_export_gzip(self):
+        '''
+        test the export is gzip-compressed when the client accepts it
+        '''
+        response = self.client.get(self.url, HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        body = gzip.decompress(b''.join(response.streaming_content))
+        self.assertEqual(len(body.decode().splitlines()), 5)
+
+    async def test_export_streams_asynchronously_under_asgi(self):
+        '''
+        test ASGI requests get an async iterator, served chunk by chunk without buffering
+        '''
+        with self.settings(NOTES_EXPORT_CHUNK_SIZE=2):
+            response = await self.async_client.get('/api/notes/export/', headers=self.headers)
+            self.assertTrue(response.is_async)
+            # The ASGI handler's sync-iterator fallback (which buffers) warns
+            with warnings.catch_warnings():
+                warnings.simplefilter('error')
+                chunks = [chunk async for chunk in response.__aiter__()]
+        self.assertEqual([len(chunk.decode().splitlines()) for chunk in chunks], [2, 2, 1])
+        lines = [json.loads(line) for line in b''.join(chunks).decode().splitlines()]
+        self.assertEqual([note['title'] for note in lines], [f"Note {i}" for i in range(5)])
+        self.assertEqual(lines[0], {
+            'id': self.notes[0].id, 'owner': self.user.id, 'title': "Note 0", 'content': "content",
+            'shared_with': [self.other.id],
+        })
+
+        response = await self.async_client.get('/api/notes/export/', headers={**self.headers, 'Accept-Encoding': 'gzip'})
+        self.assertTrue(response.is_async)
+        body = gzip.decompress(b''.join([chunk async for chunk in response.streaming_content]))
+        self.assertEqual(len(body.decode().splitlines()), 5)
+
+    def test_export_gzip_refused(self):
+        '''
+        test gzip is not sent to clients that give it a zero q-value
+        '''
+        for header in ('gzip;q=0', 'gzip; q=0.0, deflate', '*;q=0', 'br, *;q=0.5, gzip;q=0', 'identity'):
+            response = self.client.get(self.url, HTTP_ACCEPT_ENCODING=header)
+            self.assertFalse(response.has_header('Content-Encoding'), header)
+            self.assertEqual(len(b''.join(response.streaming_content).decode().splitlines()), 5)
+        for header in ('gzip;q=0.5', 'deflate, GZIP', '*'):
+            response = self.client.get(self.url, HTTP_ACCEPT_ENCODING=header)
+            self.assertEqual(response['Content-Encoding'], 'gzip', header)
+
+
+class NoteImportTestCase(APITestCase):
+
+    """
+    Test suite for NDJSON import
+    """
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser1', password='this_is_a_test')
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + Token.objects.create(user=self.user).key)
+        self.url = "http://127.0.0.1:8000/api/notes/import/"
+        self.body = "\n".join([
+            json.dumps({"title": "First", "content": "alpha"}),
+            "not json",
+            json.dumps({"title": "", "content": "missing title"}),
+            "",
+            json.dumps({"title": "Second", "content": "beta"}),
+        ])
+
+    def test_import_endpoint_reports_per_line_errors(self):
+        '''
+        test valid lines are imported and invalid ones reported by line
+        '''
+        with self.settings(NOTES_IMPORT_BATCH_SIZE=1):
+            response = self.client.generic('POST', self.url, self.body, content_type='application/x-ndjson')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['created'], 2)
+        self.assertEqual(response.data['failed'], 2)
+        self.assertEqual([error['line'] for error in response.data['errors']], [2, 3])
+        self.assertEqual(sorted(Note.objects.filter(owner=self.user).values_list('title', flat=True)), ["First", "Second"])
+        self.assertTrue(Note.objects.filter(search_vector="beta").exists())
+
+    def test_import_command(self):
+        '''
+        test the import_notes management command
+        '''
+        with tempfile.NamedTemporaryFile('w', suffix='.ndjson') as f:
+            f.write(self.body)
+            f.flush()
+            out = io.StringIO()
+            call_command('import_notes', f.name, user='testuser1', batch_size=1, stdout=out, stderr=io.StringIO())
+        self.assertIn("Imported 2 notes from 5 lines (2 failed)", out.getvalue())
+        self.assertEqual(Note.objects.count(), 2)
+
+    def test_failed_batch_reports_where_to_resume(self):
+        '''
+        test a failing batch keeps earlier batches and reports the first line not imported
+        '''
+        create = Note.objects.bulk_create
+        calls = []
+
+        def failing_second_batch(notes, *args, **kwargs):
+            calls.append(len(notes))
+            if len(calls) == 2:
+                raise RuntimeError("database went away")
+            return create(notes, *args, **kwargs)
+
+        body = "\n".join(json.dumps({"title": f"Note {i}", "content": "body"}) for i in range(1, 6))
+        with self.settings(NOTES_IMPORT_BATCH_SIZE=2), \
+                mock.patch.object(Note.objects, 'bulk_create', side_effect=failing_second_batch):
+            response = self.client.generic('POST', self.url, body, content_type='application/x-ndjson')
+        self.assertEqual(response.status_code, status.HTTP_500_INTERNAL_SERVER_ERROR)
+        self.assertEqual(response.data['created'], 2)
+        self.assertEqual(response.data['committed_lines'], 2)
+        self.assertEqual(response.data['error'], {'line': 3, 'detail': "database went away"})
+        self.assertEqual(list(Note.objects.order_by('id').values_list('title', flat=True)), ["Note 1", "Note 2"])
+
+        # Resuming from the reported line imports the rest once
+        rest = "\n".join(body.splitlines()[response.data['error']['line'] - 1:])
+        response = self.client.generic('POST', self.url, rest, content_type='application/x-ndjson')
+        self.assertEqual(response.data['created'], 3)
+        self.assertEqual(Note.objects.count(), 5)
+
+
+@override_settings(NOTES_PROVISION_HASH_WORKERS=1)
+class BulkRegisterTestCase(APITestCase):
+
+    """
+    Test suite for bulk user provisioning
+    """
+    def setUp(self):
+        self.admin = User.objects.create_user(username='admin', email='admin@example.com', password='this_is_a_test', is_staff=True)
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + Token.objects.create(user=self.admin).key)
+        self.url = "http://127.0.0.1:8000/api/auth/register/bulk/"
+
+    def test_per_user_outcomes(self):
+        '''
+        test valid users are created with tokens and the rest are reported
+        '''
+        users = [
+            {"username": "alice", "email": "alice@example.com", "password": "secret-1"},
+            {"username": "admin", "email": "new@example.com", "password": "secret-2"},
+            {"username": "bob", "email": "alice@example.com", "password": "secret-3"},
+            {"username": "carol", "email": "not-an-email", "password": "secret-4"},
+            {"username": "dave", "email": "dave@example.com", "password": "secret-5"},
+        ]
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(self.url, {"users": users}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([result['status'] for result in response.data['results']],
+                         ["created", "exists", "exists", "invalid", "created"])
+        self.assertEqual(response.data['results'][2]['errors'], {'email': ["email already exists"]})
+        self.assertEqual((response.data['created'], response.data['failed']), (2, 3))
+        # Auth and throttle, one collision query, one insert each for users and tokens
+        self.assertLessEqual(len(queries), 8)
+
+        alice = User.objects.get(username='alice')
+        self.assertTrue(alice.check_password("secret-1"))
+        self.assertEqual(Token.objects.get(user=alice).key, response.data['results'][0]['token'])
+
+    def test_staff_only(self):
+        '''
+        test non-staff users cannot provision users
+        '''
+        user = User.objects.create_user(username='testuser1', password='this_is_a_test')
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + Token.objects.create(user=user).key)
+        response = self.client.post(self.url, {"users": [{"username": "x", "email": "x@example.com", "password": "x"}]}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_command_hashes_in_a_process_pool(self):
+        '''
+        test the provision_users command, hashing with two worker processes
+        '''
+        with tempfile.NamedTemporaryFile('w', suffix='.csv') as f:
+            f.write("username,email,password\nerin,erin@example.com,pw-1\nfrank,frank@example.com,pw-2\nerin,e2@example.com,pw-3\n")
+            f.flush()
+            out, err = io.StringIO(), io.StringIO()
+            call_command('provision_users', f.name, workers=2, stdout=out, stderr=err)
+        self.assertIn("Provisioned 2 users from 3 rows (1 failed)", out.getvalue())
+        self.assertIn("line 4: 'erin' exists", err.getvalue())
+        self.assertTrue(User.objects.get(username='frank').check_password("pw-2"))
+        self.assertEqual(Token.objects.filter(user__username__in=['erin', 'frank']).count(), 2)
+
+
+class NoteBenchmarkTestCase(TestCase):
+
+    """
+    Test suite for the benchmark command
+    """
+    def test_benchmark_covers_every_endpoint(self):
+        '''
+        test a small run reports every endpoint without errors and cleans up
+        '''
+        out = io.StringIO()
+        call_command('benchmark', users=2, notes=5, requests=2, warmup=0, concurrency=1,
+                     stdout=out, stderr=io.StringIO())
+        report = json.loads(out.getvalue())
+
+        self.assertEqual(len(report['endpoints']), 15)
+        for label, result in report['endpoints'].items():
+            self.assertEqual(result['errors'], 0, label)
+            self.assertEqual(result['requests'], 2)
+            self.assertGreater(result['queries']['mean'], 0)
+            self.assertLessEqual(result['latency_ms']['p50'], result['latency_ms']['p99'])
+        self.assertEqual(report['parameters']['notes'], 5)
+        self.assertFalse(User.objects.filter(username__startswith='bench-').exists())
+
+    def test_unknown_endpoint(self):
+        '''
+        test unknown endpoint labels are rejected
+        '''
+        with self.assertRaises(CommandError):
+            call_command('benchmark', users=2, notes=1, endpoints='GET nowhere', stdout=io.StringIO())
+
+
+@override_settings(NOTES_METRICS=True, NOTES_METRICS_TOKEN='')
+class NoteMetricsTestCase(APITestCase):
+
+    """
+    Test suite for the metrics middleware and endpoint
+    """
+    def setUp(self):
+        registry.reset()
+        self.user = User.objects.create_user(username='testuser1', password='this_is_a_test')
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + Token.objects.create(user=self.user).key)
+        self.note = Note.objects.create(title="Measured", content="body", owner=self.user)
+
+    def test_server_timing_header(self):
+        '''
+        test responses report total, db and serialization time
+        '''
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(f"http://127.0.0.1:8000/api/notes/{self.note.id}/")
+        timing = response['Server-Timing']
+        self.assertRegex(timing, r'^total;dur=[0-9.]+, db;dur=[0-9.]+;desc="\d+ queries", serialize;dur=[0-9.]+$')
+        self.assertIn(f'desc="{len(queries)} queries"', timing)
+
+    def test_metrics_endpoint(self):
+        '''
+        test per-route histograms are served in the Prometheus text format
+        '''
+        for _ in range(3):
+            self.client.get(f"http://127.0.0.1:8000/api/notes/{self.note.id}/")
+        self.client.get("http://127.0.0.1:8000/api/search/", {"q": "measured"})
+
+        response = self.client.get("http://127.0.0.1:8000/api/metrics/")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response['Content-Type'].startswith('text/plain'))
+        body = response.content.decode()
+        self.assertIn('notes_requests_total{route="note-detail",method="GET",status="200"} 3', body)
+        self.assertIn('notes_request_duration_seconds_count{route="note-detail",method="GET"} 3', body)
+        self.assertIn('notes_request_db_queries_bucket{route="note-search",method="GET",le="+Inf"} 1', body)
+        self.assertIn('notes_cache_requests_total{namespace="search",outcome="misses"}', body)
+
+        scraper = Client()
+        with self.settings(NOTES_METRICS_TOKEN='scrape'):
+            self.assertEqual(scraper.get("http://127.0.0.1:8000/api/metrics/").status_code, 401)
+            response = scraper.get("http://127.0.0.1:8000/api/metrics/", HTTP_AUTHORIZATION='Bearer scrape')
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    @override_settings(ROOT_URLCONF='notes.async_urls')
+    async def test_async_views(self):
+        '''
+        test async views are measured too
+        '''
+        token = await Token.objects.aget(user=self.user)
+        response = await self.async_client.get(f'/notes/{self.note.id}/', headers={'Authorization': 'Token ' + token.key})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertRegex(response['Server-Timing'], r'desc="[1-9]\d* queries", serialize;dur=[0-9.]+$')
+        self.assertIn('notes_request_duration_seconds_count{route="note-detail",method="GET"} 1', registry.render())
+
+    @override_settings(NOTES_METRICS=False)
+    def test_disabled(self):
+        '''
+        test nothing is recorded or served when metrics are off
+        '''
+        response = self.client.get(f"http://127.0.0.1:8000/api/notes/{self.note.id}/")
+        self.assertFalse(response.has_header('Server-Timing'))
+        self.assertEqual(self.client.get("http://127.0.0.1:8000/api/metrics/").status_code, 404)
+        self.assertEqual(registry.render().count('route="note-detail"'), 0)
+
+
+class NoteProfilingTestCase(APITestCase):
+
+    """
+    Test suite for the request profiler
+    """
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        self.user = User.objects.create_user(username='testuser1', password='this_is_a_test')
+        self.admin = User.objects.create_user(username='admin', password='this_is_a_test', is_staff=True)
+        self.note = Note.objects.create(title="Profiled", content="body", owner=self.user)
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + Token.objects.create(user=self.user).key)
+        self.admin_client = APIClient()
+        self.admin_client.credentials(HTTP_AUTHORIZATION='Token ' + Token.objects.create(user=self.admin).key)
+
+    def profiles(self):
+        response = self.admin_client.get("http://127.0.0.1:8000/api/profiles/")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response.data
+
+    def test_sampled_requests_in_a_bounded_ring(self):
+        '''
+        test sampled requests are profiled and only the newest are kept
+        '''
+        with self.settings(NOTES_PROFILE_SAMPLE_RATE=1.0, NOTES_PROFILE_DIR=self.directory.name,
+                           NOTES_PROFILE_MAX_FILES=3, NOTES_PROFILE_ROUTES=['note-search', 'note-list']):
+            client = APIClient()
+            client.credentials(HTTP_AUTHORIZATION=self.client._credentials['HTTP_AUTHORIZATION'])
+            client.get(f"http://127.0.0.1:8000/api/notes/{self.note.id}/")
+            for _ in range(4):
+                client.get("http://127.0.0.1:8000/api/search/", {"q": "profiled"})
+            client.get("http://127.0.0.1:8000/api/notes/")
+
+            profiles = self.profiles()
+            self.assertEqual([profile['route'] for profile in profiles], ["note-list", "note-search", "note-search"])
+            self.assertEqual(profiles[1]['reason'], "sampled")
+
+            profile = self.admin_client.get(f"http://127.0.0.1:8000/api/profiles/{profiles[1]['id']}/").data
+            self.assertTrue(any('"notes_note"' in statement['sql'] for statement in profile['sql']))
+            self.assertTrue(any('NoteSearchAPI' in row['function'] or 'views.py' in row['function']
+                                for row in profile['profile']))
+
+    def test_slow_requests_keep_stack_samples(self):
+        '''
+        test requests over the threshold are kept and faster ones are not
+        '''
+        with self.settings(NOTES_PROFILE_SLOW_MS=60000, NOTES_PROFILE_DIR=self.directory.name):
+            APIClient().get("http://127.0.0.1:8000/api/notes/")
+            self.assertEqual(self.profiles(), [])
+
+        with self.settings(NOTES_PROFILE_SLOW_MS=1, NOTES_PROFILE_STACK_INTERVAL_MS=1,
+                           NOTES_PROFILE_DIR=self.directory.name):
+            client = APIClient()
+            client.credentials(HTTP_AUTHORIZATION=self.client._credentials['HTTP_AUTHORIZATION'])
+            with mock.patch('notes.views.NotesAPI.prepare_list', side_effect=lambda *args: time.sleep(0.05) or args[0]):
+                client.get("http://127.0.0.1:8000/api/notes/")
+            profile = self.admin_client.get(f"http://127.0.0.1:8000/api/profiles/{self.profiles()[0]['id']}/").data
+            self.assertEqual(profile['reason'], "slow")
+            self.assertGreaterEqual(profile['duration_ms'], 50)
+            self.assertTrue(any('sleep' in sample['stack'] or 'lambda' in sample['stack'] for sample in profile['stacks']))
+
+    def test_staff_only(self):
+        '''
+        test profiles are only readable by staff
+        '''
+        self.assertEqual(self.client.get("http://127.0.0.1:8000/api/profiles/").status_code, status.HTTP_403_FORBIDDEN)
+        with self.settings(NOTES_PROFILE_DIR=self.directory.name):
+            response = self.admin_client.get("http://127.0.0.1:8000/api/profiles/..%2Fsecret/")
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+
+RATES = {'high': '3/minute', 'low': '2/minute'}
+
+
+class NoteThrottleTestCase(APITestCase):
+
+    """
+    Test suite for the GCRA throttle
+    """
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser1', password='this_is_a_test')
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + Token.objects.create(user=self.user).key)
+        self.note = Note.objects.create(title="Throttled", content="body", owner=self.user)
+        self.url = "http://127.0.0.1:8000/api/notes/"
+
+    @mock.patch('rest_framework.settings.api_settings.DEFAULT_THROTTLE_RATES', RATES)
+    def test_burst_then_throttled(self):
+        '''
+        test a scope allows a burst of its limit and then returns 429
+        '''
+        responses = [self.client.get(self.url) for _ in range(3)]
+        self.assertEqual([response.status_code for response in responses], [200, 200, 429])
+        self.assertEqual([response['X-RateLimit-Remaining'] for response in responses[:2]], ["1", "0"])
+        self.assertEqual(responses[0]['X-RateLimit-Limit'], "2")
+        # The next token is due one emission interval (60s / 2) later
+        self.assertIn(int(responses[2]['Retry-After']), (29, 30))
+
+    @mock.patch('rest_framework.settings.api_settings.DEFAULT_THROTTLE_RATES', RATES)
+    def test_scopes_are_separate(self):
+        '''
+        test the high and low scopes keep separate buckets
+        '''
+        for _ in range(2):
+            self.client.get(self.url)
+        self.assertEqual(self.client.get(self.url).status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+        response = self.client.get(self.url + f"{self.note.id}/")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response['X-RateLimit-Limit'], "3")
+
+    @mock.patch('rest_framework.settings.api_settings.DEFAULT_THROTTLE_RATES', RATES)
+    def test_bucket_refills(self):
+        '''
+        test one token is returned per emission interval
+        '''
+        for _ in range(2):
+            self.client.get(self.url)
+        # Move the stored arrival time one interval into the past
+        ThrottleBucket.objects.update(tat=F('tat') - 30)
+        self.assertEqual(self.client.get(self.url).status_code, status.HTTP_200_OK)
+        self.assertEqual(self.client.get(self.url).status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+        self.assertEqual(ThrottleBucket.objects.count(), 1)
+
+    def test_worker_purges_drained_buckets(self):
+        '''
+        test the periodic purge task deletes drained buckets only and queues its next run
+        '''
+        self.client.get(self.url)
+        ThrottleBucket.objects.create(key='throttle_low_0', tat=time.time() - 60)
+        call_command('run_worker', '--once', '--concurrency', '1', stdout=io.StringIO())
+        self.assertEqual(ThrottleBucket.objects.count(), 1)
+        self.assertFalse(ThrottleBucket.objects.filter(key='throttle_low_0').exists())
+        queued, = Task.objects.filter(name=purge_throttle_buckets.name)
+        self.assertGreater(queued.available_at, timezone.now() + datetime.timedelta(minutes=59))
+
+
+@override_settings(ROOT_URLCONF='notes.async_urls')
+class AsyncNoteViewsTestCase(TestCase):
+
+    """
+    Test suite for the async note views
+    """
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser1', password='this_is_a_test')
+        self.other = User.objects.create_user(username='testuser2', password='this_is_a_test')
+        self.headers = {'Authorization': 'Token ' + Token.objects.create(user=self.user).key}
+
+    async def test_crud_and_share(self):
+        '''
+        test the async views create, list, update, share and delete notes
+        '''
+        response = await self.async_client.post('/notes/', {"title": "Async", "content": "body"},
+                                                content_type='application/json', headers=self.headers)
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        note_id = response.json()['id']
+
+        response = await self.async_client.get('/notes/', headers=self.headers)
+        self.assertEqual([note['title'] for note in response.json()['results']], ["Async"])
+        self.assertEqual(response['X-RateLimit-Limit'], "30")
+
+        response = await self.async_client.put(f'/notes/{note_id}/', {"title": "Renamed"},
+                                               content_type='application/json', headers=self.headers)
+        self.assertEqual(response.json()['title'], "Renamed")
+
+        response = await self.async_client.post(f'/notes/{note_id}/share/', {"user_to_share_with": self.other.id},
+                                                content_type='application/json', headers=self.headers)
+        self.assertEqual(response.json()['detail'], "Note shared successfully")
+        response = await self.async_client.get(f'/notes/{note_id}/', headers=self.headers)
+        self.assertEqual(response.json()['shared_with'], [self.other.id])
+
+        # Users already on the note get the new shared_with in their listings
+        third = await User.objects.acreate(username='testuser3')
+        other_headers = {'Authorization': 'Token ' + (await Token.objects.acreate(user=self.other)).key}
+        with override_settings(ROOT_URLCONF='note_project.urls'):
+            response = await self.async_client.get('/api/notes/feed/', headers=other_headers)
+            self.assertEqual(response.json()['results'][0]['shared_with'], [self.other.id])
+        await self.async_client.post(f'/notes/{note_id}/share/', {"user_to_share_with": third.id},
+                                     content_type='application/json', headers=self.headers)
+        with override_settings(ROOT_URLCONF='note_project.urls'):
+            response = await self.async_client.get('/api/notes/feed/', headers=other_headers)
+        self.assertEqual(response.json()['results'][0]['shared_with'], [self.other.id, third.id])
+
+        response = await self.async_client.get('/search/', {"q": "renamed"}, headers=self.headers)
+        self.assertEqual([note['id'] for note in response.json()['results']], [note_id])
+
+        response = await self.async_client.delete(f'/notes/{note_id}/', headers=self.headers)
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+        self.assertFalse(await Note.objects.filter(id=note_id).aexists())
+
+    async def test_matches_sync_representation(self):
+        '''
+        test the async detail view renders the same JSON as the sync one
+        '''
+        note = await Note.objects.acreate(title="Same", content="body", owner=self.user)
+        response = await self.async_client.get(f'/notes/{note.id}/', headers=self.headers)
+        with override_settings(ROOT_URLCONF='note_project.urls'):
+            expected = await self.async_client.get(f'/api/notes/{note.id}/', headers=self.headers)
+        self.assertEqual(response.content, expected.content)
+        self.assertEqual(response['ETag'], expected['ETag'])
+
+    async def test_authentication_required(self):
+        '''
+        test requests without a valid token are rejected
+        '''
+        response = await self.async_client.get('/notes/')
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+        response = await self.async_client.get('/notes/', headers={'Authorization': 'Token invalid'})
+        self.assertEqual(response.json()['detail'], "Invalid token.")
+
+    async def test_put_matches_sync_view(self):
+        '''
+        test the async and sync PUT accept the same fields, owner included
+        '''
+        third = await User.objects.acreate(username='testuser3')
+        for urls in ('notes.async_urls', 'note_project.urls'):
+            prefix = '' if urls == 'notes.async_urls' else '/api'
+            note = await Note.objects.acreate(title="Mine", content="body", owner=self.user)
+            with override_settings(ROOT_URLCONF=urls):
+                response = await self.async_client.put(
+                    f'{prefix}/notes/{note.id}/', {"owner": self.other.id, "shared_with": [third.id, self.user.id]},
+                    content_type='application/json', headers=self.headers,
+                )
+                self.assertEqual(response.status_code, status.HTTP_200_OK, urls)
+                self.assertEqual(response.json()['owner'], self.other.id, urls)
+                self.assertEqual(response.json()['shared_with'], sorted([third.id, self.user.id]), urls)
+                self.assertEqual((await Note.objects.aget(id=note.id)).owner_id, self.other.id)
+
+                response = await self.async_client.put(
+                    f'{prefix}/notes/{note.id}/', {"title": "Theirs"}, content_type='application/json', headers=self.headers,
+                )
+                self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND, urls)
+
+                mine = await Note.objects.acreate(title="Mine", content="body", owner=self.user)
+                response = await self.async_client.put(
+                    f'{prefix}/notes/{mine.id}/', {"owner": 0, "shared_with": [0]},
+                    content_type='application/json', headers=self.headers,
+                )
+                self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST, urls)
+                self.assertEqual(set(response.json()), {'owner', 'shared_with'}, urls)
+
+    def test_csrf_exempt(self):
+        '''
+        test token-authenticated writes pass CSRF checks, like the sync views
+        '''
+        client = Client(enforce_csrf_checks=True, headers=self.headers)
+        response = client.post('/notes/', {"title": "Async", "content": "body"}, content_type='application/json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        note_id = response.json()['id']
+        response = client.put(f'/notes/{note_id}/', {"title": "Renamed"}, content_type='application/json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        response = client.post(f'/notes/{note_id}/share/', {"user_to_share_with": self.other.id},
+                               content_type='application/json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        response = client.delete(f'/notes/{note_id}/')
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+
+    async def test_detail_errors_are_json(self):
+        '''
+        test unexpected errors in the detail view return a JSON 500
+        '''
+        note = await Note.objects.acreate(title="Async", content="body", owner=self.user)
+        with mock.patch('notes.async_views.note_etag', side_effect=RuntimeError("boom")):
+            response = await self.async_client.get(f'/notes/{note.id}/', headers=self.headers)
+        self.assertEqual(response.status_code, status.HTTP_500_INTERNAL_SERVER_ERROR)
+        self.assertEqual(response.json(), {"detail": "boom"})
@@ -1,9 +1,104 @@
-from rest_framework.throttling import UserRateThrottle
+import math
 
-class HighRateThrottle(UserRateThrottle):
+from django.db import connections, router
+from rest_framework.settings import api_settings
+from rest_framework.throttling import ScopedRateThrottle, SimpleRateThrottle
 
-    scope = 'high'
+from .models import ThrottleBucket
 
-class LowRateThrottle(UserRateThrottle):
+# One statement both decides and records a request. The bucket row is locked
+# by the upsert, so concurrent requests from any number of workers serialize
+# on it, and every worker uses the database clock.
+ACQUIRE_SQL = """
+    WITH acquired AS (
+        INSERT INTO {table} AS bucket (key, tat)
+        VALUES (%(key)s, extract(epoch FROM statement_timestamp())::double precision + %(interval)s)
+        ON CONFLICT (key) DO UPDATE
+        SET tat = GREATEST(bucket.tat, extract(epoch FROM statement_timestamp())::double precision) + %(interval)s
+        WHERE GREATEST(bucket.tat, extract(epoch FROM statement_timestamp())::double precision) + %(interval)s
+              - extract(epoch FROM statement_timestamp())::double precision <= %(period)s
+        RETURNING tat
+    )
+    SELECT
+        (SELECT tat FROM acquired),
+        (SELECT tat FROM {table} WHERE key = %(key)s),
+        extract(epoch FROM statement_timestamp())::double precision
+"""
 
-    scope = 'low'
\ No newline at end of file
+
+class GCRARateThrottle(SimpleRateThrottle):
+    """
+    Token-bucket throttle implemented with the generic cell rate algorithm.
+
+    Each key keeps a single value, its theoretical arrival time (TAT), in
+    the ThrottleBucket table. A request is allowed when pushing the TAT one
+    emission interval (period / limit) forward keeps it within one period of
+    now, which permits bursts of up to ``limit`` requests. The check and the
+    update are a single UPSERT, so the state is O(1) per key and correct
+    across workers.
+
+    Rate-limit headers are added to the view's response headers.
+    """
+
+    def get_rate(self):
+        # Read the rates on every call so overridden settings take effect
+        self.THROTTLE_RATES = api_settings.DEFAULT_THROTTLE_RATES
+        return super().get_rate()
+
+    def allow_request(self, request, view):
+        if self.rate is None:
+            return True
+
+        self.key = self.get_cache_key(request, view)
+        if self.key is None:
+            return True
+
+        self.interval = self.duration / self.num_requests
+        connection = connections[router.db_for_write(ThrottleBucket)]
+        with connection.cursor() as cursor:
+            cursor.execute(ACQUIRE_SQL.format(table=ThrottleBucket._meta.db_table), {
+                'key': self.key,
+                'interval': self.interval,
+                'period': self.duration,
+            })
+            acquired, current, self.now = cursor.fetchone()
+        self.tat = acquired if acquired is not None else current
+
+        headers = getattr(view, 'headers', None)
+        if headers is not None:
+            headers.update(self.rate_limit_headers())
+        return acquired is not None
+
+    def rate_limit_headers(self):
+        remaining = math.floor((self.duration - (self.tat - self.now)) / self.interval)
+        return {
+            'X-RateLimit-Limit': str(self.num_requests),
+            'X-RateLimit-Remaining': str(max(remaining, 0)),
+            'X-RateLimit-Reset': str(max(math.ceil(self.tat - self.now), 0)),
+        }
+
+    def wait(self):
+        """
+        Seconds until the bucket admits one more request.
+        """
+        return max(self.tat - (self.duration - self.interval) - self.now, 0)
+
+
+class ScopedGCRAThrottle(ScopedRateThrottle, GCRARateThrottle):
+    """
+    GCRA throttle keyed by user (or client IP) and the view's
+    ``throttle_scope``. Views without a scope are not throttled.
+    """
+
+
+def purge_expired_buckets():
+    """
+    Delete buckets whose TAT has passed; they are equivalent to no row.
+    """
+    connection = connections[router.db_for_write(ThrottleBucket)]
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"DELETE FROM {ThrottleBucket._meta.db_table} "
+            "WHERE tat < extract(epoch FROM statement_timestamp())::double precision"
+        )
+        return cursor.rowcount
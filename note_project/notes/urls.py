@@ -1,12 +1,30 @@
+from django.conf import settings
 from django.urls import path
-from .views import LoginAPI, RegisterAPI, SignOutAPI, NotesAPI, NoteDetailAPI, NoteShareAPI, NoteSearchAPI
+from .metrics import metrics_view
+from .views import LoginAPI, RegisterAPI, BulkRegisterAPI, AccountAPI, SignOutAPI, NotesAPI, NoteFeedAPI, NoteSyncAPI, NoteDetailAPI, NoteShareAPI, NoteSearchAPI, NoteAutocompleteAPI, NoteBatchAPI, NoteBulkShareAPI, NoteExportAPI, NoteImportAPI, ProfileListAPI, ProfileDetailAPI
 
 urlpatterns = [
-    path('auth/login/', LoginAPI.as_view()), # Login user
-    path('auth/register/', RegisterAPI.as_view()), # Register user
+    path('auth/login/', LoginAPI.as_view(), name='login'), # Login user
+    path('auth/register/', RegisterAPI.as_view(), name='register'), # Register user
+    path('auth/register/bulk/', BulkRegisterAPI.as_view(), name='register-bulk'), # Provision many users (staff)
+    path('auth/account/', AccountAPI.as_view(), name='account'), # Delete the authenticated user's account
     # path('auth/logout/', SignOutAPI.as_view()),
-    path('notes/', NotesAPI.as_view()), # View or create notes
+    path('notes/', NotesAPI.as_view(), name='note-list'), # View or create notes
+    path('notes/feed/', NoteFeedAPI.as_view(), name='note-feed'), # View own and shared notes in one list
+    path('notes/sync/', NoteSyncAPI.as_view(), name='note-sync'), # Notes changed or removed since a cursor
+    path('notes/batch/', NoteBatchAPI.as_view(), name='note-batch'), # Batch create, update, delete or fetch notes
+    path('notes/export/', NoteExportAPI.as_view(), name='note-export'), # Stream all notes as NDJSON
+    path('notes/import/', NoteImportAPI.as_view(), name='note-import'), # Import notes from NDJSON
+    path('notes/share/', NoteBulkShareAPI.as_view(), name='note-bulk-share'), # Share or unshare many notes with many users
     path('notes/<int:id>/', NoteDetailAPI.as_view(), name='note-detail'), # View, update or delete a note
     path('notes/<int:id>/share/', NoteShareAPI.as_view(), name='note-share'), # Share a note
     path('search/', NoteSearchAPI.as_view(), name='note-search'), # Search notes
+    path('search/autocomplete/', NoteAutocompleteAPI.as_view(), name='note-autocomplete'), # Suggest note titles
+    path('metrics/', metrics_view, name='metrics'), # Prometheus metrics (NOTES_METRICS)
+    path('profiles/', ProfileListAPI.as_view(), name='profile-list'), # List request profiles (staff)
+    path('profiles/<str:profile_id>/', ProfileDetailAPI.as_view(), name='profile-detail'), # View a request profile (staff)
 ]
+
+if settings.NOTES_ASYNC_VIEWS:
+    from .async_urls import urlpatterns as async_urlpatterns
+    urlpatterns = async_urlpatterns + urlpatterns
@@ -1,18 +1,52 @@
+import json
+import zlib
+
 from rest_framework.response import Response
-from .models import Note
-from .serializers import LoginSerializer, RegisterSerializer, NoteSerializer
+from .models import Note, SEARCH_CONFIG
+from .serializers import LoginSerializer, RegisterSerializer, NoteSerializer, NoteSummarySerializer, NoteSyncSerializer, NoteBatchCreateSerializer, NoteBatchUpdateSerializer, note_data, note_values
+from .pagination import NoteCursorPagination, NoteFeedPagination, NoteSearchPagination
+from .cache import autocomplete_cache_key, bump_notes_version, get_or_build, listing_cache_key, note_audience, search_cache_key
+from .etags import if_match_fails, if_none_match, listing_etag, note_etag
+from .importer import import_notes
+from .provisioning import provision_users
+from .profiling import store as profile_store
+from .sync import CursorExpired, changes_since, decode_cursor, encode_cursor
+from .tasks import purge_user
 from rest_framework.views import APIView
-from rest_framework import status
+from rest_framework import serializers, status
 from django.contrib.auth import authenticate
 from rest_framework.authtoken.models import Token
 from django.contrib.auth.models import User
-from rest_framework.permissions import IsAuthenticated
+from rest_framework.permissions import AllowAny, IsAdminUser, IsAuthenticated
 from django.core.paginator import Paginator
 from rest_framework.authentication import SessionAuthentication, BasicAuthentication, TokenAuthentication
 from django.contrib.auth import authenticate, login, logout
-from django.contrib.postgres.search import SearchQuery, SearchRank, SearchVector
+from django.contrib.postgres.search import SearchHeadline, SearchQuery, SearchRank, TrigramWordSimilarity
+from django.db import connection, transaction
+from django.db.models import BooleanField, ExpressionWrapper, F, Prefetch, Q
+from django.db.models.functions import Substr
+from django.conf import settings
+from django.http import StreamingHttpResponse
+from django.core.handlers.asgi import ASGIRequest
+
+# Statements used by NoteBulkShareAPI; every note id is paired with every user id
+SHARE_SQL = """
+    INSERT INTO {table} (note_id, user_id)
+    SELECT note_id, user_id
+    FROM unnest(%s::bigint[]) AS note_id CROSS JOIN unnest(%s::integer[]) AS user_id
+    ON CONFLICT (note_id, user_id) DO NOTHING
+    RETURNING note_id, user_id
+"""
+
+UNSHARE_SQL = """
+    DELETE FROM {table}
+    WHERE note_id = ANY(%s::bigint[]) AND user_id = ANY(%s::integer[])
+    RETURNING note_id, user_id
+"""
 
 class LoginAPI(APIView):
+    permission_classes = [AllowAny]
+
     def post(self, request):
         data = request.data
         serializer = LoginSerializer(data=data)
@@ -46,6 +80,8 @@ class LoginAPI(APIView):
 
 
 class RegisterAPI(APIView):
+    permission_classes = [AllowAny]
+
     # POST Method
     def post(self, request):
         data = request.data
@@ -67,6 +103,45 @@ class RegisterAPI(APIView):
         status=status.HTTP_201_CREATED)
 
 
+class BulkRegisterAPI(APIView):
+    permission_classes = [IsAdminUser]
+    authentication_classes = [TokenAuthentication]
+    throttle_scope = "low"
+
+    # Provision many users at once
+    def post(self, request):
+        accounts = request.data.get('users')
+        if not isinstance(accounts, list) or not accounts:
+            return Response({"detail": "users must be a non-empty list"}, status=status.HTTP_400_BAD_REQUEST)
+        if len(accounts) > settings.NOTES_PROVISION_MAX_USERS:
+            return Response({"detail": f"At most {settings.NOTES_PROVISION_MAX_USERS} users per request"},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        results = provision_users(accounts)
+        created = sum(1 for result in results if result['status'] == 'created')
+        return Response({
+            'created': created,
+            'failed': len(results) - created,
+            'results': results,
+        }, status=status.HTTP_200_OK)
+
+
+class AccountAPI(APIView):
+    permission_classes = [IsAuthenticated]
+    authentication_classes = [TokenAuthentication]
+    throttle_scope = "low"
+
+    # Delete the account
+    @transaction.atomic
+    def delete(self, request):
+        # The account stops working at once; its notes are deleted in the
+        # background, as a cascade over all of them could take minutes
+        User.objects.filter(id=request.user.id).update(is_active=False)
+        Token.objects.filter(user=request.user).delete()
+        purge_user.enqueue(user_id=request.user.id)
+        return Response({"detail": "Account scheduled for deletion"}, status=status.HTTP_202_ACCEPTED)
+
+
 class SignOutAPI(APIView):
     permission_classes = [IsAuthenticated]
     authentication_classes = [TokenAuthentication]
@@ -77,18 +152,108 @@ class SignOutAPI(APIView):
         return Response({'detail': 'Successfully logged out.'}, status=status.HTTP_200_OK)
 
 
-class NotesAPI(APIView):
+class NoteListMixin:
+    """
+    Shared behaviour of the note list endpoints.
+
+    ``?view=summary`` swaps the content for a SQL-computed snippet and
+    ``?fields=a,b`` selects a sparse fieldset. Notes are read as ``values()``
+    rows of only the columns those fields need, ``shared_with`` ids
+    included, and output with ``note_data`` rather than the serializer, so
+    a page is one query and costs little Python.
+    """
+
+    def get_list_fields(self, request, default_view='full'):
+        view = request.query_params.get('view', default_view)
+        serializer_class = NoteSummarySerializer if view == 'summary' else NoteSerializer
+        fields = list(serializer_class().fields)
+
+        requested = request.query_params.get('fields')
+        if requested:
+            requested = [field for field in requested.split(',') if field]
+            unknown = [field for field in requested if field not in fields]
+            if unknown:
+                raise serializers.ValidationError({'fields': [f"Unknown fields: {', '.join(unknown)}"]})
+            fields = [field for field in fields if field in requested]
+
+        return serializer_class, fields
+
+    def prepare_list(self, notes, serializer_class, fields, snippet=None):
+        if 'snippet' in fields:
+            # SUBSTRING only detoasts the leading slice of a large body
+            notes = notes.annotate(snippet=snippet or Substr('content', 1, settings.NOTES_SNIPPET_LENGTH))
+        return note_values(notes, fields)
+
+    def visible_notes(self, request):
+        """
+        Notes the requesting user owns or that are shared with them.
+        """
+        return visible_to(request.user)
+
+    def search(self, request, text):
+        """
+        Notes visible to the requesting user that match ``text``, best first.
+
+        ``text`` is parsed like a web search box (quoted phrases, ``or``,
+        ``-word``). Visibility and the rank threshold are filtered in SQL, so
+        only the caller's matches are ranked and sorted. Cover density
+        ranking is used because plain ``ts_rank`` scores any query with an
+        excluded word close to zero.
+        """
+        query = SearchQuery(text, config=SEARCH_CONFIG, search_type='websearch')
+        return self.visible_notes(request).filter(search_vector=query).annotate(
+            rank=SearchRank(F('search_vector'), query, cover_density=True)
+        ).filter(rank__gte=settings.NOTES_SEARCH_MIN_RANK).order_by('-rank', '-id'), query
+
+    def headline(self, query):
+        """
+        ``ts_headline`` excerpt of the content around the matched terms.
+        Postgres evaluates it after the sort and limit, for the page's rows only.
+        """
+        return SearchHeadline(
+            'content', query, config=SEARCH_CONFIG,
+            max_words=settings.NOTES_SEARCH_HEADLINE_WORDS,
+            min_words=settings.NOTES_SEARCH_HEADLINE_WORDS // 2,
+        )
+
+    def search_page(self, request, ids, query, serializer_class, fields):
+        """
+        Load the notes of a cached page of search results by id. The ranked
+        order is restored by the caller with ``order_by_ids``.
+        """
+        notes = self.visible_notes(request).filter(id__in=ids)
+        return self.prepare_list(notes, serializer_class, fields, snippet=self.headline(query))
+
+
+class NotesAPI(NoteListMixin, APIView):
     permission_classes = [IsAuthenticated]
     authentication_classes = [TokenAuthentication]
-    # throttle_scope = "low"
+    pagination_class = NoteCursorPagination
+    throttle_scope = "low"
 
     # View Notes
     def get(self, request):
         try:
-            print(request.user)
-            notes = Note.objects.filter(owner=request.user)
-            serializer = NoteSerializer(notes, many=True)
-            return Response(serializer.data)
+            serializer_class, fields = self.get_list_fields(request)
+        except serializers.ValidationError as e:
+            return Response(e.detail, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            def build():
+                notes = self.prepare_list(Note.objects.filter(owner=request.user), serializer_class, fields)
+                paginator = self.pagination_class()
+                page = paginator.paginate_queryset(notes, request, view=self)
+                return paginator.get_paginated_response(note_data(page, fields)).data
+
+            # The versioned cache key doubles as the listing's validator
+            cache_key = listing_cache_key(request, 'list')
+            etag = listing_etag(cache_key)
+            if if_none_match(request, etag):
+                return Response(status=status.HTTP_304_NOT_MODIFIED, headers={'ETag': etag})
+
+            # Served from the per-user versioned cache when nothing changed
+            data = get_or_build(cache_key, build)
+            return Response(data, headers={'ETag': etag})
         except Exception as e:
             return Response({'detail': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
     
@@ -100,23 +265,137 @@ class NotesAPI(APIView):
 
         # Serializer check
         if serializer.is_valid():
-            serializer.save()
-            return Response(serializer.data, status=status.HTTP_201_CREATED)
+            note = serializer.save()
+            bump_notes_version({note.owner_id, *(user.id for user in serializer.validated_data.get('shared_with', []))})
+            return Response(serializer.data, status=status.HTTP_201_CREATED,
+                            headers={'ETag': note_etag(note.id, note.revision)})
 
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
     
 
+class NoteFeedAPI(NoteListMixin, APIView):
+    permission_classes = [IsAuthenticated]
+    authentication_classes = [TokenAuthentication]
+    pagination_class = NoteFeedPagination
+    throttle_scope = "low"
+    scopes = ('all', 'owned', 'shared')
+
+    # View own and shared notes together
+    def get(self, request):
+        scope = request.query_params.get('scope', 'all')
+        if scope not in self.scopes:
+            return Response({"detail": f"scope must be one of: {', '.join(self.scopes)}"},
+                            status=status.HTTP_400_BAD_REQUEST)
+        try:
+            serializer_class, fields = self.get_list_fields(request)
+        except serializers.ValidationError as e:
+            return Response(e.detail, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            def build():
+                notes = self.prepare_list(Note.objects.all(), serializer_class, fields)
+                paginator = self.pagination_class()
+                page = paginator.paginate_feed(notes, self.feed_sources(request, scope), request, view=self)
+                return paginator.get_paginated_response(note_data(page, fields)).data
+
+            # Sharing changes bump the recipients' versions as well, so the
+            # feed is cached like the owner's listing
+            cache_key = listing_cache_key(request, 'feed')
+            etag = listing_etag(cache_key)
+            if if_none_match(request, etag):
+                return Response(status=status.HTTP_304_NOT_MODIFIED, headers={'ETag': etag})
+
+            data = get_or_build(cache_key, build)
+            return Response(data, headers={'ETag': etag})
+        except Exception as e:
+            return Response({'detail': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+    def feed_sources(self, request, scope):
+        """
+        The ``(queryset, field)`` sources of note ids for ``scope``: owned
+        notes from the ``(owner_id, id)`` index and shared ones from the
+        ``(user_id, note_id)`` index of the ``shared_with`` table.
+        """
+        sources = []
+        if scope in ('all', 'owned'):
+            sources.append((Note.objects.filter(owner=request.user), 'id'))
+        if scope in ('all', 'shared'):
+            sources.append((Note.shared_with.through.objects.filter(user_id=request.user.id), 'note_id'))
+        return sources
+
+
+class NoteSyncAPI(APIView):
+    permission_classes = [IsAuthenticated]
+    authentication_classes = [TokenAuthentication]
+    throttle_scope = "low"
+    # Changes are read on the primary; loading them from a lagging replica
+    # would skip notes the returned cursor has already moved past
+    use_primary = True
+
+    # Sync changes since a cursor
+    def get(self, request):
+        cursor = request.query_params.get('cursor')
+        try:
+            page_size = min(int(request.query_params.get('page_size', settings.NOTES_SYNC_PAGE_SIZE)),
+                            settings.NOTES_MAX_PAGE_SIZE)
+        except ValueError:
+            return Response({"detail": "page_size must be an integer"}, status=status.HTTP_400_BAD_REQUEST)
+        if page_size < 1:
+            return Response({"detail": "page_size must be positive"}, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            position = decode_cursor(cursor) if cursor else None
+        except ValueError as e:
+            return Response({"detail": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        except CursorExpired:
+            return Response({"detail": "Sync cursor has expired, sync again without a cursor"},
+                            status=status.HTTP_410_GONE)
+
+        # One extra change tells whether the client should ask again
+        changes, settled = changes_since(request.user, position, page_size + 1)
+        page = changes[:page_size]
+        ids = [note_id for deleted, note_id, _ in page if not deleted]
+
+        # A note changed again since is sent as it is now, and again on the
+        # next sync; one that is gone since will come as a tombstone
+        notes = visible_to(request.user).filter(id__in=ids).prefetch_related(
+            Prefetch('shared_with', queryset=User.objects.only('id').order_by('id'))
+        )
+        has_more = len(changes) > page_size
+        if page:
+            position = (page[-1][2], page[-1][1])
+        if not has_more:
+            # A caught-up client moves on to the settled time, so an idle
+            # client's cursor does not expire with the tombstones
+            position = max(position or (settled, 0), (settled, 0))
+        return Response({
+            'notes': NoteSyncSerializer(order_by_ids(notes, ids), many=True).data,
+            'deleted': [note_id for deleted, note_id, _ in page if deleted],
+            'cursor': encode_cursor(*position),
+            'has_more': has_more,
+        })
+
+
 class NoteDetailAPI(APIView):
     permission_classes = [IsAuthenticated]
     authentication_classes = [TokenAuthentication]
-    # throttle_scope = "high"
+    throttle_scope = "high"
 
     # View Note
     def get(self, request, id):
         try:
-            note = Note.objects.get(id=id, owner=request.user)
+            # Answer conditional requests from the revision column alone
+            # Notes shared with the user are readable; writes stay owner only
+            notes = visible_to(request.user)
+            if request.headers.get('If-None-Match'):
+                revision = notes.values_list('revision', flat=True).get(id=id)
+                etag = note_etag(id, revision)
+                if if_none_match(request, etag):
+                    return Response(status=status.HTTP_304_NOT_MODIFIED, headers={'ETag': etag})
+
+            note = notes.get(id=id)
             serializer = NoteSerializer(note)
-            return Response(serializer.data)
+            return Response(serializer.data, headers={'ETag': note_etag(note.id, note.revision)})
         
         # If note is not found.
         except Note.DoesNotExist:
@@ -129,14 +408,23 @@ class NoteDetailAPI(APIView):
     # Update Note
     def put(self, request, id):
         try:
-            note = Note.objects.get(id=id, owner=request.user)
-            serializer = NoteSerializer(note, data=request.data, partial=True)
+            # Failures leave the atomic block, so partial writes roll back
+            with transaction.atomic():
+                # Lock the row so an If-Match check and the write are atomic
+                note = Note.objects.select_for_update().get(id=id, owner=request.user)
+                if if_match_fails(request, note_etag(note.id, note.revision)):
+                    return Response({"detail": "Note has been modified"}, status=status.HTTP_412_PRECONDITION_FAILED)
+
+                serializer = NoteSerializer(note, data=request.data, partial=True)
 
-            if serializer.is_valid():
-                serializer.save()
-                return Response(serializer.data)
-            
-            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+                if serializer.is_valid():
+                    audience = note_audience([note.id])
+                    serializer.save()
+                    bump_notes_version(audience | note_audience([note.id]))
+                    note.refresh_from_db(fields=['revision'])
+                    return Response(serializer.data, headers={'ETag': note_etag(note.id, note.revision)})
+
+                return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
         
         # If note is not found.
         except Note.DoesNotExist:
@@ -149,9 +437,16 @@ class NoteDetailAPI(APIView):
     # Delete Note
     def delete(self, request, id):
         try:
-            note = Note.objects.get(id=id, owner=request.user)
-            note.delete()
-            return Response({"detail": "Note deleted successfully"}, status=status.HTTP_204_NO_CONTENT)
+            with transaction.atomic():
+                # Deleting needs neither the content nor a detoasted copy of it
+                note = Note.objects.select_for_update().only('id', 'revision').get(id=id, owner=request.user)
+                if if_match_fails(request, note_etag(note.id, note.revision)):
+                    return Response({"detail": "Note has been modified"}, status=status.HTTP_412_PRECONDITION_FAILED)
+
+                audience = note_audience([note.id])
+                note.delete()
+                bump_notes_version(audience)
+                return Response({"detail": "Note deleted successfully"}, status=status.HTTP_204_NO_CONTENT)
         
         # If note is not found.
         except Note.DoesNotExist:
@@ -164,19 +459,20 @@ class NoteDetailAPI(APIView):
 class NoteShareAPI(APIView):
     permission_classes = [IsAuthenticated]
     authentication_classes = [TokenAuthentication]
-    # throttle_scope = "low"
+    throttle_scope = "low"
 
     # Share Note
     def post(self, request, id):
         
         try:
-            note = Note.objects.get(id=id, owner=request.user)
+            note = Note.objects.only('id', 'owner_id').get(id=id, owner=request.user)
             user_to_share_with_id = request.data.get('user_to_share_with')
 
             if user_to_share_with_id is not None:
                 user_to_share_with = User.objects.get(id=user_to_share_with_id)
                 note.shared_with.add(user_to_share_with)
-                note.save()
+                # Everyone who sees the note gets the new shared_with
+                bump_notes_version(note_audience([note.id]))
 
                 return Response({"detail": "Note shared successfully"}, status=status.HTTP_200_OK)
             # If user_to_share_with is not provided.
@@ -196,22 +492,456 @@ class NoteShareAPI(APIView):
             return Response({"detail": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
 
-class NoteSearchAPI(APIView):
+class NoteExportAPI(APIView):
+    permission_classes = [IsAuthenticated]
+    authentication_classes = [TokenAuthentication]
+    throttle_scope = "low"
+
+    # Export all notes as NDJSON
+    def get(self, request):
+        chunk_size = settings.NOTES_EXPORT_CHUNK_SIZE
+        notes = Note.objects.filter(owner=request.user).order_by('id')
+        compress = accepts_gzip(request.headers.get('Accept-Encoding', ''))
+
+        if isinstance(request._request, ASGIRequest):
+            # ASGI servers would read a sync iterator into a list before
+            # sending anything, so they get an async one
+            chunks = self.andjson_chunks(notes, chunk_size)
+            if compress:
+                chunks = self.agzip_chunks(chunks)
+        else:
+            # iterator() reads through a server-side cursor, chunk_size rows
+            # (and their shared_with ids) at a time, so memory stays flat
+            chunks = self.ndjson_chunks(notes.prefetch_related(
+                Prefetch('shared_with', queryset=User.objects.only('id').order_by('id'))
+            ).iterator(chunk_size=chunk_size), chunk_size)
+            if compress:
+                chunks = self.gzip_chunks(chunks)
+
+        response = StreamingHttpResponse(chunks, content_type='application/x-ndjson')
+        response['Content-Disposition'] = 'attachment; filename="notes.ndjson"'
+        response['Vary'] = 'Accept-Encoding'
+        if compress:
+            response['Content-Encoding'] = 'gzip'
+        return response
+
+    def ndjson_chunks(self, notes, chunk_size):
+        serializer = NoteSerializer()
+        lines = []
+        for note in notes:
+            lines.append(ndjson_line(serializer.to_representation(note)))
+            if len(lines) == chunk_size:
+                yield ('\n'.join(lines) + '\n').encode()
+                lines = []
+        if lines:
+            yield ('\n'.join(lines) + '\n').encode()
+
+    async def andjson_chunks(self, notes, chunk_size):
+        # aiterator() cannot follow prefetch_related() in this Django version;
+        # values() rows carry the shared_with ids and render the same lines
+        fields = list(NoteSerializer().fields)
+        lines = []
+        async for row in note_values(notes, fields).aiterator(chunk_size=chunk_size):
+            lines.append(ndjson_line(note_data([row], fields)[0]))
+            if len(lines) == chunk_size:
+                yield ('\n'.join(lines) + '\n').encode()
+                lines = []
+        if lines:
+            yield ('\n'.join(lines) + '\n').encode()
+
+    def gzip_chunks(self, chunks):
+        compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+        for chunk in chunks:
+            # A sync flush emits every chunk right away instead of buffering
+            yield compressor.compress(chunk) + compressor.flush(zlib.Z_SYNC_FLUSH)
+        yield compressor.flush()
+
+    async def agzip_chunks(self, chunks):
+        compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+        async for chunk in chunks:
+            yield compressor.compress(chunk) + compressor.flush(zlib.Z_SYNC_FLUSH)
+        yield compressor.flush()
+
+
+class NoteImportAPI(APIView):
+    permission_classes = [IsAuthenticated]
+    authentication_classes = [TokenAuthentication]
+    throttle_scope = "low"
+
+    # Import notes from an NDJSON request body
+    def post(self, request):
+        # Read the raw body line by line rather than through request.data, so
+        # the upload is never parsed into memory as a whole
+        if request.stream is None:
+            return Response({"detail": "Please provide NDJSON notes in the request body"}, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            report = import_notes(request.stream, request.user)
+            if 'error' in report:
+                # What was imported before the failure stays imported
+                return Response({"detail": report['error']['detail'], **report},
+                                status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+            return Response(report, status=status.HTTP_200_OK)
+
+        # If any other exception occurs.
+        except Exception as e:
+            return Response({"detail": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+
+class NoteBulkShareAPI(APIView):
+    permission_classes = [IsAuthenticated]
+    authentication_classes = [TokenAuthentication]
+    throttle_scope = "low"
+
+    # Share many notes with many users
+    def post(self, request):
+        return self.change_shares(request, SHARE_SQL)
+
+    # Stop sharing many notes with many users
+    def delete(self, request):
+        return self.change_shares(request, UNSHARE_SQL)
+
+    def change_shares(self, request, sql):
+        id_list = serializers.ListField(child=serializers.IntegerField(), allow_empty=False,
+                                        max_length=settings.NOTES_BATCH_MAX_OPERATIONS)
+        errors = {}
+        ids = {}
+        for field in ('notes', 'users'):
+            try:
+                ids[field] = list(dict.fromkeys(id_list.run_validation(request.data.get(field))))
+            except serializers.ValidationError as e:
+                errors[field] = e.detail
+        if errors:
+            return Response(errors, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            # One query each to check ownership and that the users exist
+            notes = set(Note.objects.filter(owner=request.user, id__in=ids['notes']).values_list('id', flat=True))
+            users = set(User.objects.filter(id__in=ids['users']).values_list('id', flat=True))
+            missing_notes = [note_id for note_id in ids['notes'] if note_id not in notes]
+            missing_users = [user_id for user_id in ids['users'] if user_id not in users]
+            if missing_notes or missing_users:
+                return Response({
+                    "detail": "Notes or users not found",
+                    "notes": missing_notes,
+                    "users": missing_users,
+                }, status=status.HTTP_404_NOT_FOUND)
+
+            # A single INSERT ... ON CONFLICT DO NOTHING (or DELETE) over every
+            # note/user pair, returning only the rows it actually changed
+            with connection.cursor() as cursor:
+                cursor.execute(sql.format(table=Note.shared_with.through._meta.db_table),
+                               [ids['notes'], ids['users']])
+                changed = [{'note': note_id, 'user': user_id} for note_id, user_id in cursor.fetchall()]
+
+            # Users still sharing a changed note see its new shared_with too;
+            # unshared users are no longer part of its audience
+            bump_notes_version({request.user.id, *(row['user'] for row in changed)}
+                               | note_audience({row['note'] for row in changed}))
+            return Response({
+                'changed': changed,
+                'unchanged': len(notes) * len(users) - len(changed),
+            }, status=status.HTTP_200_OK)
+
+        # If any other exception occurs.
+        except Exception as e:
+            return Response({"detail": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+
+class NoteBatchAPI(APIView):
+    permission_classes = [IsAuthenticated]
+    authentication_classes = [TokenAuthentication]
+    throttle_scope = "low"
+
+    # Fetch many notes by id
+    def get(self, request):
+        try:
+            ids = [int(note_id) for note_id in request.query_params.get('ids', '').split(',') if note_id]
+        except ValueError:
+            return Response({"detail": "ids must be a comma separated list of note ids"}, status=status.HTTP_400_BAD_REQUEST)
+
+        if not ids:
+            return Response({"detail": "Please provide ids"}, status=status.HTTP_400_BAD_REQUEST)
+        if len(ids) > settings.NOTES_BATCH_MAX_OPERATIONS:
+            return Response({"detail": f"At most {settings.NOTES_BATCH_MAX_OPERATIONS} ids are allowed"}, status=status.HTTP_400_BAD_REQUEST)
+
+        notes = Note.objects.filter(owner=request.user, id__in=ids).prefetch_related(
+            Prefetch('shared_with', queryset=User.objects.only('id').order_by('id'))
+        )
+        results = NoteSerializer(notes, many=True).data
+        found = {note['id'] for note in results}
+        return Response({
+            'results': results,
+            'missing': [note_id for note_id in ids if note_id not in found],
+        })
+
+    # Create, update and delete many notes in one transaction
+    def post(self, request):
+        creates = request.data.get('create', [])
+        updates = request.data.get('update', [])
+        deletes = request.data.get('delete', [])
+
+        if not all(isinstance(operations, list) for operations in (creates, updates, deletes)):
+            return Response({"detail": "create, update and delete must be lists"}, status=status.HTTP_400_BAD_REQUEST)
+        if len(creates) + len(updates) + len(deletes) > settings.NOTES_BATCH_MAX_OPERATIONS:
+            return Response({"detail": f"At most {settings.NOTES_BATCH_MAX_OPERATIONS} operations are allowed"}, status=status.HTTP_400_BAD_REQUEST)
+
+        context = {'request': request}
+        create_serializer = NoteBatchCreateSerializer(data=creates, many=True, context=context)
+        update_serializer = NoteBatchUpdateSerializer(data=updates, many=True, partial=True, context=context)
+        delete_serializer = serializers.ListField(child=serializers.IntegerField())
+
+        errors = {}
+        if not create_serializer.is_valid():
+            errors['create'] = create_serializer.errors
+        if not update_serializer.is_valid():
+            errors['update'] = update_serializer.errors
+        try:
+            deletes = delete_serializer.run_validation(deletes)
+        except serializers.ValidationError as e:
+            errors['delete'] = e.detail
+        if errors:
+            return Response(errors, status=status.HTTP_400_BAD_REQUEST)
+
+        # Check every referenced user exists with a single query
+        creates, updates = create_serializer.validated_data, update_serializer.validated_data
+        user_ids = {user_id for item in creates + updates for user_id in item.get('shared_with', [])}
+        existing = set(User.objects.filter(id__in=user_ids).values_list('id', flat=True))
+        for operation, items in (('create', creates), ('update', updates)):
+            item_errors = []
+            for item in items:
+                missing = [user_id for user_id in item.get('shared_with', []) if user_id not in existing]
+                item_errors.append({'shared_with': [f'Invalid pk "{user_id}" - object does not exist.' for user_id in missing]} if missing else {})
+            if any(item_errors):
+                errors[operation] = item_errors
+        if errors:
+            return Response(errors, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            with transaction.atomic():
+                results = self.apply(request.user, creates, updates, deletes)
+            return Response(results)
+
+        # If any other exception occurs.
+        except Exception as e:
+            return Response({"detail": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+    def apply(self, user, creates, updates, deletes):
+        Through = Note.shared_with.through
+
+        # Ownership is enforced in SQL: ids the user does not own never load
+        deleted_ids = set(Note.objects.filter(owner=user, id__in=deletes).values_list('id', flat=True))
+        notes = Note.objects.select_for_update().filter(owner=user, id__in=[item['id'] for item in updates]).exclude(id__in=deleted_ids).in_bulk()
+        audience = note_audience([*notes, *deleted_ids])
+
+        # Updates: one bulk UPDATE plus one replace of the affected shared_with rows
+        fields, shared_with = set(), {}
+        for item in updates:
+            note = notes.get(item['id'])
+            if note is None:
+                continue
+            for field in ('title', 'content'):
+                if field in item:
+                    setattr(note, field, item[field])
+                    fields.add(field)
+            if 'shared_with' in item:
+                shared_with[note.id] = item['shared_with']
+        if fields:
+            Note.objects.bulk_update(notes.values(), sorted(fields))
+
+        # Deletes: one DELETE ... WHERE id IN for the notes and their shares
+        if deleted_ids:
+            Note.objects.filter(id__in=deleted_ids).delete()
+
+        # Creates: one INSERT for the notes and one for their shares
+        created = Note.objects.bulk_create([
+            Note(owner=user, title=item['title'], content=item.get('content', '')) for item in creates
+        ])
+        for note, item in zip(created, creates):
+            if item.get('shared_with'):
+                shared_with[note.id] = item['shared_with']
+
+        if shared_with:
+            Through.objects.filter(note_id__in=shared_with).delete()
+            Through.objects.bulk_create([
+                Through(note_id=note_id, user_id=user_id)
+                for note_id, user_ids in shared_with.items() for user_id in set(user_ids)
+            ])
+
+        touched = [note.id for note in created] + list(notes)
+        data = {note['id']: note for note in NoteSerializer(
+            Note.objects.filter(id__in=touched).prefetch_related(
+                Prefetch('shared_with', queryset=User.objects.only('id').order_by('id'))
+            ),
+            many=True,
+        ).data}
+        bump_notes_version({user.id} | audience | note_audience(touched))
+
+        return {
+            'create': [{'status': status.HTTP_201_CREATED, 'note': data[note.id]} for note in created],
+            'update': [
+                {'id': item['id'], 'status': status.HTTP_200_OK, 'note': data[item['id']]}
+                if item['id'] in notes else
+                {'id': item['id'], 'status': status.HTTP_404_NOT_FOUND, 'detail': "Note not found"}
+                for item in updates
+            ],
+            'delete': [
+                {'id': note_id, 'status': status.HTTP_204_NO_CONTENT}
+                if note_id in deleted_ids else
+                {'id': note_id, 'status': status.HTTP_404_NOT_FOUND, 'detail': "Note not found"}
+                for note_id in deletes
+            ],
+        }
+
+
+class NoteAutocompleteAPI(NoteListMixin, APIView):
     permission_classes = [IsAuthenticated]
     authentication_classes = [TokenAuthentication]
+    # Called on every keystroke, so it shares the generous detail rate
+    throttle_scope = "high"
 
+    # Suggest note titles for a prefix
     def get(self, request):
-        query = request.query_params.get('q', '')
+        prefix = normalize_query(request.query_params.get('q', ''))
+        try:
+            limit = min(int(request.query_params.get('limit', settings.NOTES_AUTOCOMPLETE_LIMIT)),
+                        settings.NOTES_AUTOCOMPLETE_MAX_LIMIT)
+        except ValueError:
+            return Response({"detail": "limit must be an integer"}, status=status.HTTP_400_BAD_REQUEST)
+
+        # Very short prefixes match most titles and are not worth a query
+        if len(prefix) < settings.NOTES_AUTOCOMPLETE_MIN_LENGTH or limit < 1:
+            return Response({'results': []})
+
+        def build():
+            # Candidates come from the trigram index: word similarity matches
+            # any prefix of three or more letters of a title word as well as
+            # misspellings. Exact prefixes are then ranked first.
+            notes = self.visible_notes(request).filter(
+                title__trigram_word_similar=prefix,
+            ).annotate(
+                starts=ExpressionWrapper(Q(title__istartswith=prefix), output_field=BooleanField()),
+                similarity=TrigramWordSimilarity(prefix, 'title'),
+            ).order_by('-starts', '-similarity', '-id')
+            return list(notes.values('id', 'title')[:limit])
+
+        results = get_or_build(
+            autocomplete_cache_key(request.user.id, prefix, limit), build,
+            timeout=settings.NOTES_AUTOCOMPLETE_CACHE_TIMEOUT,
+        )
+        return Response({'results': results})
+
+
+class NoteSearchAPI(NoteListMixin, APIView):
+    permission_classes = [IsAuthenticated]
+    authentication_classes = [TokenAuthentication]
+    pagination_class = NoteSearchPagination
+    throttle_scope = "low"
+
+    # Search own and shared notes
+    def get(self, request):
+        query = normalize_query(request.query_params.get('q', ''))
 
         if query:
-            # Use PostgreSQL Full Text Search for efficient searching
-            vector = SearchVector("title", "content")
-            query = SearchQuery(query)
-            notes = Note.objects.annotate(rank=SearchRank(vector, query)).order_by('-rank')
-            # notes = Note.objects.annotate(rank=SearchRank(F('search_vector'), SearchQuery(query))).filter(
-            #     rank__gte=0.3
-            # ).order_by('-rank')
-            serializer = NoteSerializer(notes, many=True)
-            return Response(serializer.data)
+            try:
+                # Results carry a highlighted snippet unless ?view=full
+                serializer_class, fields = self.get_list_fields(request, default_view='summary')
+            except serializers.ValidationError as e:
+                return Response(e.detail, status=status.HTTP_400_BAD_REQUEST)
+
+            notes, search_query = self.search(request, query)
+            paginator = self.pagination_class()
+            page = paginator.get_page_queryset(notes.values_list('id', flat=True), request, view=self)
+
+            # Only the ranked ids of the page are cached; the notes are loaded
+            # fresh, so ?fields= and ?view= share one entry
+            ids = get_or_build(
+                search_cache_key(request.user.id, query, paginator.limit, paginator.offset),
+                lambda: list(page), timeout=settings.NOTES_SEARCH_CACHE_TIMEOUT,
+            )
+            ids = paginator.set_page(ids)
+            notes = order_by_ids(self.search_page(request, ids, search_query, serializer_class, fields), ids)
+            return paginator.get_paginated_response(note_data(notes, fields))
         else:
             return Response({"detail": "Please provide a search query"}, status=status.HTTP_400_BAD_REQUEST)
+
+
+def visible_to(user):
+    """
+    Notes ``user`` owns or that are shared with them.
+    """
+    shared = Note.shared_with.through.objects.filter(user_id=user.id).values('note_id')
+    return Note.objects.filter(Q(owner=user) | Q(id__in=shared))
+
+
+def ndjson_line(data):
+    return json.dumps(data, ensure_ascii=False, separators=(',', ':'))
+
+
+def accepts_gzip(accept_encoding):
+    """
+    Whether an ``Accept-Encoding`` header accepts gzip: listed (or ``*``,
+    when gzip is not listed) with a non-zero q-value.
+    """
+    qualities = {}
+    for coding in accept_encoding.split(','):
+        name, *params = [part.strip() for part in coding.split(';')]
+        quality = 1.0
+        for param in params:
+            key, _, value = param.partition('=')
+            if key.strip().lower() == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        if name:
+            qualities[name.lower()] = quality
+    for name in ('gzip', 'x-gzip', '*'):
+        if name in qualities:
+            return qualities[name] > 0
+    return False
+
+
+def normalize_query(text):
+    """
+    Collapse whitespace and case, which do not change what a search matches.
+    """
+    return ' '.join(text.split()).lower()
+
+
+def order_by_ids(notes, ids):
+    """
+    Sort ``notes``, instances or ``values()`` rows, into the order of ``ids``.
+    """
+    position = {note_id: index for index, note_id in enumerate(ids)}
+    return sorted(notes, key=lambda note: position[note['id'] if isinstance(note, dict) else note.id])
+
+
+class ProfileListAPI(APIView):
+    permission_classes = [IsAdminUser]
+    authentication_classes = [TokenAuthentication]
+
+    # List stored request profiles, newest first
+    def get(self, request):
+        profiles = []
+        for profile_id in profile_store.ids():
+            try:
+                profile = profile_store.load(profile_id)
+            except FileNotFoundError:
+                continue
+            profiles.append({field: profile[field] for field in (
+                'id', 'route', 'method', 'path', 'status', 'reason', 'started_at', 'duration_ms',
+            )} | {'queries': len(profile['sql'])})
+        return Response(profiles)
+
+
+class ProfileDetailAPI(APIView):
+    permission_classes = [IsAdminUser]
+    authentication_classes = [TokenAuthentication]
+
+    # View one request profile
+    def get(self, request, profile_id):
+        try:
+            return Response(profile_store.load(profile_id))
+        except FileNotFoundError:
+            return Response({"detail": "Profile not found"}, status=status.HTTP_404_NOT_FOUND)